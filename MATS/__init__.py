@@ -21,7 +21,7 @@ from .generate_fitparam_file import Generate_FitParam_File
 from .fit_dataset import Fit_DataSet
 from .utilities import add_to_HITRANstyle_isotope_list
 from .linelistdata import linelistdata
-from .o2_cia_karman import o2_cia_karman_model
+from .o2_cia_karman import o2_cia_karman_model, KarmanCIA
 
 try:
     import pkg_resources
@@ -1,23 +1,162 @@
 #Import Packages
 # from .Utilities import *
-from bisect import bisect
 import re
+import copy
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
 
 import numpy as np
 import pandas as pd
-from scipy.interpolate import RegularGridInterpolator
-from .hapi import ISO, PYTIPS2017, PYTIPS2011, PYTIPS2021, pcqsdhc
-from .utilities import molecularMass, etalon, convolveSpectrumSame
+from scipy.sparse import lil_matrix
+from scipy.optimize import lsq_linear, least_squares
+from .hapi import ISO, PYTIPS2017, PYTIPS2011, PYTIPS2021
+from .utilities import molecularMass, convolveSpectrumSame, partition_function, load_compressability_table
 from .codata import CONSTANTS
 from .o2_cia_karman import o2_cia_karman_model
+from .lineshape import cross_section_batch, LineArrays
 
 from lmfit import Minimizer,  Parameters
 
 
+def _isotope_properties(linelist, T, Tref, TIPS, isotope_list, natural_abundance, abundance_ratio_MI):
+    """Gets the partition function at T and Tref, the molecular mass, and the abundance ratio of each line in a LineArrays object.
+
+    The values are looked-up once for each isotope in the line list (with the partition functions memoized by partition_function) and gathered to the lines through the isotope index.
+    """
+    SigmaT = np.asarray([partition_function(TIPS, molec, iso, T) for molec, iso in linelist.isotopes], dtype = float)
+    SigmaTref = np.asarray([partition_function(TIPS, molec, iso, Tref) for molec, iso in linelist.isotopes], dtype = float)
+    m = np.asarray([molecularMass(molec,iso, isotope_list = isotope_list) for molec, iso in linelist.isotopes], dtype = float) #* 1.66053873e-27 * 1000 #cmassmol and kg conversion
+    if ( natural_abundance == False) and abundance_ratio_MI != {}:
+        abun_ratio = np.asarray([abundance_ratio_MI[molec][iso] for molec, iso in linelist.isotopes], dtype = float)
+    else:
+        abun_ratio = np.ones(len(linelist.isotopes))
+    isotope_index = linelist.isotope_index
+    return SigmaT[isotope_index], SigmaTref[isotope_index], m[isotope_index], abun_ratio[isotope_index]
+
+def _diluent_line_parameters(linelist, Diluent, p, T, pref, Tref):
+    """Calculates the line parameters at experimental conditions as the composition weighted sum over the diluents of a LineArrays object.
+    """
+    Gamma0 = np.zeros(len(linelist))
+    Shift0 = np.zeros(len(linelist))
+    Gamma2 = np.zeros(len(linelist))
+    Shift2 = np.zeros(len(linelist))
+    NuVC = np.zeros(len(linelist))
+    Eta = np.zeros(len(linelist))
+    Y = np.zeros(len(linelist))
+    for species in Diluent:
+        abun = Diluent[species]['composition']
+        row = linelist.diluent_row(species)
+        #Gamma0: pressure broadening coefficient HWHM
+        Gamma0 += abun*(linelist.gamma0[row]*(p/pref)*((Tref/T)**linelist.n_gamma0[row]))
+        #Delta0
+        Shift0 += abun*((linelist.delta0[row] + linelist.n_delta0[row]*(T-Tref))*p/pref)
+        #Gamma2
+        Gamma2 += abun*(linelist.SD_gamma[row]*linelist.gamma0[row]*(p/pref)*((Tref/T)**linelist.n_gamma2[row]))
+        #Delta2
+        Shift2 += abun*((linelist.SD_delta[row]*linelist.delta0[row] + linelist.n_delta2[row]*(T-Tref))*p/pref)
+        #nuVC
+        NuVC += abun*(linelist.nuVC[row]*(p/pref)*((Tref/T)**(linelist.n_nuVC[row])))
+        #eta
+        Eta += linelist.eta[row] *abun
+        #Line mixing
+        Y += abun*(linelist.y[row]*(p/pref)*((Tref/T)**(linelist.n_y[row])))
+    return Gamma0, Shift0, Gamma2, Shift2, NuVC, Eta, Y
+
+def _line_cutoff(Gamma0, GammaD, wing_cutoff, wing_wavenumbers, wing_method):
+    """Calculates the half-width of the simulation window of each line, as wing_cutoff voigt half-widths or wing_wavenumbers.
+    """
+    if wing_method == 'wing_cutoff':
+        return (0.5346*Gamma0 + (0.2166*Gamma0**2 + GammaD**2)**0.5)*wing_cutoff
+    return np.full(len(Gamma0), wing_wavenumbers, dtype = float)
+
+def _alias_closure(param, aliases):
+    """Returns the parameter and all of the parameters constrained to be equal to it (expr = 'parameter name'), directly or through other aliases.
+    """
+    parameters = [param]
+    for alias in aliases.get(param, []):
+        parameters += _alias_closure(alias, aliases)
+    return parameters
+
+def _scatter_line_values(linelist, slots, vector):
+    """Sets the line parameters of a LineArrays from the parameter vector, where each slot is (attribute, row, line positions, parameter positions).
+    """
+    for attribute, row, positions, indices in slots:
+        if row == None:
+            getattr(linelist, attribute)[positions] = vector[indices]
+        else:
+            getattr(linelist, attribute)[row, positions] = vector[indices]
+
+#Constraint expressions of the form [scale*]parameter[ +/- offset], which are compiled into ties by Fit_DataSet._compile_ties
+_AFFINE_CONSTRAINT = re.compile(r'^\s*(?:(?P<scale>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*\*\s*)?(?P<sign>[-+]?)\s*(?P<source>[A-Za-z_][A-Za-z0-9_]*)'
+                                r'\s*(?:(?P<operator>[-+])\s*(?P<offset>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?))?\s*$')
+
+def _same_state(state, snapshot):
+    """Compares a (versions, arrays, settings) state of the spectra (see Fit_DataSet._model_state) with an earlier snapshot of it (see _state_snapshot), where the versions and settings are compared by value and the arrays by identity and length.
+    """
+    versions, arrays, settings = state
+    snapshot_versions, snapshot_arrays, snapshot_settings = snapshot
+    if (versions != snapshot_versions) or (arrays.keys() != snapshot_arrays.keys()):
+        return False
+    for name in arrays:
+        if (arrays[name] is not snapshot_arrays[name]) or (len(arrays[name]) != len(snapshot_arrays[name])):
+            return False
+    return settings == snapshot_settings
+
+def _state_snapshot(state):
+    """Copies a (versions, arrays, settings) state of the spectra, where the settings are deep copied, so that in place edits (ie of the Diluent composition) are found, and the arrays are kept by reference.
+    """
+    versions, arrays, settings = state
+    return versions, dict(arrays), copy.deepcopy(settings)
+
+#Simulation keyword arguments that are fixed for each spectrum, which are sent to the simulation worker processes once (see Fit_DataSet.n_workers)
+SPECTRUM_SIMULATION_KWARGS = ('isotope_list', 'natural_abundance', 'abundance_ratio_MI', 'Diluent', 'TIPS')
+#HAPI TIPS versions, which are lambda functions, so they are sent to the simulation worker processes by name (they can not be pickled for spawned workers)
+_TIPS_VERSIONS = {'PYTIPS2021': PYTIPS2021, 'PYTIPS2017': PYTIPS2017, 'PYTIPS2011': PYTIPS2011}
+#Shared memory wavenumber buffers and fixed simulation keyword arguments of the spectra in a simulation worker process
+_worker_spectra = {}
+
+def _worker_kwargs(spectrum_kwargs):
+    """Replaces the HAPI TIPS versions in the fixed simulation keyword arguments of the spectra by their names (see _TIPS_VERSIONS), so that the keyword arguments can be pickled.
+    """
+    worker_kwargs = {}
+    for spectrum_number, kwargs in spectrum_kwargs.items():
+        worker_kwargs[spectrum_number] = dict(kwargs)
+        for version in _TIPS_VERSIONS:
+            if kwargs['TIPS'] is _TIPS_VERSIONS[version]:
+                worker_kwargs[spectrum_number]['TIPS'] = version
+    return worker_kwargs
+
+def _init_simulation_worker(buffers, spectrum_kwargs):
+    """Attaches the shared memory wavenumber buffers of the spectra, given as {spectrum_number: (name, length)}, in a simulation worker process, and resolves the TIPS versions sent by name (see _worker_kwargs).
+    """
+    for spectrum_number, (name, length) in buffers.items():
+        buffer = shared_memory.SharedMemory(name = name)
+        kwargs = dict(spectrum_kwargs[spectrum_number])
+        if isinstance(kwargs['TIPS'], str):
+            kwargs['TIPS'] = _TIPS_VERSIONS[kwargs['TIPS']]
+        _worker_spectra[spectrum_number] = (buffer, np.ndarray((length,), dtype = float, buffer = buffer.buf), kwargs)
+
+def _simulate_segment(task):
+    """Simulates the lines of a spectrum segment in a simulation worker process, where the segment wavenumbers are read from the shared memory buffer of the spectrum.
+    """
+    HTP_model, linelist, spectrum_number, start, stop, x_shift, simulation_kwargs = task
+    buffer, wavenumbers, spectrum_kwargs = _worker_spectra[spectrum_number]
+    return HTP_model(linelist, wavenumbers[start:stop] + x_shift, **spectrum_kwargs, **simulation_kwargs)[1]
+
+def _close_simulation_pool(executor, buffers):
+    """Shuts down the simulation worker processes and releases the shared memory wavenumber buffers.
+    """
+    executor.shutdown()
+    for buffer in buffers:
+        buffer.close()
+        buffer.unlink()
+
 def HTP_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers = 25, wing_method = 'wing_cutoff',
                 p = 1, T = 296, molefraction = {}, isotope_list = ISO,
                 natural_abundance = True, abundance_ratio_MI = {},  Diluent = {}, diluent = 'air', IntensityThreshold = 1e-30, 
-                TIPS = PYTIPS2021, compressability_factor = 1):
+                TIPS = PYTIPS2021, compressability_factor = 1, lineshape_backend = 'numpy'):
     """Calculates the absorbance (ppm/cm) based on input line list, wavenumbers, and spectrum environmental parameters.
 
     Outline
@@ -28,18 +167,18 @@ def HTP_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers = 25,
 
     3.  Sets up Diluent dictionary if not given as input
 
-    4.  Calculates line intensity and doppler width at temperature for all lines
+    4.  Converts a dataframe line list to LineArrays and calculates line intensity and doppler width at temperature for all lines
 
     5.  Loops through each line in the line list and loops through each diluent, generating a line parameter at experimental conditions
-        that is the appropriate ratio of each diluent species corrected for pressure and temperature.  For each line, simulate the line for the given simulation cutoffs and add to cross section
+        that is the appropriate ratio of each diluent species corrected for pressure and temperature.  All lines are then simulated in vectorized batches for the given simulation cutoffs and added to the cross section (see lineshape.cross_section_batch)
 
     6.  Return wavenumber and cross section arrays
 
 
     Parameters
     ----------
-    linelist : dataframe
-        Pandas dataframe with the following column headers, where species corresponds to each diluent in the spectrum objects included in the dataset and nominal temperature corresponds to the nominal temperatures included in the dataset:
+    linelist : dataframe or LineArrays
+        LineArrays object (see lineshape.LineArrays) or Pandas dataframe with the following column headers, where species corresponds to each diluent in the spectrum objects included in the dataset and nominal temperature corresponds to the nominal temperatures included in the dataset:
             nu = wavenumber of the spectral line transition (cm-1) in vacuum
 
             sw = The spectral line intensity (cm−1/(molecule⋅cm−2)) at Tref=296K
@@ -104,6 +243,10 @@ def HTP_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers = 25,
         minimum line intensity that will be simulated. The default is 1e-30.
     TIPS : definition, optional
         selects the HAPI provided TIPS version to use for the partition function
+    compressability_factor : float, optional
+        compressability factor used to correct the molecular density. The default is 1.
+    lineshape_backend : str, optional
+        'numpy' or 'numba' (see lineshape.cross_section_batch).  The 'numba' backend requires the optional numba package and falls back to 'numpy' if it is not installed. The default is 'numpy'.
 
     Returns
     -------
@@ -118,9 +261,6 @@ def HTP_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers = 25,
     #Generate X-axis for simulation
     wavenumbers = waves
 
-    #Set Omegas to X-values
-    Xsect = [0]*len(wavenumbers)
-
     #define reference temperature/pressure and calculate molecular density
     Tref = 296. # K
     pref = 1. # atm
@@ -138,80 +278,35 @@ def HTP_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers = 25,
          elif diluent == 'self':
             Diluent = {diluent: {'composition':1, 'm':0}}
 
-    #Calculate line intensity
-    linelist['SigmaT'] = 0.0
-    linelist['SigmaTref'] = 0.0
-    linelist['GammaD'] = 0.0
-    linelist['m'] = 0.0
-    linelist['abun_ratio'] = 1.0
-    
-    
-    for molec in linelist['molec_id'].unique():
-        for iso in linelist[linelist['molec_id']==molec]['local_iso_id'].unique():
-            try:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'SigmaT'] = TIPS(molec,iso,T)
-            except:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'SigmaT'] = 1
-            try:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'SigmaTref'] = TIPS(molec,iso,Tref)
-            except:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'SigmaTref'] = 1
-            linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'm'] = molecularMass(molec,iso, isotope_list = isotope_list) #* 1.66053873e-27 * 1000 #cmassmol and kg conversion
-            if ( natural_abundance == False) and abundance_ratio_MI != {}:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'abun_ratio'] = abundance_ratio_MI[molec][iso]
-
-    #linelist['LineIntensity'] = EnvironmentDependency_Intensity(linelist['sw'],T,Tref,linelist['SigmaT'],linelist['SigmaTref'],linelist['elower'],linelist['nu'])
+    if not isinstance(linelist, LineArrays):
+        linelist = LineArrays.from_dataframe(linelist, Diluent)
 
-    linelist['LineIntensity'] = linelist['sw']*linelist['SigmaTref']/linelist['SigmaT']*(np.exp(-CONSTANTS['c2']*linelist['elower']/T)*(1-np.exp(-CONSTANTS['c2']*linelist['nu']/T)))/(np.exp(-CONSTANTS['c2']*linelist['elower']/Tref)*(1-np.exp(-CONSTANTS['c2']*linelist['nu']/Tref)))
+    #Calculate line intensity
+    SigmaT, SigmaTref, m, abun_ratio = _isotope_properties(linelist, T, Tref, TIPS, isotope_list, natural_abundance, abundance_ratio_MI)
+    sw = linelist.sw*linelist.sw_scale_factor
+    LineIntensity = sw*SigmaTref/SigmaT*(np.exp(-CONSTANTS['c2']*linelist.elower/T)*(1-np.exp(-CONSTANTS['c2']*linelist.nu/T)))/(np.exp(-CONSTANTS['c2']*linelist.elower/Tref)*(1-np.exp(-CONSTANTS['c2']*linelist.nu/Tref)))
     if isotope_list != ISO:
-        linelist.loc[(linelist['SigmaT'] == 1) & (linelist['SigmaTref'] == 1), 'LineIntensity'] = linelist[(linelist['SigmaT'] == 1) & (linelist['SigmaTref'] == 1)]['sw'].values
+        no_TIPS = (SigmaT == 1) & (SigmaTref == 1)
+        LineIntensity[no_TIPS] = sw[no_TIPS]
 
     #Calculate Doppler Broadening
-    linelist['GammaD'] = np.sqrt(2*CONSTANTS['k']*CONSTANTS['Na']*T*np.log(2)/(linelist['m'].values))*linelist['nu'] / CONSTANTS['c']
+    GammaD = np.sqrt(2*CONSTANTS['k']*CONSTANTS['Na']*T*np.log(2)/m)*linelist.nu / CONSTANTS['c']
     # Calculated Line Parameters across Broadeners
-    linelist['Gamma0'] = 0.0
-    linelist['Shift0'] = 0.0
-    linelist['Gamma2'] = 0.0
-    linelist['Shift2'] = 0.0
-    linelist['NuVC'] = 0.0
-    linelist['Eta'] = 0.0
-    linelist['Y'] = 0.0
-    for species in Diluent:
-        abun = Diluent[species]['composition']
-        #Gamma0: pressure broadening coefficient HWHM
-        linelist['Gamma0'] += abun*(linelist['gamma0_%s'%species]*(p/pref)*((Tref/T)**linelist['n_gamma0_%s'%species]))
-        #Delta0
-        linelist['Shift0'] += abun*((linelist['delta0_%s'%species] + linelist['n_delta0_%s'%species]*(T-Tref))*p/pref)
-        #Gamma2
-        linelist['Gamma2'] += abun*(linelist['SD_gamma_%s'%species]*linelist['gamma0_%s'%species]*(p/pref)*((Tref/T)**linelist['n_gamma2_%s'%species]))
-        #Delta2
-        linelist['Shift2'] += abun*((linelist['SD_delta_%s'%species]*linelist['delta0_%s'%species] + linelist['n_delta2_%s'%species]*(T-Tref))*p/pref)
-        #nuVC
-        linelist['NuVC'] += abun*(linelist['nuVC_%s'%species]*(p/pref)*((Tref/T)**(linelist['n_nuVC_%s'%species])))
-        #eta
-        linelist['Eta'] += linelist['eta_%s'%species] *abun
-        #Line mixing
-        #linelist['Y'] += abun*(linelist['y_%s'%species] *(p/pref))
-        linelist['Y'] += abun*(linelist['y_%s'%species]*(p/pref)*((Tref/T)**(linelist['n_y_%s'%species])))
+    Gamma0, Shift0, Gamma2, Shift2, NuVC, Eta, Y = _diluent_line_parameters(linelist, Diluent, p, T, pref, Tref)
 
     #Line profile simulation cut-off determination
-    if wing_method == 'wing_cutoff':
-        linelist['line cut-off'] = (0.5346*linelist['Gamma0'] + (0.2166*linelist['Gamma0']**2 + linelist['GammaD']**2)**0.5)*wing_cutoff
-    else:
-        linelist['line cut-off'] = wing_wavenumbers
+    line_cutoff = _line_cutoff(Gamma0, GammaD, wing_cutoff, wing_wavenumbers, wing_method)
 
     #Enforce  Line Intensity Simulation Threshold
-    linelist = linelist[linelist['LineIntensity']>= IntensityThreshold]
-
-    #For each line calculate spectrum and add to the global spectrum
-    for index, line in linelist.iterrows():
-        BoundIndexLower = bisect(wavenumbers, line['nu'] - line['line cut-off'])
-        BoundIndexUpper = bisect(wavenumbers, line['nu'] + line['line cut-off'])
-        lineshape_vals_real, lineshape_vals_imag = pcqsdhc(line['nu'],line['GammaD'],line['Gamma0'],line['Gamma2'],line['Shift0'],line['Shift2'],
-                                                    line['NuVC'],line['Eta'],wavenumbers[BoundIndexLower:BoundIndexUpper])
-        Xsect[BoundIndexLower:BoundIndexUpper] += mol_dens  * \
-                                                    molefraction[line['molec_id']] * line['abun_ratio'] * \
-                                                    line['LineIntensity'] * (lineshape_vals_real + line['Y']*lineshape_vals_imag)
+    simulate = LineIntensity >= IntensityThreshold
+
+    #Simulate all lines in batches and add to the global spectrum
+    molec_ids, molec_index = np.unique(linelist.molec_id[simulate], return_inverse = True)
+    line_molefraction = np.asarray([molefraction[molec] for molec in molec_ids], dtype = float)[molec_index]
+    line_strength = mol_dens * line_molefraction * abun_ratio[simulate] * LineIntensity[simulate]
+    Xsect = cross_section_batch(wavenumbers, linelist.nu[simulate], GammaD[simulate], Gamma0[simulate], Gamma2[simulate],
+                                Shift0[simulate], Shift2[simulate], NuVC[simulate], Eta[simulate],
+                                Y[simulate], line_strength, line_cutoff[simulate], backend = lineshape_backend)
 
     # Return two arrays corresponding to the wavenumber axis and the calculated cross-section
     return (wavenumbers, np.asarray(Xsect))
@@ -219,7 +314,7 @@ def HTP_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers = 25,
 def HTP_wBeta_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers = 25, wing_method = 'wing_cutoff',
                 p = 1, T = 296, molefraction = {}, isotope_list = ISO,
                 natural_abundance = True, abundance_ratio_MI = {},  Diluent = {}, diluent = 'air', IntensityThreshold = 1e-30, 
-                TIPS = PYTIPS2021, compressability_factor = 1):
+                TIPS = PYTIPS2021, compressability_factor = 1, lineshape_backend = 'numpy'):
     """Calculates the absorbance (ppm/cm) based on input line list, wavenumbers, and spectrum environmental parameters with capability of incorporating the beta correction to the Dicke Narrowing proposed in Analytical-function correction to the Hartmann–Tran profile for more reliable representation of the Dicke-narrowed molecular spectra.
 
     Outline
@@ -230,18 +325,18 @@ def HTP_wBeta_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers
 
     3.  Sets up Diluent dictionary if not given as input
 
-    4.  Calculates line intensity and doppler width at temperature for all lines
+    4.  Converts a dataframe line list to LineArrays and calculates line intensity and doppler width at temperature for all lines
 
     5.  Loops through each line in the line list and loops through each diluent, generating a line parameter at experimental conditions
-        that is the appropriate ratio of each diluent species corrected for pressure and temperature.  For each line, simulate the line for the given simulation cutoffs and add to cross section
+        that is the appropriate ratio of each diluent species corrected for pressure and temperature.  All lines are then simulated in vectorized batches for the given simulation cutoffs and added to the cross section (see lineshape.cross_section_batch)
 
     6.  Return wavenumber and cross section arrays
 
 
     Parameters
     ----------
-    linelist : dataframe
-        Pandas dataframe with the following column headers, where species corresponds to each diluent in the spectrum objects included in the dataset and nominal temperature corresponds to the nominal temperatures included in the dataset:
+    linelist : dataframe or LineArrays
+        LineArrays object (see lineshape.LineArrays) or Pandas dataframe with the following column headers, where species corresponds to each diluent in the spectrum objects included in the dataset and nominal temperature corresponds to the nominal temperatures included in the dataset:
             nu = wavenumber of the spectral line transition (cm-1) in vacuum
 
             sw = The spectral line intensity (cm−1/(molecule⋅cm−2)) at Tref=296K
@@ -305,6 +400,10 @@ def HTP_wBeta_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers
         minimum line intensity that will be simulated. The default is 1e-30.
     TIPS : definition, optional
         selects the HAPI provided TIPS version to use for the partition function
+    compressability_factor : float, optional
+        compressability factor used to correct the molecular density. The default is 1.
+    lineshape_backend : str, optional
+        'numpy' or 'numba' (see lineshape.cross_section_batch).  The 'numba' backend requires the optional numba package and falls back to 'numpy' if it is not installed. The default is 'numpy'.
     Returns
     -------
     wavenumbers : array
@@ -318,9 +417,6 @@ def HTP_wBeta_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers
     #Generate X-axis for simulation
     wavenumbers = waves
 
-    #Set Omegas to X-values
-    Xsect = [0]*len(wavenumbers)
-
     #define reference temperature/pressure and calculate molecular density
     Tref = 296. # K
     pref = 1. # atm
@@ -340,97 +436,53 @@ def HTP_wBeta_from_DF_select(linelist, waves, wing_cutoff = 25, wing_wavenumbers
 
 
 
-    #Calculate line intensity
-    linelist['SigmaT'] = 0.0
-    linelist['SigmaTref'] = 0.0
-    linelist['GammaD'] = 0.0
-    linelist['m'] = 0.0
-    linelist['abun_ratio'] = 1.0
-
-    for molec in linelist['molec_id'].unique():
-        for iso in linelist ['local_iso_id'].unique():
-            try:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'SigmaT'] = TIPS(molec,iso,T)
-            except:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'SigmaT'] = 1
-            try:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'SigmaTref'] = TIPS(molec,iso,Tref)
-            except:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'SigmaTref'] = 1
-
+    if not isinstance(linelist, LineArrays):
+        linelist = LineArrays.from_dataframe(linelist, Diluent)
 
-            linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'm'] = molecularMass(molec,iso, isotope_list = isotope_list) #* 1.66053873e-27 * 1000 #cmassmol and kg conversion
-            if (len(Diluent) == 1) & ('self' in Diluent):
-                Diluent['self']['mp'] = molecularMass(molec,iso, isotope_list = isotope_list)
-            if ( natural_abundance == False) and abundance_ratio_MI != {}:
-                linelist.loc[(linelist['molec_id']==molec) & (linelist['local_iso_id']==iso), 'abun_ratio'] = abundance_ratio_MI[molec][iso]
+    #Calculate line intensity
+    SigmaT, SigmaTref, m, abun_ratio = _isotope_properties(linelist, T, Tref, TIPS, isotope_list, natural_abundance, abundance_ratio_MI)
+    if (len(Diluent) == 1) & ('self' in Diluent) & (len(linelist) > 0):
+        Diluent['self']['mp'] = m[-1]
     # Calculate mp
     mp = 0.0
     for diluent in Diluent:
         mp += Diluent[diluent]['composition']*Diluent[diluent]['m']
 
     # Get Line Intensity
-    linelist['LineIntensity'] = linelist['sw']*linelist['SigmaTref']/linelist['SigmaT']*(np.exp(-CONSTANTS['c2']*linelist['elower']/T)*(1-np.exp(-CONSTANTS['c2']*linelist['nu']/T)))/(np.exp(-CONSTANTS['c2']*linelist['elower']/Tref)*(1-np.exp(-CONSTANTS['c2']*linelist['nu']/Tref)))
+    sw = linelist.sw*linelist.sw_scale_factor
+    LineIntensity = sw*SigmaTref/SigmaT*(np.exp(-CONSTANTS['c2']*linelist.elower/T)*(1-np.exp(-CONSTANTS['c2']*linelist.nu/T)))/(np.exp(-CONSTANTS['c2']*linelist.elower/Tref)*(1-np.exp(-CONSTANTS['c2']*linelist.nu/Tref)))
     if isotope_list != ISO:
-        linelist.loc[(linelist['SigmaT' == 1]) & (linelist['SigmaTref' == 1])] = linelist[(linelist['SigmaT' == 1]) & (linelist['SigmaTref' == 1])]['sw'].values
+        no_TIPS = (SigmaT == 1) & (SigmaTref == 1)
+        LineIntensity[no_TIPS] = sw[no_TIPS]
 
     #Calculate Doppler Broadening
-    #linelist['GammaD'] = np.sqrt(2*1.380648813E-16*T*np.log(2)/linelist['m']/2.99792458e10**2)*linelist['nu']
-    linelist['GammaD'] = np.sqrt(2*CONSTANTS['k']*CONSTANTS['Na']*T*np.log(2)/(linelist['m'].values))*linelist['nu'] / CONSTANTS['c']
+    GammaD = np.sqrt(2*CONSTANTS['k']*CONSTANTS['Na']*T*np.log(2)/m)*linelist.nu / CONSTANTS['c']
 
     # Calculated Line Parameters across Broadeners
-    linelist['Gamma0'] = 0.0
-    linelist['Shift0'] = 0.0
-    linelist['Gamma2'] = 0.0
-    linelist['Shift2'] = 0.0
-    linelist['NuVC'] = 0.0
-    linelist['Eta'] = 0.0
-    linelist['Y'] = 0.0
-    for species in Diluent:
-        abun = Diluent[species]['composition']
-        #Gamma0: pressure broadening coefficient HWHM
-        linelist['Gamma0'] += abun*(linelist['gamma0_%s'%species]*(p/pref)*((Tref/T)**linelist['n_gamma0_%s'%species]))
-        #Delta0
-        linelist['Shift0'] += abun*((linelist['delta0_%s'%species] + linelist['n_delta0_%s'%species]*(T-Tref))*p/pref)
-        #Gamma2
-        linelist['Gamma2'] += abun*(linelist['SD_gamma_%s'%species]*linelist['gamma0_%s'%species]*(p/pref)*((Tref/T)**linelist['n_gamma2_%s'%species]))
-        #Delta2
-        linelist['Shift2'] += abun*((linelist['SD_delta_%s'%species]*linelist['delta0_%s'%species] + linelist['n_delta2_%s'%species]*(T-Tref))*p/pref)
-        #nuVC
-        linelist['NuVC'] += abun*(linelist['nuVC_%s'%species]*(p/pref)*((Tref/T)**(linelist['n_nuVC_%s'%species])))
-        #eta
-        linelist['Eta'] += linelist['eta_%s'%species] *abun
-        #Line mixing
-        #linelist['Y'] += abun*(linelist['y_%s'%species]*(p/pref))
-        linelist['Y'] += abun*(linelist['y_%s'%species]*(p/pref)*((Tref/T)**(linelist['n_y_%s'%species])))
+    Gamma0, Shift0, Gamma2, Shift2, NuVC, Eta, Y = _diluent_line_parameters(linelist, Diluent, p, T, pref, Tref)
 
-    linelist['alpha'] =  mp / linelist['m']
-    linelist['Chi'] = linelist['NuVC'] / linelist['GammaD']
-    linelist['A'] = 0.0534 + 0.1585*np.exp(-0.451*linelist['alpha'].values)
-    linelist['B'] = 1.9595 - 0.1258*linelist['alpha'].values + 0.0056*linelist['alpha'].values**2 + 0.0050*linelist['alpha'].values**3
-    linelist['C'] = -0.0546 + 0.0672*linelist['alpha'].values - 0.0125*linelist['alpha'].values**2+0.0003*linelist['alpha'].values**3
-    linelist['D'] = 0.9466 - 0.1585*np.exp(-0.4510*linelist['alpha'].values)
-    linelist['Beta'] = linelist['A'].values*np.tanh(linelist['B'].values * np.log10(linelist['Chi'].values) + linelist['C'].values) + linelist['D'].values
+    alpha =  mp / m
+    Chi = NuVC / GammaD
+    A = 0.0534 + 0.1585*np.exp(-0.451*alpha)
+    B = 1.9595 - 0.1258*alpha + 0.0056*alpha**2 + 0.0050*alpha**3
+    C = -0.0546 + 0.0672*alpha - 0.0125*alpha**2+0.0003*alpha**3
+    D = 0.9466 - 0.1585*np.exp(-0.4510*alpha)
+    Beta = A*np.tanh(B * np.log10(Chi) + C) + D
 
 
     #Line profile simulation cut-off determination
-    if wing_method == 'wing_cutoff':
-        linelist['line cut-off'] = (0.5346*linelist['Gamma0'] + (0.2166*linelist['Gamma0']**2 + linelist['GammaD']**2)**0.5)*wing_cutoff
-    else:
-        linelist['line cut-off'] = wing_wavenumbers
+    line_cutoff = _line_cutoff(Gamma0, GammaD, wing_cutoff, wing_wavenumbers, wing_method)
 
     #Enforce  Line Intensity Simulation Threshold
-    linelist = linelist[linelist['LineIntensity']>= IntensityThreshold]
-
-    #For each line calculate spectrum and add to the global spectrum
-    for index, line in linelist.iterrows():
-        BoundIndexLower = bisect(wavenumbers, line['nu'] - line['line cut-off'])
-        BoundIndexUpper = bisect(wavenumbers, line['nu'] + line['line cut-off'])
-        lineshape_vals_real, lineshape_vals_imag = pcqsdhc(line['nu'],line['GammaD'],line['Gamma0'],line['Gamma2'],line['Shift0'],line['Shift2'],
-                                                    line['NuVC']*line['Beta'],line['Eta'],wavenumbers[BoundIndexLower:BoundIndexUpper])
-        Xsect[BoundIndexLower:BoundIndexUpper] += mol_dens  * \
-                                                    molefraction[line['molec_id']] * line['abun_ratio'] * \
-                                                    line['LineIntensity'] * (lineshape_vals_real + line['Y']*lineshape_vals_imag)
+    simulate = LineIntensity >= IntensityThreshold
+
+    #Simulate all lines in batches and add to the global spectrum
+    molec_ids, molec_index = np.unique(linelist.molec_id[simulate], return_inverse = True)
+    line_molefraction = np.asarray([molefraction[molec] for molec in molec_ids], dtype = float)[molec_index]
+    line_strength = mol_dens * line_molefraction * abun_ratio[simulate] * LineIntensity[simulate]
+    Xsect = cross_section_batch(wavenumbers, linelist.nu[simulate], GammaD[simulate], Gamma0[simulate], Gamma2[simulate],
+                                Shift0[simulate], Shift2[simulate], (NuVC*Beta)[simulate], Eta[simulate],
+                                Y[simulate], line_strength, line_cutoff[simulate], backend = lineshape_backend)
 
     # Return two arrays corresponding to the wavenumber axis and the calculated cross-section
     return (wavenumbers, np.asarray(Xsect))
@@ -540,6 +592,10 @@ class Fit_DataSet:
     beta_formalism : boolean, optional
     如果为 True，则在模拟模型中使用狄克收窄的贝塔修正。
         If True, then the beta correction on the Dicke narrowing is used in the simulation model.
+    lineshape_backend : str, optional
+        line shape backend used in the simulation model, either 'numpy' or 'numba' (see lineshape.cross_section_batch).  The 'numba' backend requires the optional numba package and falls back to 'numpy' if it is not installed. The default is 'numpy'.
+    n_workers : int, optional
+        If greater than 1, then the line simulations of the spectrum segments in the simulation model are dispatched to a pool of n_workers processes, with the spectrum wavenumbers in shared memory.  The pool is started at the first evaluation and can be shut down with close_pool. The default is None, which simulates the segments serially.
     """
 
     def __init__(self, dataset, base_linelist_file, param_linelist_file, CIA_linelist_file = None,
@@ -559,7 +615,7 @@ class Fit_DataSet:
                 nuVC_limit = False, nuVC_limit_factor  = 10, n_nuVC_limit = False, n_nuVC_limit_factor = 10,
                 eta_limit = False, eta_limit_factor  = 10,
                 linemixing_limit = False, linemixing_limit_factor  = 10, n_linemixing_limit = False, n_linemixing_limit_factor = 10,
-                beta_formalism = False):
+                beta_formalism = False, lineshape_backend = 'numpy', n_workers = None):
 
 
         self.dataset = dataset
@@ -619,7 +675,33 @@ class Fit_DataSet:
         self.n_linemixing_limit = n_linemixing_limit
         self.n_linemixing_limit_factor = n_linemixing_limit_factor
         self.beta_formalism = beta_formalism
+        self.lineshape_backend = lineshape_backend
+        self.n_workers = n_workers
+        self.simulation_pool = None
+        self.line_arrays = self.generate_line_arrays()
+        self.background_cache = {}
+        self.model_cache = None
+        self.varpro_cache = None
+        self.parameter_map = None
+        self.model_buffers = None
+        self.parameter_ties = None
+
+    def generate_line_arrays(self):
+        """Builds the LineArrays (see lineshape.LineArrays) representation of the parameter line list for each spectrum in the dataset, which is used by the simulation model.
+
+        NOTE: If the lineparam_list is edited after the Fit_DataSet is created, then this should be called again to update the line_arrays.  The static line backgrounds cached by the simulation model are re-simulated automatically when the line_arrays are replaced.
 
+        Returns
+        -------
+        line_arrays : dict
+            dictionary with the spectrum number as the key and the LineArrays for that spectrum as the value.
+
+        """
+        line_arrays = {}
+        for spectrum in self.dataset.spectra:
+            line_arrays[spectrum.spectrum_number] = LineArrays.from_dataframe(self.lineparam_list, spectrum.Diluent, spectrum_number = spectrum.spectrum_number,
+                                                                               sw_scale_factor = True)
+        return line_arrays
 
     def generate_params(self):
         """Generates the lmfit parameter object that will be used in fitting.
@@ -638,42 +720,16 @@ class Fit_DataSet:
         for base_param in list(self.baseline_list):
             if ('_vary' not in base_param) and ('_err' not in base_param) and ('Spectrum Number' not in base_param) and ('Segment Number' not in base_param):
                 baseline_parameters.append(base_param)
-        for index in self.baseline_list.index.values:
-            spec_num = self.baseline_list.iloc[index]['Spectrum Number']
-            seg_num = self.baseline_list.iloc[index]['Segment Number']
-            for base_param in baseline_parameters:
-                if self.baseline_list.loc[index][base_param] == 0:
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'])
-                elif ('Pressure' in base_param) and self.pressure_limit:
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'],
-                              min = (1 / self.pressure_limit_factor)*self.baseline_list.loc[index][base_param],
-                              max = self.pressure_limit_factor*self.baseline_list.loc[index][base_param])
-                elif ('Temperature' in base_param) and self.temperature_limit:
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'],
-                              min = (1 / self.temperature_limit_factor)*self.baseline_list.loc[index][base_param],
-                              max = self.temperature_limit_factor*self.baseline_list.loc[index][base_param])
-                elif ('molefraction' in base_param) and self.molefraction_limit:
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'],
-                              min = (1 / self.molefraction_limit_factor)*self.baseline_list.loc[index][base_param],
-                              max = self.molefraction_limit_factor*self.baseline_list.loc[index][base_param])
-                elif ('baseline' in base_param) and self.baseline_limit:
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'],
-                              min = (1 / self.baseline_limit_factor)*self.baseline_list.loc[index][base_param],
-                              max = self.baseline_limit_factor *self.baseline_list.loc[index][base_param])
-                elif ('etalon_' in base_param) and self.etalon_limit and ('phase' not in base_param):
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'],
-                              min = (1 / self.etalon_limit_factor )*self.baseline_list.loc[index][base_param],
-                              max = self.etalon_limit_factor *self.baseline_list.loc[index][base_param])
-                elif ('etalon_' in base_param) and self.etalon_limit and ('phase' in base_param):
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'],
-                              min = -2*np.pi, max = 2*np.pi)
-                elif ('x_shift' in base_param) and self.x_shift_limit:
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'],
-                              min = (self.baseline_list.loc[index][base_param] - self.x_shift_limit_magnitude),
-                              max = self.x_shift_limit_magnitude + self.baseline_list.loc[index][base_param])
-                else:
-                    params.add(base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)), self.baseline_list.loc[index][base_param], self.baseline_list.loc[index][base_param + '_vary'])
-                
+        baseline_columns = []
+        for base_param in baseline_parameters:
+            values = self.baseline_list[base_param].values
+            names = [base_param + '_'+str(int(spec_num))+'_'+ str(int(seg_num)) for spec_num, seg_num in zip(self.baseline_list['Spectrum Number'].values, self.baseline_list['Segment Number'].values)]
+            minimums, maximums = self._baseline_parameter_bounds(base_param, values)
+            baseline_columns.append((names, values, self.baseline_list[base_param + '_vary'].values, minimums, maximums))
+        #Parameters are added row by row, in the column order within each row
+        params.add_many(*[(column[0][row], column[1][row], column[2][row], column[3][row], column[4][row], None, None)
+                          for row in range(len(self.baseline_list)) for column in baseline_columns])
+
         #Lineshape parameters
         linelist_params = []
         for line_param in list(self.lineparam_list):
@@ -734,199 +790,22 @@ class Fit_DataSet:
                 linemix_constrain = False
 
 
-        for spec_line in self.lineparam_list.index.values:
-            if self.lineparam_list.loc[spec_line]['sw'] >= self.minimum_parameter_fit_intensity / self.lineparam_list.loc[spec_line]['sw_scale_factor']:# bigger than 1 because fit_intensity / fit_intensity
-                for line_param in linelist_params:
-                    indices = [m.start() for m in re.finditer('_', line_param)]
-                    index_length = len(indices)
-                    #NU
-                    if line_param == 'nu' and nu_constrain:
-                        if self.nu_limit:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                      min = self.lineparam_list.loc[spec_line][line_param] - self.nu_limit_magnitude,
-                                      max = self.lineparam_list.loc[spec_line][line_param] + self.nu_limit_magnitude)
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif (line_param != 'nu') and ('nu' in line_param) and ('nuVC' not in line_param) and (not nu_constrain):
-                        if self.nu_limit:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                      min = self.lineparam_list.loc[spec_line][line_param] - self.nu_limit_magnitude,
-                                      max = self.lineparam_list.loc[spec_line][line_param] + self.nu_limit_magnitude)
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    #SW
-                    elif line_param == 'sw' and sw_constrain:
-                        if self.sw_limit:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.sw_limit_factor)* self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.sw_limit_factor* self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif (line_param != 'sw') and ('sw' in line_param) and (not sw_constrain) and (line_param != 'sw_scale_factor'):
-                        if self.sw_limit:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min =  (1 / self.sw_limit_factor)* self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.sw_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    #GAMMA0
-                    elif ('gamma0_' in line_param) and ('n_' not in line_param) and (gamma0_constrain) and (index_length==1):
-                        if self.gamma0_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.gamma0_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param] ,
-                                  max = self.gamma0_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('gamma0_' in line_param) and ('n_' not in line_param) and (not gamma0_constrain) and (index_length>1):
-                        if self.gamma0_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.gamma0_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.gamma0_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('n_gamma0' in line_param):
-                        if self.n_gamma0_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.n_gamma0_limit_factor) *self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.n_gamma0_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param],self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    #DELTA0
-                    elif ('delta0' in line_param) and ('n_' not in line_param) and (delta0_constrain) and (index_length==1):
-                        if self.delta0_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.delta0_limit_factor )*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.delta0_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('delta0_' in line_param) and ('n_' not in line_param) and (not delta0_constrain) and (index_length>1):
-                        if self.delta0_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.delta0_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.delta0_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('n_delta0' in line_param):
-                        if self.n_delta0_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param],self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.n_delta0_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.n_delta0_limit_factor / 100*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    #SD Gamma
-                    elif ('SD_gamma' in line_param) and (SD_gamma_constrain) and (index_length==2):
-                        if self.SD_gamma_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.SD_gamma_limit_factor) *self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.SD_gamma_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('SD_gamma' in line_param) and (not SD_gamma_constrain) and (index_length>2):
-                        if self.SD_gamma_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.SD_gamma_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.SD_gamma_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('n_gamma2' in line_param):
-
-                        if self.n_gamma2_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                min = (1 / self.n_gamma2_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                max = (self.n_gamma2_limit_factor / 100)*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    #SD Delta
-                    elif ('SD_delta' in line_param) and (SD_delta_constrain) and (index_length==2):
-                        if self.SD_delta_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.SD_delta_limit_factor )*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.SD_delta_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('SD_delta' in line_param) and (not SD_delta_constrain) and (index_length>2):
-                        if self.SD_delta_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.SD_delta_limit_factor )*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max =self.SD_delta_limit_factor / 100*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('n_delta2' in line_param):
+        constrain = {'nu': nu_constrain, 'sw': sw_constrain, 'gamma0': gamma0_constrain, 'delta0': delta0_constrain, 'SD_gamma': SD_gamma_constrain,
+                     'SD_delta': SD_delta_constrain, 'nuVC': nuVC_constrain, 'eta': eta_constrain, 'y': linemix_constrain}
+        fit_lines = self.lineparam_list['sw'].values >= self.minimum_parameter_fit_intensity / self.lineparam_list['sw_scale_factor'].values# bigger than 1 because fit_intensity / fit_intensity
+        line_numbers = self.lineparam_list.index.values[fit_lines]
+        line_columns = []
+        for line_param in linelist_params:
+            values = self.lineparam_list[line_param].values[fit_lines]
+            bounds = self._line_parameter_bounds(line_param, values, constrain)
+            if bounds == None:
+                continue
+            names = [line_param + '_' + 'line_' + str(spec_line) for spec_line in line_numbers]
+            line_columns.append((names, values, self.lineparam_list[line_param + '_vary'].values[fit_lines], bounds[0], bounds[1]))
+        #Parameters are added line by line, in the column order within each line
+        params.add_many(*[(column[0][line], column[1][line], column[2][line], column[3][line], column[4][line], None, None)
+                          for line in range(len(line_numbers)) for column in line_columns])
 
-                        if self.n_delta2_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                min = (1 / self.n_delta2_limit_factor )*self.lineparam_list.loc[int(spec_line)][line_param],
-                                max = self.n_delta2_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    #nuVC
-                    elif ('nuVC' in line_param) and ('n_nuVC_' not in line_param) and (nuVC_constrain) and (index_length==1):
-                        if self.nuVC_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 /self.nuVC_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.nuVC_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            if self.beta_formalism:
-                                params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'], min = 0)
-                            else:
-                                params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('nuVC' in line_param) and ('n_nuVC' not in line_param) and (not nuVC_constrain) and (index_length>1):
-                        if self.nuVC_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.nuVC_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.nuVC_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            if self.beta_formalism:
-                                params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'], min = 0)
-                            else:
-                                params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('n_nuVC' in line_param):
-                        if self.n_nuVC_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.n_nuVC_limit_factor )*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.n_nuVC_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    #eta
-                    elif ('eta_' in line_param) and (eta_constrain) and (index_length==1):
-                        if self.eta_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.eta_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = (self.eta_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('eta_' in line_param) and (not eta_constrain) and (index_length>1):
-                        if self.eta_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.eta_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.eta_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    # linemixing
-                    
-                    elif ('y_' in line_param) and ('n_' not in line_param) and (linemix_constrain) and (index_length==1):
-                        if self.linemixing_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.linemixing_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param] ,
-                                  max = self.linemixing_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('y_' in line_param) and ('n_' not in line_param) and (not linemix_constrain) and (index_length>1):
-                        if self.linemixing_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.linemixing_limit_factor)*self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.linemixing_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                             params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'])
-                    elif ('n_y_' in line_param):
-                        if self.n_linemixing_limit and self.lineparam_list.loc[spec_line][line_param] != 0:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param], self.lineparam_list.loc[spec_line][line_param + '_vary'],
-                                  min = (1 / self.n_linemixing_limit_factor) *self.lineparam_list.loc[int(spec_line)][line_param],
-                                  max = self.n_linemixing_limit_factor*self.lineparam_list.loc[int(spec_line)][line_param])
-                        else:
-                            params.add(line_param + '_' + 'line_' + str(spec_line), self.lineparam_list.loc[spec_line][line_param],self.lineparam_list.loc[spec_line][line_param + '_vary'])
-        
         #CIA Parameters (O2 Karman Model)
         if self.dataset.CIA_model['model'] == "Karman":
             cia_parameters = []
@@ -947,6 +826,105 @@ class Fit_DataSet:
                             params.add(cia_param + '_'+ cia_pair, 0, False)
         return (params)
 
+    def _baseline_parameter_bounds(self, base_param, values):
+        """Returns the min and max of the lmfit parameters of a baseline_list column for the value in each row, as set by the baseline, etalon, x_shift, pressure, temperature, and molefraction limits.  Rows with a value of 0 are not bounded.
+        """
+        if ('Pressure' in base_param) and self.pressure_limit:
+            lower, upper = (1 / self.pressure_limit_factor)*values, self.pressure_limit_factor*values
+        elif ('Temperature' in base_param) and self.temperature_limit:
+            lower, upper = (1 / self.temperature_limit_factor)*values, self.temperature_limit_factor*values
+        elif ('molefraction' in base_param) and self.molefraction_limit:
+            lower, upper = (1 / self.molefraction_limit_factor)*values, self.molefraction_limit_factor*values
+        elif ('baseline' in base_param) and self.baseline_limit:
+            lower, upper = (1 / self.baseline_limit_factor)*values, self.baseline_limit_factor *values
+        elif ('etalon_' in base_param) and self.etalon_limit and ('phase' not in base_param):
+            lower, upper = (1 / self.etalon_limit_factor )*values, self.etalon_limit_factor *values
+        elif ('etalon_' in base_param) and self.etalon_limit and ('phase' in base_param):
+            lower, upper = -2*np.pi, 2*np.pi
+        elif ('x_shift' in base_param) and self.x_shift_limit:
+            lower, upper = (values - self.x_shift_limit_magnitude), self.x_shift_limit_magnitude + values
+        else:
+            lower, upper = -np.inf, np.inf
+        bounded = values != 0
+        return np.where(bounded, lower, -np.inf), np.where(bounded, upper, np.inf)
+
+    def _line_parameter_bounds(self, line_param, values, constrain):
+        """Returns the min and max of the lmfit parameters of a lineparam_list column for the value in each row, as set by the line parameter limits, or None if the column is not fit with the constraints of the dataset.
+
+        The constrain dictionary gives whether the nu, sw, gamma0, delta0, SD_gamma, SD_delta, nuVC, eta, and y (line mixing) parameters are constrained across the spectra.  Except for nu and sw, rows with a value of 0 are not bounded.
+        """
+        index_length = line_param.count('_')
+        nonzero = True
+        minimum = -np.inf
+        #NU
+        if (line_param == 'nu' and constrain['nu']) or ((line_param != 'nu') and ('nu' in line_param) and ('nuVC' not in line_param) and (not constrain['nu'])):
+            limit, nonzero = self.nu_limit, False
+            lower, upper = values - self.nu_limit_magnitude, values + self.nu_limit_magnitude
+        #SW
+        elif (line_param == 'sw' and constrain['sw']) or ((line_param != 'sw') and ('sw' in line_param) and (not constrain['sw']) and (line_param != 'sw_scale_factor')):
+            limit, nonzero = self.sw_limit, False
+            lower, upper = (1 / self.sw_limit_factor)* values, self.sw_limit_factor* values
+        #GAMMA0
+        elif (('gamma0_' in line_param) and ('n_' not in line_param) and (constrain['gamma0']) and (index_length==1)) or (('gamma0_' in line_param) and ('n_' not in line_param) and (not constrain['gamma0']) and (index_length>1)):
+            limit = self.gamma0_limit
+            lower, upper = (1 / self.gamma0_limit_factor)*values, self.gamma0_limit_factor*values
+        elif ('n_gamma0' in line_param):
+            limit = self.n_gamma0_limit
+            lower, upper = (1 / self.n_gamma0_limit_factor) *values, self.n_gamma0_limit_factor*values
+        #DELTA0
+        elif (('delta0' in line_param) and ('n_' not in line_param) and (constrain['delta0']) and (index_length==1)) or (('delta0_' in line_param) and ('n_' not in line_param) and (not constrain['delta0']) and (index_length>1)):
+            limit = self.delta0_limit
+            lower, upper = (1 / self.delta0_limit_factor )*values, self.delta0_limit_factor*values
+        elif ('n_delta0' in line_param):
+            limit = self.n_delta0_limit
+            lower, upper = (1 / self.n_delta0_limit_factor)*values, self.n_delta0_limit_factor / 100*values
+        #SD Gamma
+        elif (('SD_gamma' in line_param) and (constrain['SD_gamma']) and (index_length==2)) or (('SD_gamma' in line_param) and (not constrain['SD_gamma']) and (index_length>2)):
+            limit = self.SD_gamma_limit
+            lower, upper = (1 / self.SD_gamma_limit_factor) *values, self.SD_gamma_limit_factor*values
+        elif ('n_gamma2' in line_param):
+            limit = self.n_gamma2_limit
+            lower, upper = (1 / self.n_gamma2_limit_factor)*values, (self.n_gamma2_limit_factor / 100)*values
+        #SD Delta
+        elif ('SD_delta' in line_param) and (constrain['SD_delta']) and (index_length==2):
+            limit = self.SD_delta_limit
+            lower, upper = (1 / self.SD_delta_limit_factor )*values, self.SD_delta_limit_factor*values
+        elif ('SD_delta' in line_param) and (not constrain['SD_delta']) and (index_length>2):
+            limit = self.SD_delta_limit
+            lower, upper = (1 / self.SD_delta_limit_factor )*values, self.SD_delta_limit_factor / 100*values
+        elif ('n_delta2' in line_param):
+            limit = self.n_delta2_limit
+            lower, upper = (1 / self.n_delta2_limit_factor )*values, self.n_delta2_limit_factor*values
+        #nuVC
+        elif (('nuVC' in line_param) and ('n_nuVC_' not in line_param) and (constrain['nuVC']) and (index_length==1)) or (('nuVC' in line_param) and ('n_nuVC' not in line_param) and (not constrain['nuVC']) and (index_length>1)):
+            limit = self.nuVC_limit
+            lower, upper = (1 / self.nuVC_limit_factor)*values, self.nuVC_limit_factor*values
+            if self.beta_formalism:
+                minimum = 0
+        elif ('n_nuVC' in line_param):
+            limit = self.n_nuVC_limit
+            lower, upper = (1 / self.n_nuVC_limit_factor )*values, self.n_nuVC_limit_factor*values
+        #eta
+        elif (('eta_' in line_param) and (constrain['eta']) and (index_length==1)) or (('eta_' in line_param) and (not constrain['eta']) and (index_length>1)):
+            limit = self.eta_limit
+            lower, upper = (1 / self.eta_limit_factor)*values, (self.eta_limit_factor)*values
+        # linemixing
+        elif (('y_' in line_param) and ('n_' not in line_param) and (constrain['y']) and (index_length==1)) or (('y_' in line_param) and ('n_' not in line_param) and (not constrain['y']) and (index_length>1)):
+            limit = self.linemixing_limit
+            lower, upper = (1 / self.linemixing_limit_factor)*values, self.linemixing_limit_factor*values
+        elif ('n_y_' in line_param):
+            limit = self.n_linemixing_limit
+            lower, upper = (1 / self.n_linemixing_limit_factor) *values, self.n_linemixing_limit_factor*values
+        else:
+            return None
+        if not limit:
+            bounded = np.zeros(len(values), dtype = bool)
+        elif nonzero:
+            bounded = values != 0
+        else:
+            bounded = np.ones(len(values), dtype = bool)
+        return np.where(bounded, lower, minimum), np.where(bounded, upper, np.inf)
+
     def constrained_baseline(self, params, baseline_segment_constrained = True, xshift_segment_constrained = True, molefraction_segment_constrained = True,
                                     etalon_amp_segment_constrained = True, etalon_period_segment_constrained = True, etalon_phase_segment_constrained = True,
                                     pressure_segment_constrained = True, temperature_segment_constrained = True):
@@ -986,46 +964,24 @@ class Fit_DataSet:
             spectrum_segment_min[spectrum.spectrum_number] = np.min(list(set(spectrum.segments)))
 
         for param in params:
+            #The pressure and temperature are not tied across the segments
             if ('Pressure' in param) and pressure_segment_constrained:
-                indices = [m.start() for m in re.finditer('_', param)]
-                spectrum_num = int(param[indices[0]+1:indices[1]])
-                segment_num = int(param[indices[1]+1:])
+                continue
             elif ('Temperature' in param) and temperature_segment_constrained:
-                indices = [m.start() for m in re.finditer('_', param)]
-                spectrum_num = int(param[indices[0]+1:indices[1]])
-                segment_num = int(param[indices[1]+1:])
-
-            elif ('baseline' in param) and baseline_segment_constrained:
-                indices = [m.start() for m in re.finditer('_', param)]
-                spectrum_num = int(param[indices[1]+1:indices[2]])
-                segment_num = int(param[indices[2]+1:])
-                if segment_num != spectrum_segment_min[spectrum_num]:
-                    params[param].set(expr = param[:indices[1]+1] + str(spectrum_num) + '_' + str(spectrum_segment_min[spectrum_num]))
-            elif ('x_shift' in param) and xshift_segment_constrained:
-                indices = [m.start() for m in re.finditer('_', param)]
-                spectrum_num = int(param[indices[1]+1:indices[2]])
-                segment_num = int(param[indices[2]+1:])
-                if segment_num != spectrum_segment_min[spectrum_num]:
-                    params[param].set(expr = param[:indices[1]+1] + str(spectrum_num) + '_' + str(spectrum_segment_min[spectrum_num]))
-            elif ('molefraction' in param) and molefraction_segment_constrained:
-                indices = [m.start() for m in re.finditer('_', param)]
-                spectrum_num = int(param[indices[1]+1:indices[2]])
-                segment_num = int(param[indices[2]+1:])
-                if segment_num != spectrum_segment_min[spectrum_num]:
-                    params[param].set(expr = param[:indices[1]+1] + str(spectrum_num) + '_' + str(spectrum_segment_min[spectrum_num]))
+                continue
+            elif ('baseline' in param):
+                constrained = baseline_segment_constrained
+            elif ('x_shift' in param):
+                constrained = xshift_segment_constrained
+            elif ('molefraction' in param):
+                constrained = molefraction_segment_constrained
             elif ('etalon' in param):
-                indices = [m.start() for m in re.finditer('_', param)]
-                spectrum_num = int(param[indices[2]+1:indices[3]])
-                segment_num = int(param[indices[3]+1:])
-                if 'amp' in param and etalon_amp_segment_constrained:
-                    if segment_num != spectrum_segment_min[spectrum_num]:
-                        params[param].set(expr = param[:indices[2]+1] + str(spectrum_num) + '_' + str(spectrum_segment_min[spectrum_num]))
-                elif 'period' in param and etalon_period_segment_constrained:
-                    if segment_num != spectrum_segment_min[spectrum_num]:
-                        params[param].set(expr = param[:indices[2]+1] + str(spectrum_num) + '_' + str(spectrum_segment_min[spectrum_num]))
-                elif 'phase' in param and etalon_phase_segment_constrained:
-                    if segment_num != spectrum_segment_min[spectrum_num]:
-                        params[param].set(expr = param[:indices[2]+1] + str(spectrum_num) + '_' + str(spectrum_segment_min[spectrum_num]))
+                constrained = (('amp' in param) and etalon_amp_segment_constrained) or (('period' in param) and etalon_period_segment_constrained) or (('phase' in param) and etalon_phase_segment_constrained)
+            else:
+                continue
+            parameter, spectrum_num, segment_num = param.rsplit('_', 2)
+            if constrained and (int(segment_num) != spectrum_segment_min[int(spectrum_num)]):
+                params[param].set(expr = parameter + '_' + str(int(spectrum_num)) + '_' + str(spectrum_segment_min[int(spectrum_num)]))
         return params
     
     def constrained_CIA(self, params, S_temperature_dependence_constrained = True, shift_constrained = True):
@@ -1057,6 +1013,335 @@ class Fit_DataSet:
                         params[param].set(expr = param[:9] + 'O2_O2')
         return params
     
+    def _compile_ties(self, params):
+        """Compiles the constraint expressions of the form [scale*]parameter[ +/- offset] (ie the segment and CIA constraints set by constrained_baseline and constrained_CIA) into ties, which map the position of each tied parameter to the position of its source parameter.
+
+        A constraint is only compiled if its source parameter is not constrained and the tied parameter is not used in another constraint expression, so that the remaining constraint expressions can still be evaluated by lmfit.
+
+        Returns
+        -------
+        ties : dict
+            names and constraint expressions of the tied parameters, the names of their source parameters, the positions of the tied and source parameters, and the scale and offset of each tie, or None if there are no ties.
+
+        """
+        names = list(params)
+        ties = {}
+        for param in names:
+            if params[param].expr == None:
+                continue
+            match = _AFFINE_CONSTRAINT.match(params[param].expr)
+            if (match == None) or (match.group('source') not in params) or (params[match.group('source')].expr != None):
+                continue
+            scale = float(match.group('scale') or 1)
+            if match.group('sign') == '-':
+                scale = -scale
+            offset = float(match.group('offset') or 0)
+            if match.group('operator') == '-':
+                offset = -offset
+            ties[param] = (match.group('source'), scale, offset)
+        #Parameters used in the constraint expressions that are not compiled keep their expressions
+        remaining = [param for param in names if (params[param].expr != None) and (param not in ties)]
+        while remaining:
+            used = set()
+            for param in remaining:
+                used.update(re.findall(r'[A-Za-z_][A-Za-z0-9_]*', params[param].expr))
+            remaining = [param for param in used if param in ties]
+            for param in remaining:
+                del ties[param]
+        if len(ties) == 0:
+            return None
+        index = {param: position for position, param in enumerate(names)}
+        tied = [param for param in names if param in ties]
+        return {'names': tied, 'exprs': {param: params[param].expr for param in tied}, 'sources': [ties[param][0] for param in tied],
+                'tied': np.asarray([index[param] for param in tied], dtype = int), 'source': np.asarray([index[ties[param][0]] for param in tied], dtype = int),
+                'scale': np.asarray([ties[param][1] for param in tied]), 'offset': np.asarray([ties[param][2] for param in tied])}
+
+    def _free_parameters(self, params, ties):
+        """Returns a copy of params where the constraint expressions of the tied parameters are removed, so that the minimizer only sees the free parameters (see fit_data).
+        """
+        if ties == None:
+            return params
+        params = params.copy()
+        for param in ties['names']:
+            params[param].set(expr = '')
+            params[param].vary = False
+        return params
+
+    def _apply_ties(self, params):
+        """Sets the values of the tied parameters (see _compile_ties) from their source parameters, as scale*source + offset, during a fit.
+        """
+        ties = self.parameter_ties
+        if ties == None:
+            return
+        vector = np.fromiter((par.value for par in params.values()), dtype = float, count = len(params))
+        for param, value in zip(ties['names'], (ties['scale']*vector[ties['source']] + ties['offset']).tolist()):
+            params[param].value = value
+
+    def _restore_ties(self, params, ties):
+        """Restores the constraint expressions of the tied parameters in the fit result parameters, where the standard error of a tied parameter is |scale| times the standard error of its source.
+        """
+        if ties == None:
+            return
+        for param in ties['names']:
+            params[param].set(expr = ties['exprs'][param])
+        params.update_constraints()
+        for param, source, scale in zip(ties['names'], ties['sources'], ties['scale']):
+            if params[source].stderr != None:
+                params[param].stderr = abs(scale)*params[source].stderr
+
+    def _parameter_map(self, params):
+        """Compiles the mapping from the parameters to the line, baseline, etalon, and segment condition slots of the simulation model, so that each evaluation gathers the values from the parameter vector instead of parsing the parameter names.
+
+        The map is rebuilt only when the parameter names, the floated (or constrained) parameters, or the line_arrays change.
+
+        Returns
+        -------
+        parameter_map : dict
+            names, baseline_params, and line_params of the parameters, the line slots of the floated and static lines of each spectrum, and the parameter positions for each segment.
+
+        """
+        names = tuple(params)
+        tied = set(self.parameter_ties['names']) if self.parameter_ties != None else set()
+        floated = tuple(bool(params[param].vary or (params[param].expr != None) or (param in tied)) for param in names)
+        parameter_map = self.parameter_map
+        if (parameter_map != None) and (parameter_map['names'] == names) and (parameter_map['floated'] == floated) and (parameter_map['line_arrays'] is self.line_arrays):
+            return parameter_map
+        index = {param: position for position, param in enumerate(names)}
+        Karman_CIA_params = ['S_SO_O2_O2', 'S_SO_O2_N2', 'S_EXCH_O2_O2', 'EXCH_b_O2_O2', 'EXCH_c_O2_O2', 
+                             'SO_b_O2_O2', 'SO_c_O2_O2', 'SO_b_O2_N2', 'SO_c_O2_N2', 
+                             'SO_shift_O2_O2', 'SO_shift_O2_N2','EXCH_shift_O2_O2', 
+                             'EXCH_shift_O2_N2', 'S_EXCH_O2_N2', 'EXCH_b_O2_N2', 'EXCH_c_O2_N2'] #this row has unused parameters
+
+        # Set-up Baseline Parameters
+        baseline_params = []
+        linelist_params = []
+        for param in names:
+            if ('molefraction' in param) or ('baseline' in param) or ('etalon' in param) or ('x_shift' in param) or ('Pressure' in param) or ('Temperature' in param) or ('_res_' in param):
+                baseline_params.append(param)
+            elif (self.dataset.CIA_model['model']== 'Karman') and (param in Karman_CIA_params):
+                continue
+            else:
+                linelist_params.append(param)
+
+        #Lines with a floated (or constrained) parameter are simulated at every call, while the remaining static lines are summed into a cached background for each segment
+        parameter_lines = {parameter: int(parameter[parameter.find('_line_') + 6:]) for parameter in linelist_params}
+        floated_lines = set(parameter_lines[parameter] for parameter in linelist_params if floated[index[parameter]])
+        spectra = {}
+        segments = {}
+        parameter_segments = {}
+        for spectrum in self.dataset.spectra:
+            spectrum_number = spectrum.spectrum_number
+            line_arrays = self.line_arrays[spectrum_number]
+            floated_mask = np.zeros(len(line_arrays), dtype = bool)
+            floated_mask[[line_arrays.positions[line] for line in floated_lines if line in line_arrays.positions]] = True
+            #Position of each line in the floated and static line subsets
+            subset_positions = {True: np.cumsum(floated_mask) - 1, False: np.cumsum(~floated_mask) - 1}
+            slots = {True: {}, False: {}}
+            line_params = {}
+            for parameter in linelist_params:
+                line = parameter_lines[parameter]
+                param = parameter[:parameter.find('_line_')]
+                if param in line_arrays.columns:
+                    line_params.setdefault(line, []).append((param, parameter))
+                    position = line_arrays.positions[line]
+                    slot = slots[bool(floated_mask[position])].setdefault(line_arrays.columns[param], ([], []))
+                    slot[0].append(subset_positions[bool(floated_mask[position])][position])
+                    slot[1].append(index[parameter])
+            for subset in slots:
+                slots[subset] = [(attribute, row, np.asarray(positions, dtype = int), np.asarray(indices, dtype = int)) for (attribute, row), (positions, indices) in slots[subset].items()]
+            spectra[spectrum_number] = {'line_params': line_params, 'floated_mask': floated_mask,
+                                        'floated_lines': line_arrays.take(floated_mask), 'floated_slots': slots[True],
+                                        'static_lines': line_arrays.take(~floated_mask), 'static_slots': slots[False],
+                                        'static_index': np.concatenate([indices for attribute, row, positions, indices in slots[False]] + [np.zeros(0, dtype = int)])}
+            for segment in list(set(spectrum.segments)):
+                suffix = '_' + str(spectrum_number) + '_' + str(segment)
+                baseline_names = ['baseline_' + chr(97 + order) + suffix for order in range(self.dataset.baseline_order + 1)]
+                etalon_names = [['etalon_' + str(etalon_num) + '_' + term + suffix for etalon_num in range(1, len(spectrum.etalons) + 1)] for term in ['amp', 'period', 'phase']]
+                for param in baseline_names + sum(etalon_names, []):
+                    if param in index:
+                        parameter_segments[param] = (spectrum_number, segment)
+                molefraction = {}
+                for molecule in spectrum.molefraction:
+                    if ('molefraction_'+ self.dataset.isotope_list[(molecule, 1)][4]) + suffix in index:
+                        molefraction[molecule] = index[('molefraction_'+ self.dataset.isotope_list[(molecule, 1)][4]) + suffix]
+                ILS_resolution = []
+                if spectrum.ILS_function != None:
+                    ILS_resolution = [index[spectrum.ILS_function.__name__ + '_res_' + str(res_param) + suffix] for res_param in range(0, self.dataset.ILS_function_dict[spectrum.ILS_function.__name__])]
+                segments[(spectrum_number, segment)] = {'x_shift': index['x_shift' + suffix], 'Pressure': index['Pressure' + suffix], 'Temperature': index['Temperature' + suffix],
+                                                        'molefraction': molefraction, 'ILS_resolution': np.asarray(ILS_resolution, dtype = int),
+                                                        'baseline': np.asarray([index.get(param, -1) for param in baseline_names], dtype = int),
+                                                        'etalons': np.asarray([[index.get(param, -1) for param in etalon_names[term]] for term in range(3)], dtype = int).reshape(3, len(spectrum.etalons))}
+        self.parameter_map = {'names': names, 'floated': floated, 'line_arrays': self.line_arrays, 'baseline_params': set(baseline_params),
+                              'parameter_lines': parameter_lines, 'parameter_segments': parameter_segments, 'spectra': spectra, 'segments': segments}
+        return self.parameter_map
+
+    def _model_buffers(self):
+        """Returns a set of float64 buffers, laid out once for the points of all spectra in the dataset, that a full evaluation of the simulation model fills in place.
+
+        Two sets of residuals, wavenumbers, wavenumbers_relative, absorbance, baseline, and etalons buffers are kept, and the set that is not referenced by the model_cache (or, if the model_cache was cleared, not used by the last evaluation) is returned, so that a full evaluation never overwrites the reference evaluation stored in the model_cache (see _jacobian_columns).  The work buffer is scratch space shared by both sets.  The buffers are laid out again if the number of points in a spectrum changes.
+        """
+        layout = tuple((spectrum.spectrum_number, len(spectrum.alpha)) for spectrum in self.dataset.spectra)
+        if (self.model_buffers == None) or (self.model_buffers['layout'] != layout):
+            n_points = sum(n for spectrum_number, n in layout)
+            self.model_buffers = {'layout': layout, 'work': np.zeros(n_points),
+                                  'sets': [{name: np.zeros(n_points) for name in ['residuals', 'wavenumbers', 'wavenumbers_relative', 'absorbance', 'baseline', 'etalons']} for i in range(2)]}
+        buffer_sets = self.model_buffers['sets']
+        if self.model_cache != None:
+            in_use = self.model_cache.get('buffers')
+        else:
+            in_use = self.model_buffers.get('last')
+        if in_use is buffer_sets[0]:
+            self.model_buffers['last'] = buffer_sets[1]
+        else:
+            self.model_buffers['last'] = buffer_sets[0]
+        return self.model_buffers['last']
+
+    def _baseline_model(self, vector, segment_map, wavenumbers_relative, baseline = None, etalons = None, work = None):
+        """Calculates the baseline and etalon terms of a spectrum segment from the parameter vector, which are accumulated in place in the baseline and etalons arrays (and the work array as scratch) if they are given.
+        """
+        if baseline is None:
+            baseline = np.empty(len(wavenumbers_relative))
+        if etalons is None:
+            etalons = np.empty(len(wavenumbers_relative))
+        if work is None:
+            work = np.empty(len(wavenumbers_relative))
+        ## Baseline Calculation
+        baseline_param_array = np.where(segment_map['baseline'] >= 0, vector[segment_map['baseline']], 0)
+        #Horner's method, as in np.polyval of the reversed baseline_param_array
+        baseline[:] = 0
+        for coefficient in baseline_param_array[::-1]:
+            baseline *= wavenumbers_relative
+            baseline += coefficient
+        #Etalon Calculation (see utilities.etalon)
+        amps, periods, phases = np.where(segment_map['etalons'] >= 0, vector[segment_map['etalons']], [[0], [1], [0]])
+        etalons[:] = 0
+        for amp, period, phase in zip(amps, periods, phases):
+            np.multiply(wavenumbers_relative, 2*np.pi * period, out = work)
+            work += phase
+            np.sin(work, out = work)
+            work *= amp
+            etalons += work
+        return baseline, etalons
+
+    def _segment_residuals(self, spectrum, record, out = None, work = None):
+        """Sums the baseline, etalon, absorption, and CIA terms of a spectrum segment record, applies the ILS and weighting, and returns the segment residuals, which are written in place in the out array (and the work array as scratch) if they are given.
+        """
+        #ILS_Function
+        if spectrum.ILS_function != None:
+            segment_alpha = record['baseline'] + record['etalons'] + record['absorbance'] + record['CIA']
+            if self.dataset.ILS_function_dict[spectrum.ILS_function.__name__] ==1:
+                spec_seg_ILS_resolution  = float(record['ILS_resolution'][0])
+            else:
+                spec_seg_ILS_resolution  = list(record['ILS_resolution'])
+            wavenumbers, segment_alpha, i1, i2m, slit = convolveSpectrumSame(record['wavenumbers'], segment_alpha, SlitFunction = spectrum.ILS_function, Resolution = spec_seg_ILS_resolution ,AF_wing=spectrum.ILS_wing)
+            residuals = np.subtract(segment_alpha, record['alpha'], out = out)
+        else:
+            residuals = np.add(record['baseline'], record['etalons'], out = out)
+            residuals += record['absorbance']
+            residuals += record['CIA']
+            residuals -= record['alpha']
+        #Weighted Spectra
+        if self.weight_spectra:
+            if spectrum.tau_stats.all() == 0:
+                residuals *= spectrum.weight
+            else:
+                weights = np.divide(1, spectrum.tau_stats[record['start']: record['stop']], out = work)
+                weights *= spectrum.weight
+                residuals *= weights
+        return residuals
+
+    def _simulation_state(self, spectrum):
+        """Returns the (versions, arrays, settings) state of the inputs of the line simulations of a spectrum that are not parameters (see _same_state), where the version counts the changes made through the set_ methods of the spectrum.
+        """
+        return ((spectrum.version,), {'wavenumber': spectrum.wavenumber},
+                {'isotope_list': self.dataset.isotope_list, 'natural_abundance': spectrum.natural_abundance, 'abundance_ratio_MI': spectrum.abundance_ratio_MI,
+                 'Diluent': spectrum.Diluent, 'TIPS': spectrum.TIPS})
+
+    def _model_state(self):
+        """Returns the (versions, arrays, settings) state of the inputs of the simulation model of all spectra that are not parameters (the simulation inputs, see _simulation_state, and the alpha, weight, tau_stats, CIA, and ILS inputs), which is compared (see _same_state) with the snapshot stored in the model_cache before the cached residuals are reused.
+
+        NOTE: The arrays of the spectra are only compared by identity, so after editing them in place (ie spectrum.alpha[...] = ...) the model_cache (and for the wavenumbers the background_cache) has to be cleared with fit.model_cache = None (fit.background_cache = {}).
+        """
+        versions = ()
+        arrays = {}
+        settings = {}
+        for spectrum in self.dataset.spectra:
+            spectrum_number = spectrum.spectrum_number
+            spectrum_versions, spectrum_arrays, spectrum_settings = self._simulation_state(spectrum)
+            spectrum_arrays.update({'alpha': spectrum.alpha, 'tau_stats': spectrum.tau_stats, 'segments': spectrum.segments})
+            spectrum_settings.update({'weight': spectrum.weight, 'ILS_function': spectrum.ILS_function, 'ILS_wing': spectrum.ILS_wing,
+                                      'compressability_file': spectrum.compressability_file})
+            if self.dataset.CIA_model['model'] == "Karman":
+                #The CIA is re-calculated from the CIA parameters and the spectrum conditions at each full evaluation
+                spectrum_settings.update({'pressure': spectrum.pressure, 'temperature': spectrum.temperature})
+            else:
+                spectrum_arrays['cia'] = spectrum.cia
+            versions += spectrum_versions
+            for name in spectrum_arrays:
+                arrays[(spectrum_number, name)] = spectrum_arrays[name]
+            settings[spectrum_number] = spectrum_settings
+        return versions, arrays, settings
+
+    def _delta_update(self, vector, parameter_map, model_key, model_state):
+        """Calculates the residuals by patching the last full evaluation of the simulation model, when only one line, baseline, or etalon parameter has changed since then.
+
+        For a line parameter, only the contribution of that line is re-simulated (within its simulation window) for each segment, and for a baseline or etalon parameter, only the baseline and etalon terms of that segment are recalculated.
+
+        Returns
+        -------
+        residuals : array
+            residuals for all spectra in Dataset, or None if a full evaluation is needed.
+
+        """
+        cache = self.model_cache
+        if (cache == None) or (cache['key'] != model_key) or (cache['line_arrays'] is not self.line_arrays) or (cache['parameter_map'] is not parameter_map):
+            return None
+        if not _same_state(model_state, cache['state']):
+            return None
+        changed = np.flatnonzero(vector != cache['vector'])
+        if len(changed) == 0:
+            return cache['residuals'].copy()
+        if len(changed) != 1:
+            return None
+        changed_position = changed[0]
+        changed = parameter_map['names'][changed_position]
+        patched = {}
+        if changed in parameter_map['parameter_lines']:
+            line = parameter_map['parameter_lines'][changed]
+            for spectrum_number in cache['line_params']:
+                if line not in cache['line_params'][spectrum_number]:
+                    continue
+                line_arrays = self.line_arrays[spectrum_number]
+                reference_line = line_arrays.take([line_arrays.positions[line]])
+                updated_line = line_arrays.take([line_arrays.positions[line]])
+                for param, parameter in cache['line_params'][spectrum_number][line]:
+                    reference_line.set_value(param, line, float(cache['values'][parameter]))
+                    if parameter == changed:
+                        updated_line.set_value(param, line, float(vector[changed_position]))
+                    else:
+                        updated_line.set_value(param, line, float(cache['values'][parameter]))
+                for (spectrum_num, segment), record in cache['segments'].items():
+                    if spectrum_num == spectrum_number:
+                        reference_nu, reference_coef = record['HTP_model'](reference_line, record['wavenumbers'], **record['simulation_kwargs'])
+                        updated_nu, updated_coef = record['HTP_model'](updated_line, record['wavenumbers'], **record['simulation_kwargs'])
+                        patched[(spectrum_num, segment)] = dict(record, absorbance = record['absorbance'] + (updated_coef - reference_coef)*1e6)
+        elif changed in parameter_map['parameter_segments']:
+            spectrum_number, segment = parameter_map['parameter_segments'][changed]
+            record = cache['segments'].get((spectrum_number, segment))
+            if record == None:
+                return None
+            baseline, etalons = self._baseline_model(vector, parameter_map['segments'][(spectrum_number, segment)], record['wavenumbers_relative'])
+            patched[(spectrum_number, segment)] = dict(record, baseline = baseline, etalons = etalons)
+        else:
+            return None
+        residuals = cache['residuals'].copy()
+        for spectrum in self.dataset.spectra:
+            for segment in spectrum.segment_slices():
+                if (spectrum.spectrum_number, segment) in patched:
+                    record = patched[(spectrum.spectrum_number, segment)]
+                    self._segment_residuals(spectrum, record, out = residuals[record['offset'] + record['start']: record['offset'] + record['stop']])
+        return residuals
+
     def simulation_model(self, params, wing_cutoff = 25, wing_wavenumbers = 25, wing_method = 'wing_cutoff'):
         """This is the model used for fitting that includes baseline, resonant absorption, and CIA models.
         这是用于拟合的模型，包括基线、共振吸收和 CIA 模型。
@@ -1074,6 +1359,15 @@ class Fit_DataSet:
         wing_method : TYPE, optional
             Provides choice between the wing_cutoff and wing_wavenumbers line cut-off options. The default is 'wing_cutoff'.
             提供了在 wing_cutoff 和 wing_wavenumbers 线截止选项之间进行选择。默认为 'wing_cutoff'。
+
+        NOTE: Only the lines with a floated or constrained (expr) line parameter are simulated at every call.  The remaining static lines are simulated once for each segment and stored in the background_cache, which is re-simulated when the pressure, temperature, mole fraction, x_shift, or static line parameters of the segment change (ie if they are floated) or when the spectrum is changed through its set_ methods, its Diluent, isotope, or TIPS inputs change, or its wavenumber array is replaced (see _simulation_state).  The wavenumber array is compared by identity, so fit.background_cache = {} has to be set after editing it in place.  The background_cache is cleared at the start of each fit_data.
+
+        The parameter names are parsed once into a parameter map (see _parameter_map), so that each call gathers the line, baseline, etalon, and segment condition values from the vector of parameter values.
+
+        A full evaluation fills the preallocated float64 buffers of the Fit_DataSet in place (see _model_buffers), and only a copy of the residuals is returned.
+
+        The residuals and the terms of each segment of the last full evaluation are stored in the model_cache.  If only one line, baseline, or etalon parameter has changed since then, as when a finite difference Jacobian is calculated, then only that line's contribution or that segment's baseline and etalon terms are recalculated (see _delta_update).  The cached residuals are only reused if the spectra have not been changed since the last full evaluation (see _model_state), where the arrays of the spectra are compared by identity, so fit.model_cache = None has to be set after editing them in place.
+
         Returns
         -------
         total_residuals : array
@@ -1081,192 +1375,646 @@ class Fit_DataSet:
 
         """
 
-        total_simulated = []
-        total_residuals = []
-        baseline_params = []
-        linelist_params = []
-        Karman_CIA_params = ['S_SO_O2_O2', 'S_SO_O2_N2', 'S_EXCH_O2_O2', 'EXCH_b_O2_O2', 'EXCH_c_O2_O2', 
-                             'SO_b_O2_O2', 'SO_c_O2_O2', 'SO_b_O2_N2', 'SO_c_O2_N2', 
-                             'SO_shift_O2_O2', 'SO_shift_O2_N2','EXCH_shift_O2_O2', 
-                             'EXCH_shift_O2_N2', 'S_EXCH_O2_N2', 'EXCH_b_O2_N2', 'EXCH_c_O2_N2'] #this row has unused parameters
+        self._apply_ties(params)
+        parameter_map = self._parameter_map(params)
+        values = params.valuesdict()
+        vector = np.fromiter(values.values(), dtype = float, count = len(values))
+        return self._model_residuals(vector, values, parameter_map, wing_cutoff, wing_wavenumbers, wing_method)
 
-        # Set-up Baseline Parameters
-        for param in (list(params.valuesdict().keys())):
-            if ('molefraction' in param) or ('baseline' in param) or ('etalon' in param) or ('x_shift' in param) or ('Pressure' in param) or ('Temperature' in param) or ('_res_' in param):
-                baseline_params.append(param)
-            elif (self.dataset.CIA_model['model']== 'Karman') and (param in Karman_CIA_params):
-                #print (param)
-                1+1
-            else:
-                linelist_params.append(param)
+    def _model_residuals(self, vector, values, parameter_map, wing_cutoff, wing_wavenumbers, wing_method):
+        """Evaluates the simulation model from the vector of parameter values (with values being the same values as a {name: value} dictionary) and the parameter map of the parameters (see simulation_model).
+        """
+        #Patch the last full evaluation if only one line, baseline, or etalon parameter has changed (ie finite difference Jacobians)
+        model_key = (wing_cutoff, wing_wavenumbers, wing_method, self.beta_formalism, self.lineshape_backend, self.weight_spectra)
+        model_state = self._model_state()
+        delta_residuals = self._delta_update(vector, parameter_map, model_key, model_state)
+        if delta_residuals is not None:
+            return delta_residuals
+
+        buffers = self._model_buffers()
+        work = self.model_buffers['work']
+        segment_records = {}
+        line_params = {}
+        simulations = []
+        background_keys = {}
+        state_snapshots = {}
+        checked_states = {}
+        offset = 0
+        if self.beta_formalism == True:
+            HTP_model = HTP_wBeta_from_DF_select
+        else:
+            HTP_model = HTP_from_DF_select
 
         for spectrum in self.dataset.spectra:
-            simulated_spectra = len(spectrum.wavenumber)*[0]
-            residuals = len(spectrum.alpha)*[0]
-            wavenumber_segments, alpha_segments, indices_segments = spectrum.segment_wave_alpha()
+            segment_slices = spectrum.segment_slices()
+            wavenumber_min = np.min(spectrum.wavenumber)
             Diluent = spectrum.Diluent
             spectrum_number = spectrum.spectrum_number
             #nominal_temp = spectrum.nominal_temperature
-            columns = ['molec_id', 'local_iso_id', 'elower', 'nu', 'sw', 'sw_scale_factor']
-            for species in Diluent:
-                columns.append('gamma0_' + species)
-                columns.append('n_gamma0_'+ species)
-                columns.append('delta0_' + species)
-                columns.append('n_delta0_'+ species)
-                columns.append('SD_gamma_' + species)
-                columns.append('n_gamma2_'+ species )
-                columns.append('SD_delta_' + species)
-                columns.append('n_delta2_' + species)
-                columns.append('nuVC_' + species)
-                columns.append('n_nuVC_' + species)
-                columns.append('eta_' + species)
-                columns.append('y_' + species)
-                columns.append('n_y_' + species)
-            rename_dictionary = {}
-            for column in self.lineparam_list:
-                if ('vary' not in column) and ('err' not in column):
-                    if ((column + '_' + str(spectrum_number)) in self.lineparam_list):
-                        columns = [(column + '_'  + str(spectrum_number))if x==column else x for x in columns]
-                        rename_dictionary[(column + '_'  + str(spectrum_number))] = column
-            linelist_for_sim = self.lineparam_list[columns].copy()
+            line_arrays = self.line_arrays[spectrum_number]
+            spectrum_map = parameter_map['spectra'][spectrum_number]
+            line_params[spectrum_number] = spectrum_map['line_params']
+            floated_mask = spectrum_map['floated_mask']
+            static_values = vector[spectrum_map['static_index']].tobytes()
+            static_lines = None
+            simulation_state = self._simulation_state(spectrum)
 
             # Replaces the relevant linelist locations with the
-            for parameter in linelist_params:
-                line = int(parameter[parameter.find('_line_') + 6:])
-                param = parameter[:parameter.find('_line_')]
-                if param in columns:
-                    if 'sw' in param:
-                        #print (linelist_for_sim[line]['sw_scale_factor'])
-                        linelist_for_sim.loc[line, param] = float(params[parameter])
-                    else:
-                        linelist_for_sim.loc[line, param] = float(params[parameter])
-            #Renames columns to generic (no scan number)
-            linelist_for_sim=linelist_for_sim.rename(columns = rename_dictionary)
-            linelist_for_sim['sw'] = linelist_for_sim['sw']*linelist_for_sim['sw_scale_factor']
+            linelist_for_sim = spectrum_map['floated_lines']
+            _scatter_line_values(linelist_for_sim, spectrum_map['floated_slots'], vector)
             
             #Calculate CIA for Spectrum
             if self.dataset.CIA_model['model'] == "Karman":
                 CIA = o2_cia_karman_model(spectrum.wavenumber, spectrum.get_temperature(), spectrum.get_pressure(), spectrum.get_Diluent(),
-                        float(params['S_SO_O2_O2']),
-                        float(params['S_SO_O2_N2']),
-                        float(params['S_EXCH_O2_O2']),
-                        float(params['EXCH_b_O2_O2']),
-                        float(params['EXCH_c_O2_O2']),
-                        float(params['SO_b_O2_O2']),
-                        float(params['SO_c_O2_O2']),
-                        float(params['SO_b_O2_N2']),
-                        float(params['SO_c_O2_N2']),
-                        float(params['SO_shift_O2_O2']),
-                        float(params['SO_shift_O2_N2']),
-                        float(params['EXCH_shift_O2_N2']),
+                        float(values['S_SO_O2_O2']),
+                        float(values['S_SO_O2_N2']),
+                        float(values['S_EXCH_O2_O2']),
+                        float(values['EXCH_b_O2_O2']),
+                        float(values['EXCH_c_O2_O2']),
+                        float(values['SO_b_O2_O2']),
+                        float(values['SO_c_O2_O2']),
+                        float(values['SO_b_O2_N2']),
+                        float(values['SO_c_O2_N2']),
+                        float(values['SO_shift_O2_O2']),
+                        float(values['SO_shift_O2_N2']),
+                        float(values['EXCH_shift_O2_N2']),
                         band = self.dataset.CIA_model['band'])
                 spectrum.set_cia(CIA)  
+            #Compressability factor at the conditions of all of the segments
+            compressability_factors = {}
             if spectrum.compressability_file != None:
-                comp_factor = pd.read_csv(spectrum.compressability_file + '.csv')
-                pressures = np.asarray(comp_factor['Pressure (MPa)'].values*1e6/101325)
-                pressures = pressures.astype(float)
-                temperatures = list(comp_factor)
-                temperatures.remove('Pressure (MPa)')
-                temperatures = np.asarray(temperatures)
-                temperatures = temperatures.astype(float)
-                comp_factor.drop('Pressure (MPa)', inplace=True, axis=1) 
-                comp_factor_array = comp_factor.to_numpy()
-                interp_comp_factor = RegularGridInterpolator(points = [pressures, temperatures], values = comp_factor_array)
-                                
+                segment_maps = [parameter_map['segments'][(spectrum_number, segment)] for segment in segment_slices]
+                segment_factors = load_compressability_table(spectrum.compressability_file)(vector[[segment_map['Pressure'] for segment_map in segment_maps]],
+                                                                                              vector[[segment_map['Temperature'] for segment_map in segment_maps]])
+                compressability_factors = dict(zip(segment_slices, segment_factors))
             
-            for segment in list(set(spectrum.segments)):
-                wavenumbers = wavenumber_segments[segment]
-                wavenumbers_relative = wavenumbers - np.min(spectrum.wavenumber)
-                x_shift = float(params['x_shift_' + str(spectrum_number) + '_' + str(segment)])
+            for segment in segment_slices:
+                segment_map = parameter_map['segments'][(spectrum_number, segment)]
+                segment_start = segment_slices[segment].start
+                segment_stop = segment_slices[segment].stop
+                x_shift = float(vector[segment_map['x_shift']])
                 #linelist_for_sim['nu'] = linelist_for_sim['nu'] + x_shift # Q
-                wavenumbers += x_shift
-                wavenumbers_relative+= x_shift
+                points = slice(offset + segment_start, offset + segment_stop)
+                wavenumbers = np.add(spectrum.wavenumber[segment_start: segment_stop], x_shift, out = buffers['wavenumbers'][points])
+                wavenumbers_relative = np.subtract(spectrum.wavenumber[segment_start: segment_stop], wavenumber_min, out = buffers['wavenumbers_relative'][points])
+                wavenumbers_relative += x_shift
                 #Set-up MoleFraction for Fitting
                 fit_molefraction = spectrum.molefraction
-                for molecule in spectrum.molefraction:
-                    if ('molefraction_'+ self.dataset.isotope_list[(molecule, 1)][4]) + '_' + str(spectrum_number) + '_' + str(segment) in baseline_params:
-                        fit_molefraction[molecule] = float(params[('molefraction_'+ self.dataset.isotope_list[(molecule, 1)][4]) + '_' + str(spectrum_number) + '_' + str(segment)])
+                for molecule in segment_map['molefraction']:
+                    fit_molefraction[molecule] = float(vector[segment_map['molefraction'][molecule]])
                 #Get Environmental Parameters
-                p = float(params['Pressure_' + str(spectrum_number) + '_' + str(segment)])
-                T = float(params['Temperature_' + str(spectrum_number) + '_' + str(segment)])
+                p = float(vector[segment_map['Pressure']])
+                T = float(vector[segment_map['Temperature']])
                 if spectrum.compressability_file != None:
-                    compressability_factor = interp_comp_factor([p, T])[0]
-                    #print (p, T, compressability_factor)
+                    compressability_factor = compressability_factors[segment]
                 else:
                     compressability_factor = 1
 
                 #Simulate Spectra
-                if self.beta_formalism == True:
-                    fit_nu, fit_coef = HTP_wBeta_from_DF_select(linelist_for_sim, wavenumbers, wing_cutoff = wing_cutoff, wing_wavenumbers = wing_wavenumbers, wing_method = wing_method,
-                            p = p, T = T, molefraction = fit_molefraction, isotope_list = self.dataset.isotope_list,
-                            natural_abundance = spectrum.natural_abundance, abundance_ratio_MI = spectrum.abundance_ratio_MI,  Diluent = Diluent, 
-                            TIPS = spectrum.TIPS, compressability_factor = compressability_factor)
-                else:
-                    fit_nu, fit_coef = HTP_from_DF_select(linelist_for_sim, wavenumbers, wing_cutoff = wing_cutoff, wing_wavenumbers = wing_wavenumbers, wing_method = wing_method,
-                            p = p, T = T, molefraction = fit_molefraction, isotope_list = self.dataset.isotope_list,
-                            natural_abundance = spectrum.natural_abundance, abundance_ratio_MI = spectrum.abundance_ratio_MI,  Diluent = Diluent, 
-                            TIPS = spectrum.TIPS, compressability_factor = compressability_factor)
-                fit_coef = fit_coef * 1e6
+                simulation_kwargs = {'wing_cutoff': wing_cutoff, 'wing_wavenumbers': wing_wavenumbers, 'wing_method': wing_method,
+                                     'p': p, 'T': T, 'molefraction': dict(fit_molefraction), 'isotope_list': self.dataset.isotope_list,
+                                     'natural_abundance': spectrum.natural_abundance, 'abundance_ratio_MI': spectrum.abundance_ratio_MI, 'Diluent': Diluent,
+                                     'TIPS': spectrum.TIPS, 'compressability_factor': compressability_factor, 'lineshape_backend': self.lineshape_backend}
+                #Static line background, which is re-simulated only if the segment conditions or the static lines have changed
+                background_key = (p, T, x_shift, tuple(fit_molefraction.items()), compressability_factor, wing_cutoff, wing_wavenumbers, wing_method,
+                                  self.beta_formalism, floated_mask.tobytes(), static_values)
+                cached_background = self.background_cache.get((spectrum_number, segment))
+                same_state = False
+                if cached_background != None:
+                    #The segments of a spectrum share their snapshot, which is only compared once for each evaluation
+                    snapshot = cached_background[2]
+                    if (spectrum_number, id(snapshot)) not in checked_states:
+                        checked_states[(spectrum_number, id(snapshot))] = _same_state(simulation_state, snapshot)
+                    same_state = checked_states[(spectrum_number, id(snapshot))]
+                    if same_state:
+                        state_snapshots.setdefault(spectrum_number, snapshot)
+                if (same_state == False) or (cached_background[0] is not line_arrays) or (cached_background[1] != background_key):
+                    if static_lines == None:
+                        static_lines = spectrum_map['static_lines']
+                        _scatter_line_values(static_lines, spectrum_map['static_slots'], vector)
+                    simulations.append((HTP_model, static_lines, wavenumbers, simulation_kwargs, spectrum_number, segment_start, segment_stop, x_shift))
+                    background_keys[(spectrum_number, segment)] = background_key
+                simulations.append((HTP_model, linelist_for_sim, wavenumbers, simulation_kwargs, spectrum_number, segment_start, segment_stop, x_shift))
                 
                 ## CIA Calculation
-                CIA = spectrum.cia[np.min(indices_segments[segment]): np.max(indices_segments[segment])+1]
-
-                ## Baseline Calculation
-                baseline_param_array = [0]*(self.dataset.baseline_order+1)
-                for param in baseline_params:
-                    if ('baseline' in param):
-                        indices = [m.start() for m in re.finditer('_', param)]
-                        spectrum_num = int(param[indices[1]+1:indices[2]])
-                        segment_num = int(param[indices[2]+1:])
-                        if (spectrum_num == spectrum_number) and (segment_num == segment):
-                            baseline_param_array[ord(param[9:param.find('_',9)])-97] = float(params[param])
-                baseline_param_array = baseline_param_array[::-1] # reverses array to be used for polyval
-                baseline = np.polyval(baseline_param_array, wavenumbers_relative)
-                #Etalon Calculation
-                fit_etalon_parameters = {}
-                for i in range(1, len(spectrum.etalons)+1):
-                    fit_etalon_parameters[i] = {'amp': 0, 'period':1, 'phase':0}
-                for param in baseline_params:
-                    if ('etalon' in param) and (str(spectrum_number) in param[param.find('_', 7):]):
-                        etalon_num = int(param[param.find('_')+1: param.find('_', param.find('_')+1)])
-                        if param == 'etalon_' + str(etalon_num) + '_amp_' + str(spectrum_number) + '_' +str(segment):#('amp' in param) and (str(etalon_num) in param):
-                            fit_etalon_parameters[etalon_num]['amp'] = float(params[param])
-                        if param == 'etalon_' + str(etalon_num) + '_period_' + str(spectrum_number) + '_' +str(segment):#('period' in param) and (str(etalon_num) in param):
-                            fit_etalon_parameters[etalon_num]['period'] = float(params[param])
-                        if param == 'etalon_' + str(etalon_num) + '_phase_' + str(spectrum_number) +'_' + str(segment):#('phase' in param) and (str(etalon_num) in param):
-                            fit_etalon_parameters[etalon_num]['phase'] = float(params[param])
-                etalons = len(wavenumbers)*[0]
-                for i in range(1, len(spectrum.etalons)+1):
-                    etalons += etalon(wavenumbers_relative, fit_etalon_parameters[i]['amp'], fit_etalon_parameters[i]['period'], fit_etalon_parameters[i]['phase'])
-                segment_alpha = baseline + etalons + fit_coef + CIA
-                #ILS_Function
-                if spectrum.ILS_function != None:
-                    if self.dataset.ILS_function_dict[spectrum.ILS_function.__name__] ==1:
-                        spec_seg_ILS_resolution  = float(params[spectrum.ILS_function.__name__ + '_res_0_' + str(spectrum_number) + '_' +str(segment)])
-                    else:
-                        spec_seg_ILS_resolution  = []
-                        for res_param in range(0, self.dataset.ILS_function_dict[spectrum.ILS_function.__name__]):
-                            spec_seg_ILS_resolution  += float(params[spectrum.ILS_function.__name__ + '_res_' + str(res_param) +'_' + str(spectrum_number) + '_' +str(segment)])
-                    wavenumbers, segment_alpha, i1, i2m, slit = convolveSpectrumSame(wavenumbers, segment_alpha, SlitFunction = spectrum.ILS_function, Resolution = spec_seg_ILS_resolution ,AF_wing=spectrum.ILS_wing)
-                simulated_spectra[np.min(indices_segments[segment]): np.max(indices_segments[segment])+1] = (segment_alpha)
-                #Weighted Spectra
-                if self.weight_spectra:
-                    if spectrum.tau_stats.all() == 0:
-                        weights = len(alpha_segments[segment])*[spectrum.weight]
+                CIA = spectrum.cia[segment_start: segment_stop]
+
+                ## Baseline and Etalon Calculation
+                baseline, etalons = self._baseline_model(vector, segment_map, wavenumbers_relative, baseline = buffers['baseline'][points], etalons = buffers['etalons'][points], work = work[points])
+                record = {'wavenumbers': wavenumbers, 'wavenumbers_relative': wavenumbers_relative, 'alpha': spectrum.alpha[segment_start: segment_stop],
+                          'start': segment_start, 'stop': segment_stop, 'offset': offset,
+                          'absorbance': None, 'CIA': CIA, 'baseline': baseline, 'etalons': etalons, 'ILS_resolution': vector[segment_map['ILS_resolution']],
+                          'HTP_model': HTP_model, 'simulation_kwargs': simulation_kwargs}
+                segment_records[(spectrum_number, segment)] = record
+            offset += len(spectrum.alpha)
+
+        #Line simulations of all segments (in the process pool if n_workers is set), which are gathered in the order of the spectra and segments
+        simulated_coefficients = iter(self._simulate_segments(simulations))
+        for spectrum in self.dataset.spectra:
+            spectrum_number = spectrum.spectrum_number
+            for segment in spectrum.segment_slices():
+                if (spectrum_number, segment) in background_keys:
+                    if spectrum_number not in state_snapshots:
+                        state_snapshots[spectrum_number] = _state_snapshot(self._simulation_state(spectrum))
+                    self.background_cache[(spectrum_number, segment)] = (self.line_arrays[spectrum_number], background_keys[(spectrum_number, segment)], state_snapshots[spectrum_number],
+                                                                         next(simulated_coefficients))
+                record = segment_records[(spectrum_number, segment)]
+                points = slice(record['offset'] + record['start'], record['offset'] + record['stop'])
+                record['absorbance'] = np.add(self.background_cache[(spectrum_number, segment)][3], next(simulated_coefficients), out = buffers['absorbance'][points])
+                record['absorbance'] *= 1e6
+                self._segment_residuals(spectrum, record, out = buffers['residuals'][points], work = work[points])
+        total_residuals = buffers['residuals']
+        #The snapshot of the spectrum inputs is only made again if they have changed
+        if (self.model_cache != None) and _same_state(model_state, self.model_cache['state']):
+            state_snapshot = self.model_cache['state']
+        else:
+            state_snapshot = _state_snapshot(model_state)
+        self.model_cache = {'key': model_key, 'line_arrays': self.line_arrays, 'parameter_map': parameter_map, 'values': values, 'vector': vector,
+                            'baseline_params': parameter_map['baseline_params'], 'line_params': line_params, 'segments': segment_records, 'residuals': total_residuals,
+                            'buffers': buffers, 'state': state_snapshot}
+        #lmfit keeps the returned residuals, so the buffer is copied
+        return total_residuals.copy()
+
+    def _simulate_segments(self, simulations):
+        """Simulates the lines of each (HTP_model, linelist, wavenumbers, simulation_kwargs, spectrum_number, start, stop, x_shift) task of the simulation model and returns the coefficients in the order of the tasks, using the process pool if n_workers is greater than 1.
+        """
+        if (self.n_workers == None) or (self.n_workers <= 1) or (len(simulations) <= 1):
+            return [HTP_model(linelist, wavenumbers, **simulation_kwargs)[1] for HTP_model, linelist, wavenumbers, simulation_kwargs, spectrum_number, start, stop, x_shift in simulations]
+        executor = self._simulation_pool()
+        tasks = []
+        for HTP_model, linelist, wavenumbers, simulation_kwargs, spectrum_number, start, stop, x_shift in simulations:
+            simulation_kwargs = {key: simulation_kwargs[key] for key in simulation_kwargs if key not in SPECTRUM_SIMULATION_KWARGS}
+            tasks.append((HTP_model, linelist, spectrum_number, start, stop, x_shift, simulation_kwargs))
+        return list(executor.map(_simulate_segment, tasks))
+
+    def _simulation_pool(self):
+        """Returns the process pool executor of the simulation workers, starting it (and the shared memory wavenumber buffers of the spectra) if needed.  The buffers are refreshed if the spectrum wavenumbers have changed, and the pool is restarted if the fixed simulation keyword arguments of the spectra have changed (compared by value).
+
+        The workers are forked where possible and spawned otherwise (ie on Windows).  The HAPI TIPS versions are sent to the workers by name (see _worker_kwargs), so a spawned pool only needs the other keyword arguments (and a user-defined TIPS function) to be picklable.
+        """
+        wavenumbers = {spectrum.spectrum_number: np.asarray(spectrum.wavenumber, dtype = float) for spectrum in self.dataset.spectra}
+        spectrum_kwargs = {spectrum.spectrum_number: {'isotope_list': self.dataset.isotope_list, 'natural_abundance': spectrum.natural_abundance, 'abundance_ratio_MI': spectrum.abundance_ratio_MI,
+                                                      'Diluent': spectrum.Diluent, 'TIPS': spectrum.TIPS} for spectrum in self.dataset.spectra}
+        lengths = {spectrum_number: len(wavenumbers[spectrum_number]) for spectrum_number in wavenumbers}
+        pool = self.simulation_pool
+        if (pool != None) and (pool['n_workers'] == self.n_workers) and (pool['lengths'] == lengths) and (pool['spectrum_kwargs'] == spectrum_kwargs):
+            for spectrum_number in wavenumbers:
+                shared_wavenumbers = np.ndarray(wavenumbers[spectrum_number].shape, dtype = float, buffer = pool['buffers'][spectrum_number].buf)
+                if not np.array_equal(shared_wavenumbers, wavenumbers[spectrum_number]):
+                    shared_wavenumbers[:] = wavenumbers[spectrum_number]
+            return pool['executor']
+        self.close_pool()
+        #The workers are given a deep copy, so that the pool is restarted if the keyword arguments are edited in place (ie the Diluent composition)
+        spectrum_kwargs = copy.deepcopy(spectrum_kwargs)
+        buffers = {}
+        for spectrum_number in wavenumbers:
+            buffers[spectrum_number] = shared_memory.SharedMemory(create = True, size = max(wavenumbers[spectrum_number].nbytes, 1))
+            np.ndarray(wavenumbers[spectrum_number].shape, dtype = float, buffer = buffers[spectrum_number].buf)[:] = wavenumbers[spectrum_number]
+        if 'fork' in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context('fork')
+        else:
+            mp_context = multiprocessing.get_context('spawn')
+        executor = ProcessPoolExecutor(max_workers = self.n_workers, mp_context = mp_context, initializer = _init_simulation_worker,
+                                       initargs = ({spectrum_number: (buffers[spectrum_number].name, lengths[spectrum_number]) for spectrum_number in buffers}, _worker_kwargs(spectrum_kwargs)))
+        self.simulation_pool = {'executor': executor, 'n_workers': self.n_workers, 'buffers': buffers, 'lengths': lengths, 'spectrum_kwargs': spectrum_kwargs,
+                                'finalizer': weakref.finalize(self, _close_simulation_pool, executor, list(buffers.values()))}
+        return executor
+
+    def close_pool(self):
+        """Shuts down the process pool of the simulation workers (see n_workers) and releases the shared memory wavenumber buffers.  The pool is started again at the next evaluation of the simulation model if n_workers is greater than 1.
+        """
+        if self.simulation_pool != None:
+            self.simulation_pool['finalizer']()
+            self.simulation_pool = None
+
+    def _segment_derivative(self, spectrum, record, absorbance = 0, baseline = 0):
+        """Propagates the derivative of the absorption and/or baseline terms of a spectrum segment through the ILS and weighting to the derivative of the segment residuals.
+        """
+        zeros = np.zeros(len(record['wavenumbers']))
+        derivative_record = dict(record, absorbance = zeros + absorbance, baseline = zeros + baseline, etalons = zeros, CIA = zeros, alpha = zeros)
+        return self._segment_residuals(spectrum, derivative_record)
+
+    def jacobian(self, params, wing_cutoff = 25, wing_wavenumbers = 25, wing_method = 'wing_cutoff', analytic_derivatives = True):
+        """Calculates the Jacobian of the simulation model residuals with respect to the floated parameters, which is used as the Dfun in fit_data.
+
+        Outline
+
+        1.  Makes sure that the model_cache holds a full evaluation of the simulation model at params
+
+        2.  Baseline and etalon parameters: analytic derivatives of the baseline polynomial and etalon terms of the segment
+
+        3.  sw: the line contribution is linear in the line intensity, so the derivative is the line contribution divided by sw
+
+        4.  Other line parameters (nu, gamma0, delta0, ...): central difference of only that line's contribution within its simulation window
+
+        5.  molefraction: the absorption is linear in the mole fraction, so the derivative is the absorption of that molecule's lines at a mole fraction of 1
+
+        6.  Any other parameter (ie x_shift, Pressure, Temperature, ILS resolution, CIA) or a parameter used in a constraint expression other than an alias (expr = 'parameter name') uses a forward finite difference of the simulation model.  Parameters that affect different residuals (see jacobian_sparsity) are stepped together in one evaluation
+
+        Constraints that are aliases of a floated parameter (ie the etalon amplitude of each spectrum set equal to the first spectrum) are added to the derivative of the floated parameter.
+
+        Parameters
+        ----------
+        params : lmfit parameter object
+            the params object is a dictionary comprised of all parameters translated from dataframes into a dictionary format compatible with lmfit.
+        wing_cutoff : float, optional
+            number of voigt half-widths to simulate on either side of each line. The default is 25.
+        wing_wavenumbers : float, optional
+            number of wavenumbers to simulate on either side of each line. The default is 25
+        wing_method : TYPE, optional
+            Provides choice between the wing_cutoff and wing_wavenumbers line cut-off options. The default is 'wing_cutoff'.
+        analytic_derivatives : bool, optional
+            If False, then all of the derivatives are grouped forward finite differences of the simulation model (see finite_difference_jacobian). The default is True.
+
+        Returns
+        -------
+        jacobian : array
+            derivative of the residuals (rows) with respect to each floated parameter (columns), in the order of the parameters.
+
+        """
+        var_names = [param for param in params if params[param].vary and (params[param].expr == None)]
+        return self._jacobian_columns(params, var_names, wing_cutoff, wing_wavenumbers, wing_method, analytic_derivatives)
+
+    def _jacobian_columns(self, params, var_names, wing_cutoff, wing_wavenumbers, wing_method, analytic_derivatives = True):
+        """Calculates the derivatives of the simulation model residuals with respect to the parameters in var_names (see jacobian).
+        """
+        self._apply_ties(params)
+        values = params.valuesdict()
+        cache = self._reference_evaluation(params, values, wing_cutoff, wing_wavenumbers, wing_method)
+        reference_residuals = cache['residuals']
+        spectra = {spectrum.spectrum_number: spectrum for spectrum in self.dataset.spectra}
+        step = np.sqrt(np.finfo(float).eps)
+        aliases, finite_difference = self._constraint_structure(params)
+
+        #Reference contribution of a line for each segment
+        line_contributions = {}
+        def line_contribution(spectrum_number, line):
+            if (spectrum_number, line) not in line_contributions:
+                line_arrays = self.line_arrays[spectrum_number]
+                reference_line = line_arrays.take([line_arrays.positions[line]])
+                for param, parameter in cache['line_params'][spectrum_number][line]:
+                    reference_line.set_value(param, line, float(values[parameter]))
+                contributions = {}
+                for (spectrum_num, segment), record in cache['segments'].items():
+                    if spectrum_num == spectrum_number:
+                        contributions[segment] = record['HTP_model'](reference_line, record['wavenumbers'], **record['simulation_kwargs'])[1]
+                line_contributions[(spectrum_number, line)] = (reference_line, contributions)
+            return line_contributions[(spectrum_number, line)]
+
+        jacobian = np.zeros((len(reference_residuals), len(var_names)))
+        finite_difference_columns = []
+        for column, var_name in enumerate(var_names):
+            parameters = _alias_closure(var_name, aliases)
+            analytic = analytic_derivatives and (var_name not in finite_difference)
+            derivative = np.zeros(len(reference_residuals))
+            for parameter in parameters:
+                if not analytic:
+                    break
+                if parameter.startswith('baseline_') or parameter.startswith('etalon_'):
+                    spectrum_number, segment = [int(value) for value in parameter.split('_')[-2:]]
+                    record = cache['segments'].get((spectrum_number, segment))
+                    if record == None:
+                        continue
+                    if parameter.startswith('baseline_'):
+                        d_baseline = record['wavenumbers_relative']**(ord(parameter[9]) - 97)
                     else:
-                        pt_by_pt_weights= 1 / (spectrum.tau_stats[np.min(indices_segments[segment]): np.max(indices_segments[segment])+1])
-                        weights = spectrum.weight * pt_by_pt_weights
-                    residuals[np.min(indices_segments[segment]): np.max(indices_segments[segment])+1]  = ((segment_alpha) - alpha_segments[segment])*weights
+                        etalon_num = parameter.split('_')[1]
+                        amp = float(values.get('etalon_' + etalon_num + '_amp_' + str(spectrum_number) + '_' + str(segment), 0))
+                        period = float(values.get('etalon_' + etalon_num + '_period_' + str(spectrum_number) + '_' + str(segment), 1))
+                        phase = float(values.get('etalon_' + etalon_num + '_phase_' + str(spectrum_number) + '_' + str(segment), 0))
+                        etalon_phase = (2*np.pi * period)*record['wavenumbers_relative'] + phase
+                        if '_amp_' in parameter:
+                            d_baseline = np.sin(etalon_phase)
+                        elif '_period_' in parameter:
+                            d_baseline = amp*np.cos(etalon_phase)*(2*np.pi)*record['wavenumbers_relative']
+                        else:
+                            d_baseline = amp*np.cos(etalon_phase)
+                    derivative[record['offset'] + record['start']: record['offset'] + record['stop']] += self._segment_derivative(spectra[spectrum_number], record, baseline = d_baseline)
+                elif parameter.startswith('molefraction_'):
+                    spectrum_number, segment = [int(value) for value in parameter.split('_')[-2:]]
+                    record = cache['segments'].get((spectrum_number, segment))
+                    if record == None:
+                        continue
+                    molecules = [molecule for molecule in spectra[spectrum_number].molefraction if parameter == ('molefraction_'+ self.dataset.isotope_list[(molecule, 1)][4]) + '_' + str(spectrum_number) + '_' + str(segment)]
+                    line_arrays = self.line_arrays[spectrum_number]
+                    molecule_lines = line_arrays.take(line_arrays.molec_id == molecules[0])
+                    for line in cache['line_params'][spectrum_number]:
+                        if line in molecule_lines.positions:
+                            for param, line_parameter in cache['line_params'][spectrum_number][line]:
+                                molecule_lines.set_value(param, line, float(values[line_parameter]))
+                    d_absorbance = record['HTP_model'](molecule_lines, record['wavenumbers'], **dict(record['simulation_kwargs'], molefraction = {molecules[0]: 1}))[1]*1e6
+                    derivative[record['offset'] + record['start']: record['offset'] + record['stop']] += self._segment_derivative(spectra[spectrum_number], record, absorbance = d_absorbance)
+                elif ('_line_' in parameter) and (parameter not in cache['baseline_params']):
+                    line = int(parameter[parameter.find('_line_') + 6:])
+                    param = parameter[:parameter.find('_line_')]
+                    for spectrum_number in cache['line_params']:
+                        if (line not in cache['line_params'][spectrum_number]) or ((param, parameter) not in cache['line_params'][spectrum_number][line]):
+                            continue
+                        reference_line, contributions = line_contribution(spectrum_number, line)
+                        value = float(values[parameter])
+                        if (self.line_arrays[spectrum_number].columns[param][0] == 'sw') and (value != 0):
+                            d_contributions = {segment: contributions[segment] / value for segment in contributions}
+                        else:
+                            if self.line_arrays[spectrum_number].columns[param][0] == 'nu':
+                                #Line center step (cm-1) that is small compared to the line widths, but large compared to the rounding error of nu
+                                h = 1e-6
+                            else:
+                                h = step*max(abs(value), 1)
+                            #Central difference within the bounds of the parameter, which is one-sided (from the reference contribution) at a bound
+                            upper_value = min(value + h, params[var_name].max, params[parameter].max)
+                            lower_value = max(value - h, params[var_name].min, params[parameter].min)
+                            if upper_value <= lower_value:
+                                continue
+                            upper_line = reference_line.copy()
+                            upper_line.set_value(param, line, upper_value)
+                            lower_line = reference_line.copy()
+                            lower_line.set_value(param, line, lower_value)
+                            d_contributions = {}
+                            for segment in contributions:
+                                record = cache['segments'][(spectrum_number, segment)]
+                                if upper_value == value:
+                                    upper_coef = contributions[segment]
+                                else:
+                                    upper_coef = record['HTP_model'](upper_line, record['wavenumbers'], **record['simulation_kwargs'])[1]
+                                if lower_value == value:
+                                    lower_coef = contributions[segment]
+                                else:
+                                    lower_coef = record['HTP_model'](lower_line, record['wavenumbers'], **record['simulation_kwargs'])[1]
+                                d_contributions[segment] = (upper_coef - lower_coef) / (upper_value - lower_value)
+                        for segment in d_contributions:
+                            record = cache['segments'][(spectrum_number, segment)]
+                            derivative[record['offset'] + record['start']: record['offset'] + record['stop']] += self._segment_derivative(spectra[spectrum_number], record, absorbance = d_contributions[segment]*1e6)
+                else:
+                    analytic = False
+            if analytic:
+                jacobian[:, column] = derivative
+            else:
+                finite_difference_columns.append(column)
+
+        #Forward finite differences of the simulation model, where parameters that affect different residuals (ie the x_shift of each segment) are stepped together
+        groups = []
+        if finite_difference_columns:
+            parameter_rows = self._parameter_rows(params, values, cache, wing_cutoff, wing_wavenumbers, wing_method)
+        for column in finite_difference_columns:
+            rows = self._variable_rows(var_names[column], parameter_rows, aliases, finite_difference, len(reference_residuals))
+            for group in groups:
+                if not np.any(group['rows'][rows]):
+                    break
+            else:
+                group = {'rows': np.zeros(len(reference_residuals), dtype = bool), 'columns': []}
+                groups.append(group)
+            group['rows'][rows] = True
+            group['columns'].append((column, rows))
+        for group in groups:
+            steps = {}
+            for column, rows in group['columns']:
+                var_name = var_names[column]
+                value = params[var_name].value
+                h = step*max(abs(value), 1)
+                if (params[var_name].max != None) and (value + h > params[var_name].max):
+                    h = -h
+                if (params[var_name].min != None) and (value + h < params[var_name].min):
+                    #The bounds are closer than the step on both sides, so the step is taken to the farther bound
+                    h = max(params[var_name].max - value, params[var_name].min - value, key = abs)
+                steps[var_name] = (value, h)
+                params[var_name].value = value + h
+            params.update_constraints()
+            difference = self.simulation_model(params, wing_cutoff = wing_cutoff, wing_wavenumbers = wing_wavenumbers, wing_method = wing_method) - reference_residuals
+            for var_name in steps:
+                params[var_name].value = steps[var_name][0]
+            params.update_constraints()
+            #Keeps the reference evaluation in the model_cache
+            self.model_cache = cache
+            for column, rows in group['columns']:
+                if steps[var_names[column]][1] != 0:
+                    jacobian[rows, column] = difference[rows] / steps[var_names[column]][1]
+        return jacobian
+
+    def finite_difference_jacobian(self, params, wing_cutoff = 25, wing_wavenumbers = 25, wing_method = 'wing_cutoff'):
+        """Calculates the Jacobian of the simulation model residuals by forward finite differences, where the floated parameters that affect different residuals (see jacobian_sparsity) are stepped together in one evaluation of the simulation model.
+
+        Parameters
+        ----------
+        params : lmfit parameter object
+            the params object is a dictionary comprised of all parameters translated from dataframes into a dictionary format compatible with lmfit.
+        wing_cutoff : float, optional
+            number of voigt half-widths to simulate on either side of each line. The default is 25.
+        wing_wavenumbers : float, optional
+            number of wavenumbers to simulate on either side of each line. The default is 25
+        wing_method : TYPE, optional
+            Provides choice between the wing_cutoff and wing_wavenumbers line cut-off options. The default is 'wing_cutoff'.
+
+        Returns
+        -------
+        jacobian : array
+            derivative of the residuals (rows) with respect to each floated parameter (columns), in the order of the parameters.
+
+        """
+        return self.jacobian(params, wing_cutoff = wing_cutoff, wing_wavenumbers = wing_wavenumbers, wing_method = wing_method, analytic_derivatives = False)
+
+    def _reference_evaluation(self, params, values, wing_cutoff, wing_wavenumbers, wing_method):
+        """Makes sure that the model_cache holds a full evaluation of the simulation model at the parameter values and returns it.
+        """
+        model_key = (wing_cutoff, wing_wavenumbers, wing_method, self.beta_formalism, self.lineshape_backend, self.weight_spectra)
+        if (self.model_cache == None) or (self.model_cache['key'] != model_key) or (self.model_cache['line_arrays'] is not self.line_arrays) or (self.model_cache['values'] != values) or (not _same_state(self._model_state(), self.model_cache['state'])):
+            self.model_cache = None
+            self.simulation_model(params, wing_cutoff = wing_cutoff, wing_wavenumbers = wing_wavenumbers, wing_method = wing_method)
+        return self.model_cache
+
+    def _constraint_structure(self, params):
+        """Finds the aliases (expr = 'parameter name') of each parameter and the parameters used in any other constraint expression.
+        """
+        aliases = {}
+        finite_difference = set()
+        #Ties compiled from the constraint expressions during a fit (see _compile_ties)
+        if self.parameter_ties != None:
+            ties = self.parameter_ties
+            for param, source, scale, offset in zip(ties['names'], ties['sources'], ties['scale'], ties['offset']):
+                if (scale == 1) and (offset == 0):
+                    aliases.setdefault(source, []).append(param)
+                else:
+                    finite_difference.add(source)
+        for param in params:
+            if params[param].expr != None:
+                expr = params[param].expr.strip()
+                if expr in params:
+                    aliases.setdefault(expr, []).append(param)
                 else:
-                    residuals[np.min(indices_segments[segment]): np.max(indices_segments[segment])+1]  = (segment_alpha) - alpha_segments[segment]
+                    finite_difference.update(name for name in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', expr) if name in params)
+        return aliases, finite_difference
+
+    def _variable_rows(self, var_name, parameter_rows, aliases, finite_difference, n_residuals):
+        """Returns the residuals that can depend on a floated parameter as a boolean mask, including the residuals of its aliases.
+        """
+        rows = np.zeros(n_residuals, dtype = bool)
+        if var_name in finite_difference:
+            rows[:] = True
+            return rows
+        for parameter in _alias_closure(var_name, aliases):
+            rows[parameter_rows.get(parameter, slice(None))] = True
+        return rows
+
+    def _parameter_rows(self, params, values, cache, wing_cutoff, wing_wavenumbers, wing_method, window_factor = 2):
+        """Maps each parameter to the residuals it can affect, from the spectrum and segment in the parameter name or from the simulation windows of the line.
+
+        Parameters ending in _spectrum_segment (baseline, etalon, x_shift, Pressure, Temperature, molefraction, and ILS resolution) affect the residuals of that segment.  Line parameters affect the points within window_factor times the simulation window of the line (plus the ILS wing), so that the pattern still holds when the widths change during the fit.  Other parameters (ie CIA) are mapped to slice(None), all residuals.
+        """
+        spectra = {spectrum.spectrum_number: spectrum for spectrum in self.dataset.spectra}
+        segment_rows = {}
+        for (spectrum_number, segment), record in cache['segments'].items():
+            segment_rows[(spectrum_number, segment)] = np.arange(record['offset'] + record['start'], record['offset'] + record['stop'])
+        parameter_rows = {}
+        line_rows = {}
+        for spectrum_number in cache['line_params']:
+            line_arrays = self.line_arrays[spectrum_number].copy()
+            for line in cache['line_params'][spectrum_number]:
+                for param, parameter in cache['line_params'][spectrum_number][line]:
+                    line_arrays.set_value(param, line, float(values[parameter]))
+            for (spectrum_num, segment), record in cache['segments'].items():
+                if spectrum_num != spectrum_number:
+                    continue
+                kwargs = record['simulation_kwargs']
+                Diluent = kwargs['Diluent']
+                if not Diluent:
+                    Diluent = {'air': {'composition':1, 'm':28.95734}}
+                SigmaT, SigmaTref, m, abun_ratio = _isotope_properties(line_arrays, kwargs['T'], 296., kwargs['TIPS'], kwargs['isotope_list'], kwargs['natural_abundance'], kwargs['abundance_ratio_MI'])
+                GammaD = np.sqrt(2*CONSTANTS['k']*CONSTANTS['Na']*kwargs['T']*np.log(2)/m)*line_arrays.nu / CONSTANTS['c']
+                Gamma0 = _diluent_line_parameters(line_arrays, Diluent, kwargs['p'], kwargs['T'], 1., 296.)[0]
+                window = window_factor*_line_cutoff(np.abs(Gamma0), GammaD, wing_cutoff, wing_wavenumbers, wing_method)
+                if spectra[spectrum_number].ILS_function != None:
+                    window += spectra[spectrum_number].ILS_wing
+                lower = np.searchsorted(record['wavenumbers'], line_arrays.nu - window, side = 'left')
+                upper = np.searchsorted(record['wavenumbers'], line_arrays.nu + window, side = 'right')
+                for line in cache['line_params'][spectrum_number]:
+                    position = line_arrays.positions[line]
+                    rows = segment_rows[(spectrum_number, segment)][lower[position]:upper[position]]
+                    for param, parameter in cache['line_params'][spectrum_number][line]:
+                        line_rows.setdefault(parameter, []).append(rows)
+        for param in params:
+            if param in line_rows:
+                parameter_rows[param] = np.concatenate(line_rows[param])
+            elif ('_line_' in param) and (param not in cache['baseline_params']):
+                parameter_rows[param] = np.zeros(0, dtype = int)
+            elif param in cache['baseline_params']:
+                spectrum_number, segment = [int(value) for value in param.split('_')[-2:]]
+                parameter_rows[param] = segment_rows.get((spectrum_number, segment), np.zeros(0, dtype = int))
+            else:
+                parameter_rows[param] = slice(None)
+        return parameter_rows
+
+    def jacobian_sparsity(self, params, wing_cutoff = 25, wing_wavenumbers = 25, wing_method = 'wing_cutoff'):
+        """Derives the sparsity structure of the Jacobian of the simulation model residuals with respect to the floated parameters, which is used to group the finite differences in finite_difference_jacobian and can be passed to scipy least_squares as the jac_sparsity.
+
+        Each baseline, etalon, x_shift, Pressure, Temperature, molefraction, and ILS resolution parameter only affects the segment in its name, and each line parameter only affects the points within twice the simulation window of the line in the spectra that use the parameter.  Aliases (expr = 'parameter name') add their pattern to the floated parameter.  CIA parameters and parameters used in other constraint expressions are treated as affecting all residuals.
+
+        Parameters
+        ----------
+        params : lmfit parameter object
+            the params object is a dictionary comprised of all parameters translated from dataframes into a dictionary format compatible with lmfit.
+        wing_cutoff : float, optional
+            number of voigt half-widths to simulate on either side of each line. The default is 25.
+        wing_wavenumbers : float, optional
+            number of wavenumbers to simulate on either side of each line. The default is 25
+        wing_method : TYPE, optional
+            Provides choice between the wing_cutoff and wing_wavenumbers line cut-off options. The default is 'wing_cutoff'.
+
+        Returns
+        -------
+        sparsity : sparse matrix
+            scipy sparse matrix with a 1 where a residual (row) can depend on a floated parameter (column).
+
+        """
+        values = params.valuesdict()
+        cache = self._reference_evaluation(params, values, wing_cutoff, wing_wavenumbers, wing_method)
+        n_residuals = len(cache['residuals'])
+        aliases, finite_difference = self._constraint_structure(params)
+        parameter_rows = self._parameter_rows(params, values, cache, wing_cutoff, wing_wavenumbers, wing_method)
+        var_names = [param for param in params if params[param].vary and (params[param].expr == None)]
+        sparsity = lil_matrix((n_residuals, len(var_names)), dtype = int)
+        for column, var_name in enumerate(var_names):
+            sparsity[np.flatnonzero(self._variable_rows(var_name, parameter_rows, aliases, finite_difference, n_residuals)), column] = 1
+        return sparsity.tocsr()
+
+    def linear_parameters(self, params):
+        """Finds the floated parameters that the simulation model is linear in, which are solved by linear least squares in the 'varpro' fit method.
+
+        The baseline coefficients, the etalon amplitudes, and (at a fixed line shape) the line intensities (sw) are linear.  The molefraction of a molecule is linear if none of the line intensities of that molecule are floated, since the absorption depends on their product.  Parameters used in constraint expressions other than aliases (expr = 'parameter name') are treated as nonlinear.
+
+        Parameters
+        ----------
+        params : lmfit parameter object
+            the params object is a dictionary comprised of all parameters translated from dataframes into a dictionary format compatible with lmfit.
+
+        Returns
+        -------
+        linear_names : list
+            names of the linear parameters, in the order of the parameters.
+
+        """
+        aliases, finite_difference = self._constraint_structure(params)
+        sw_columns = set()
+        for spectrum_number in self.line_arrays:
+            for column in self.line_arrays[spectrum_number].columns:
+                if self.line_arrays[spectrum_number].columns[column][0] == 'sw':
+                    sw_columns.add(column)
+        floated = [param for param in params if params[param].vary and (params[param].expr == None) and (param not in finite_difference)]
+        linear_names = []
+        sw_molecules = set()
+        for param in floated:
+            if ('_line_' in param) and (param[:param.find('_line_')] in sw_columns):
+                line = int(param[param.find('_line_') + 6:])
+                for spectrum_number in self.line_arrays:
+                    if line in self.line_arrays[spectrum_number].positions:
+                        sw_molecules.add(int(self.line_arrays[spectrum_number].molec_id[self.line_arrays[spectrum_number].positions[line]]))
+                linear_names.append(param)
+            elif param.startswith('baseline_') or (param.startswith('etalon_') and ('_amp_' in param)):
+                linear_names.append(param)
+        for param in floated:
+            if param.startswith('molefraction_'):
+                molecules = set()
+                for spectrum in self.dataset.spectra:
+                    for molecule in spectrum.molefraction:
+                        if param == ('molefraction_'+ self.dataset.isotope_list[(molecule, 1)][4]) + '_' + str(spectrum.spectrum_number) + param[param.rfind('_'):]:
+                            molecules.add(molecule)
+                if len(molecules & sw_molecules) == 0:
+                    linear_names.append(param)
+        return [param for param in params if param in linear_names]
+
+    def _varpro_residuals(self, params, linear_names, wing_cutoff, wing_wavenumbers, wing_method):
+        """Solves the linear parameters for the current nonlinear parameters by bounded linear least squares, updates them in params, and returns the resulting residuals (variable projection).
+        """
+        residuals = self.simulation_model(params, wing_cutoff = wing_cutoff, wing_wavenumbers = wing_wavenumbers, wing_method = wing_method)
+        if len(linear_names) == 0:
+            return residuals
+        linear_jacobian = self._jacobian_columns(params, linear_names, wing_cutoff, wing_wavenumbers, wing_method)
+        linear_values = np.asarray([params[name].value for name in linear_names], dtype = float)
+        lower = np.asarray([params[name].min for name in linear_names], dtype = float) - linear_values
+        upper = np.asarray([params[name].max for name in linear_names], dtype = float) - linear_values
+        linear_step = lsq_linear(linear_jacobian, -residuals, bounds = (lower, upper), method = 'bvls').x
+        for name, value in zip(linear_names, linear_values + linear_step):
+            params[name].value = value
+        params.update_constraints()
+        #The model is linear in the linear parameters, so their derivatives are the same at the solved values and are kept for _varpro_jacobian
+        self.varpro_cache = {'key': (wing_cutoff, wing_wavenumbers, wing_method), 'linear_names': linear_names, 'values': params.valuesdict(), 'linear_jacobian': linear_jacobian}
+        return residuals + linear_jacobian @ linear_step
+
+    def _varpro_jacobian(self, params, linear_names, wing_cutoff, wing_wavenumbers, wing_method):
+        """Jacobian of the variable projection residuals with respect to the nonlinear parameters in the Kaufman approximation, where the derivatives are projected onto the complement of the linear parameter derivatives.
+
+        The linear parameter derivatives of the last _varpro_residuals evaluation are reused (see varpro_cache) if params is at that evaluation, as when the minimizer asks for the Jacobian at its last step.
+        """
+        cache = self.varpro_cache
+        if (cache == None) or (cache['key'] != (wing_cutoff, wing_wavenumbers, wing_method)) or (cache['linear_names'] != linear_names) or (cache['values'] != params.valuesdict()):
+            self._varpro_residuals(params, linear_names, wing_cutoff, wing_wavenumbers, wing_method)
+        var_names = [param for param in params if params[param].vary and (params[param].expr == None)]
+        jacobian = self._jacobian_columns(params, var_names, wing_cutoff, wing_wavenumbers, wing_method)
+        if len(linear_names) == 0:
+            return jacobian
+        linear_jacobian = self.varpro_cache['linear_jacobian']
+        return jacobian - linear_jacobian @ np.linalg.lstsq(linear_jacobian, jacobian, rcond = None)[0]
 
-            total_simulated = np.append(total_simulated, simulated_spectra)
-            total_residuals = np.append(total_residuals, residuals)
-        total_residuals = np.asarray(total_residuals)
-        total_simulated = np.asarray(total_simulated)
-        return total_residuals
     def fit_data(self, params, wing_cutoff = 25, wing_wavenumbers = 25, wing_method = 'wing_cutoff', xtol = 1e-7, maxfev = 2000, ftol = 1e-7, 
-                 method = 'least_squares'):
+                 method = 'least_squares', analytic_jacobian = True, sparse_jacobian = True, backend = 'lmfit'):
         """Uses the lmfit minimizer to do the fitting through the simulation model function.
 
 
@@ -1296,6 +2044,15 @@ class Fit_DataSet:
         method : string, optional
         定义 LMFIT 中选项中的最小化方法（不是所有都有效）。已在使用 Levenberg-Marquardt 算法的 'leastsq' 和使用信任区域反射方法的 'least_squares' 上进行了测试。
             Defines the minimization method from the options in LMFIT (not all will work).  Has been tested on the 'leastsq' which uses the Levenberg-Marquardt algorithm and 'least_squares' which uses the Trust Region Reflective method.
+            'varpro' uses variable projection, where the linear parameters (see linear_parameters) are solved by linear least squares at every evaluation and 'least_squares' only fits the nonlinear parameters, followed by a 'least_squares' fit of all parameters from that solution to get the uncertainties.  The nfev of the result includes the evaluations of the variable projection stage, which are also given as result.varpro_nfev.
+        analytic_jacobian : bool, optional
+            If True, then the 'leastsq' and 'least_squares' methods use the jacobian function (analytic and line-local derivatives) as the Dfun instead of finite differences of the full simulation model. The default is True.
+        sparse_jacobian : bool, optional
+            If True and analytic_jacobian is False, then the finite_difference_jacobian, which steps the parameters that affect different residuals together (see jacobian_sparsity), is used as the Dfun instead of stepping one parameter at a time. The default is True.
+        backend : str, optional
+            'lmfit' uses the lmfit Minimizer.  'array' calls scipy.optimize.least_squares directly on the vector of the floated parameter values with their bounds, so the lmfit Parameters are not updated at each evaluation (see _minimize_array).  The 'array' backend only supports the 'least_squares' method and constraint expressions that are compiled into ties.  The default is 'lmfit'.
+
+        NOTE: Constraint expressions of the form [scale*]parameter[ +/- offset], as set by constrained_baseline and constrained_CIA, are compiled into ties (see _compile_ties).  The tied parameters are set from their source parameters before each evaluation instead of being evaluated by lmfit, so the minimizer only sees the free parameters.  The constraint expressions are restored in the result parameters.
 
         Returns
         -------
@@ -1303,8 +2060,32 @@ class Fit_DataSet:
             contains all fit results as LMFit results object.
 
         """
+        if backend not in ['lmfit', 'array']:
+            raise ValueError("backend must be 'lmfit' or 'array', not '%s'" % backend)
+        if (backend == 'array') and (method != 'least_squares'):
+            raise ValueError("backend = 'array' only supports method = 'least_squares', not '%s'" % method)
+        self.background_cache = {}
+        self.model_cache = None
+        self.varpro_cache = None
+        #Affine constraints (ie the segment and CIA constraints) are compiled into ties that are applied before each evaluation, so the minimizer only sees the free parameters
+        ties = self._compile_ties(params)
+        params = self._free_parameters(params, ties)
+        self.parameter_ties = ties
+        try:
+            if backend == 'array':
+                result = self._minimize_array(params, wing_cutoff, wing_wavenumbers, wing_method, xtol, maxfev, ftol, analytic_jacobian, sparse_jacobian)
+            else:
+                result = self._minimize(params, wing_cutoff, wing_wavenumbers, wing_method, xtol, maxfev, ftol, method, analytic_jacobian, sparse_jacobian)
+        finally:
+            self.parameter_ties = None
+        self._restore_ties(result.params, ties)
+        return result
+
+    def _minimize(self, params, wing_cutoff, wing_wavenumbers, wing_method, xtol, maxfev, ftol, method, analytic_jacobian, sparse_jacobian):
+        """Sets up the lmfit Minimizer for the fit method and minimizes the simulation model residuals (see fit_data).
+        """
+        varpro_nfev = None
         if (method == 'least_squares') or (method == 'leastsq'):
-            minner = Minimizer(self.simulation_model, params, xtol =xtol, max_nfev =  maxfev, ftol = ftol, fcn_args=(wing_cutoff, wing_wavenumbers, wing_method))
             floated_parameters = False
             for param in params:
                 if params[param].vary == True:
@@ -1312,10 +2093,135 @@ class Fit_DataSet:
             if floated_parameters == False:
                 if method == 'least_squares':
                     method = 'leastsq'
+            if analytic_jacobian and floated_parameters:
+                minner = Minimizer(self.simulation_model, params, xtol =xtol, max_nfev =  maxfev, ftol = ftol, fcn_args=(wing_cutoff, wing_wavenumbers, wing_method), Dfun = self.jacobian)
+            elif sparse_jacobian and floated_parameters:
+                minner = Minimizer(self.simulation_model, params, xtol =xtol, max_nfev =  maxfev, ftol = ftol, fcn_args=(wing_cutoff, wing_wavenumbers, wing_method), Dfun = self.finite_difference_jacobian)
+            else:
+                minner = Minimizer(self.simulation_model, params, xtol =xtol, max_nfev =  maxfev, ftol = ftol, fcn_args=(wing_cutoff, wing_wavenumbers, wing_method))
+        elif method == 'varpro':
+            #Variable projection: the linear parameters are solved at every evaluation, so that the minimizer only sees the nonlinear parameters
+            linear_names = self.linear_parameters(params)
+            varpro_params = params.copy()
+            for name in linear_names:
+                varpro_params[name].vary = False
+            if any((varpro_params[param].vary == True) and (varpro_params[param].expr == None) for param in varpro_params):
+                minner = Minimizer(self._varpro_residuals, varpro_params, xtol =xtol, max_nfev =  maxfev, ftol = ftol, fcn_args=(linear_names, wing_cutoff, wing_wavenumbers, wing_method), Dfun = self._varpro_jacobian)
+                varpro_result = minner.minimize(method = 'least_squares')
+                varpro_params = varpro_result.params
+                varpro_nfev = varpro_result.nfev
+            else:
+                self._varpro_residuals(varpro_params, linear_names, wing_cutoff, wing_wavenumbers, wing_method)
+                varpro_nfev = 1
+            #Final least_squares fit with the linear parameters floated again, starting from the variable projection solution, which gives the uncertainties of all of the parameters
+            for name in linear_names:
+                varpro_params[name].vary = True
+            self.model_cache = None
+            self.varpro_cache = None
+            minner = Minimizer(self.simulation_model, varpro_params, xtol =xtol, max_nfev =  maxfev, ftol = ftol, fcn_args=(wing_cutoff, wing_wavenumbers, wing_method), Dfun = self.jacobian)
+            method = 'least_squares'
         else: 
             minner = Minimizer(self.simulation_model, params, max_nfev =  maxfev, fcn_args=(wing_cutoff, wing_wavenumbers, wing_method))
             #could add Ns = 20, and keep = 50
         result = minner.minimize(method = method)#'
+        if varpro_nfev != None:
+            #The evaluations of the variable projection stage are counted in the nfev of the result, and are also kept as varpro_nfev
+            result.varpro_nfev = varpro_nfev
+            result.nfev += varpro_nfev
+        return result
+
+    def _minimize_array(self, params, wing_cutoff, wing_wavenumbers, wing_method, xtol, maxfev, ftol, analytic_jacobian, sparse_jacobian):
+        """Minimizes the simulation model residuals with scipy.optimize.least_squares on the vector of the floated parameter values (see fit_data).
+
+        The parameter map is compiled once, and each evaluation scatters the floated values into the vector of all parameter values, sets the tied values (clipped to their bounds, as lmfit does) with one vectorized assignment, and calls the simulation model on the vector.  The lmfit Parameters are only updated for the Jacobian, which is calculated as in the 'lmfit' backend.
+
+        Returns
+        -------
+        result : LMFit result Object
+            lmfit MinimizerResult with the fit parameters, residual, fit statistics, and covariance, as returned by the 'least_squares' method of the lmfit Minimizer.
+
+        """
+        if any(params[param].expr != None for param in params):
+            raise ValueError("backend = 'array' only supports constraint expressions of the form [scale*]parameter[ +/- offset]")
+        names = list(params)
+        parameter_map = self._parameter_map(params)
+        vector = np.fromiter((par.value for par in params.values()), dtype = float, count = len(names))
+        free = np.asarray([position for position, param in enumerate(names) if params[param].vary], dtype = int)
+        lower = np.asarray([params[names[position]].min for position in free], dtype = float)
+        upper = np.asarray([params[names[position]].max for position in free], dtype = float)
+        ties = self.parameter_ties
+        if ties != None:
+            tie_lower = np.asarray([params[param].min for param in ties['names']], dtype = float)
+            tie_upper = np.asarray([params[param].max for param in ties['names']], dtype = float)
+            updated = np.concatenate([free, ties['tied']])
+        else:
+            updated = free
+
+        def parameter_vector(x):
+            full = vector.copy()
+            full[free] = x
+            if ties != None:
+                full[ties['tied']] = np.clip(ties['scale']*full[ties['source']] + ties['offset'], tie_lower, tie_upper)
+            return full
+
+        def residuals(x):
+            full = parameter_vector(x)
+            return self._model_residuals(full, dict(zip(names, full.tolist())), parameter_map, wing_cutoff, wing_wavenumbers, wing_method)
+
+        jacobian_params = params.copy()
+        var_names = [names[position] for position in free]
+        def jacobian(x):
+            full = parameter_vector(x)
+            for position, value in zip(updated.tolist(), full[updated].tolist()):
+                jacobian_params[names[position]].value = value
+            return self._jacobian_columns(jacobian_params, var_names, wing_cutoff, wing_wavenumbers, wing_method, analytic_derivatives = analytic_jacobian)
+
+        result = Minimizer(self.simulation_model, params).prepare_fit()
+        result.method = 'least_squares'
+        if len(free) == 0:
+            x = vector[free]
+            result.residual = residuals(x)
+            result.nfev = 1
+            result.message = 'No floated parameters.'
+        else:
+            if analytic_jacobian or sparse_jacobian:
+                jac = jacobian
+            else:
+                jac = '2-point'
+            ret = least_squares(residuals, np.clip(vector[free], lower, upper), jac = jac, bounds = (lower, upper), method = 'trf', xtol = xtol, ftol = ftol, max_nfev = maxfev)
+            x = ret.x
+            #least_squares returns the last evaluation, so the residuals are re-evaluated at the solution
+            result.residual = residuals(x)
+            result.nfev = ret.nfev
+            result.njev = ret.njev
+            result.status = ret.status
+            result.success = ret.success
+            result.message = ret.message
+            result.x = x
+            result.jac = ret.jac
+        full = parameter_vector(x)
+        for position, value in zip(updated.tolist(), full[updated].tolist()):
+            result.params[names[position]].value = value
+        #Fit statistics and uncertainties, as calculated by lmfit
+        result.chisqr = float((result.residual**2).sum())
+        result.ndata = len(result.residual)
+        result.nfree = result.ndata - result.nvarys
+        result.redchi = result.chisqr / max(1, result.nfree)
+        neg2_log_likelihood = result.ndata*np.log(max(result.chisqr, 1.e-250*result.ndata) / result.ndata)
+        result.aic = neg2_log_likelihood + 2*result.nvarys
+        result.bic = neg2_log_likelihood + np.log(result.ndata)*result.nvarys
+        if len(free) != 0:
+            try:
+                result.covar = np.linalg.inv(ret.jac.T @ ret.jac)*result.redchi
+            except np.linalg.LinAlgError:
+                result.covar = None
+        if result.covar is not None:
+            stderr = np.sqrt(np.diag(result.covar))
+            correl = result.covar / np.outer(stderr, stderr)
+            result.errorbars = bool(np.all(stderr > 0))
+            for ivar, name in enumerate(var_names):
+                result.params[name].stderr = float(stderr[ivar])
+                result.params[name].correl = {other: float(correl[ivar, jvar]) for jvar, other in enumerate(var_names) if jvar != ivar}
         return result
 
 
@@ -1354,11 +2260,38 @@ class Fit_DataSet:
             spectrum.set_model(spectrum_residual + spectrum.alpha)
             if indv_resid_plot:
                 spectrum.plot_model_residuals()
+    def _parameter_locations(self, params):
+        """Returns the baseline_list, CIAparam_list, or lineparam_list entries that update_params writes each parameter to, as {name: (table, row labels, column)}.
+        """
+        baseline_rows = {}
+        for label, spectrum, segment in zip(self.baseline_list.index.values, self.baseline_list['Spectrum Number'].values, self.baseline_list['Segment Number'].values):
+            baseline_rows.setdefault((int(spectrum), int(segment)), []).append(label)
+        if self.dataset.CIA_model['model'] == 'Karman':
+            cia_rows = {cia_pair: list(self.CIAparam_list.index.values[self.CIAparam_list['CIA Pair'].values == cia_pair]) for cia_pair in ['O2_O2', 'O2_N2']}
+        locations = {}
+        for name in params:
+            #Baseline
+            if ('Pressure' in name) or ('Temperature' in name) or ('molefraction' in name) or ('baseline' in name) or ('x_shift' in name) or ('etalon' in name) or ('_res_' in name):
+                parameter, spectrum, segment = name.rsplit('_', 2)
+                locations[name] = ('baseline_list', baseline_rows.get((int(spectrum), int(segment)), []), parameter)
+            #CIA
+            #Karman CIA
+            elif (self.dataset.CIA_model['model']=='Karman') and ('O2_O2' in name):
+                locations[name] = ('CIAparam_list', cia_rows['O2_O2'], '_'.join(name.split('_')[:2]))
+            elif (self.dataset.CIA_model['model']=='Karman') and ('O2_N2' in name):
+                locations[name] = ('CIAparam_list', cia_rows['O2_N2'], '_'.join(name.split('_')[:2]))
+            #Line shape Parameters
+            else:
+                locations[name] = ('lineparam_list', [int(name[name.find('_line')+6:])], name[:name.find('_line')])
+        return locations
+
     def update_params(self, result, base_linelist_update_file = None , param_linelist_update_file = None, 
                       CIA_linelist_update_file = None):
         """Updates the baseline and line parameter files based on fit results with the option to write over the file (default) or save as a new file and updates baseline values in the spectrum objects.
         根据拟合结果更新基线和线参数文件，可选择写入文件（默认）或保存为新文件，并更新频谱对象中的基线值。
 
+        The table entry of each parameter is found once (see _parameter_locations) and the values and errors are assigned with one assignment per table column.  The baseline and etalon background of each spectrum is calculated from the parameter map (see _parameter_map) used by the simulation model.
+
         Parameters
         ----------
         result : LMFit result Object
@@ -1379,62 +2312,19 @@ class Fit_DataSet:
         if CIA_linelist_update_file == None:
             CIA_linelist_update_file = self.CIA_linelist_file
 
-        for key, par in result.params.items():
-            #Baseline
-            if ('Pressure' in par.name) or ('Temperature' in par.name):
-                indices = [m.start() for m in re.finditer('_', par.name)]
-                parameter = (par.name[:indices[0]])
-                spectrum = int(par.name[indices[0] + 1:indices[1]])
-                segment = int(par.name[indices[1] + 1:])
-                self.baseline_list.loc[(self.baseline_list['Segment Number'] == segment) & (self.baseline_list['Spectrum Number'] == spectrum), parameter] = par.value
-                if par.vary:
-                    self.baseline_list.loc[(self.baseline_list['Segment Number'] == segment) & (self.baseline_list['Spectrum Number'] == spectrum), parameter + '_err'] = par.stderr
-
-            elif ('molefraction' in par.name) or ('baseline' in par.name) or ('x_shift' in par.name):
-                indices = [m.start() for m in re.finditer('_', par.name)]
-                parameter = (par.name[:indices[1]])
-                spectrum = int(par.name[indices[1] + 1:indices[2]])
-                segment = int(par.name[indices[2] + 1:])
-                self.baseline_list.loc[(self.baseline_list['Segment Number'] == segment) & (self.baseline_list['Spectrum Number'] == spectrum), parameter] = par.value
-                if par.vary:
-                    self.baseline_list.loc[(self.baseline_list['Segment Number'] == segment) & (self.baseline_list['Spectrum Number'] == spectrum), parameter + '_err'] = par.stderr
-            elif ('etalon' in par.name):
-                indices = [m.start() for m in re.finditer('_', par.name)]
-                parameter = par.name[:indices[2]]
-                spectrum = int(par.name[indices[2]+1:indices[3]])
-                segment = int(par.name[indices[3]+1:])
-                self.baseline_list.loc[(self.baseline_list['Segment Number'] == segment) & (self.baseline_list['Spectrum Number'] == spectrum), parameter] = par.value
-                if par.vary:
-                    self.baseline_list.loc[(self.baseline_list['Segment Number'] == segment) & (self.baseline_list['Spectrum Number'] == spectrum), parameter + '_err'] = par.stderr
-            elif ('_res_' in par.name):
-                indices = [m.start() for m in re.finditer('_', par.name[par.name.find('_res_') + 5:])]
-                spectrum = par.name[par.name.find('_res_') + 5:][indices[0]+1:indices[1]]
-                segment = par.name[par.name.find('_res_') + 5:][indices[1]+1:]
-                parameter = par.name[:par.name.find('_res_')] + '_res_' + par.name[par.name.find('_res_') + 5:][:indices[0]]
-                self.baseline_list.loc[(self.baseline_list['Segment Number'] == segment) & (self.baseline_list['Spectrum Number'] == spectrum), parameter] = par.value
-                if par.vary:
-                    self.baseline_list.loc[(self.baseline_list['Segment Number'] == segment) & (self.baseline_list['Spectrum Number'] == spectrum), parameter + '_err'] = par.stderr
-            #CIA
-            #Karman CIA
-            elif (self.dataset.CIA_model['model']=='Karman') and ('O2_O2' in par.name):
-                indices = [m.start() for m in re.finditer('_', par.name)]
-                parameter = par.name[:indices[1]]
-                self.CIAparam_list.loc[(self.CIAparam_list['CIA Pair'] == 'O2_O2'), parameter] = par.value
-                if par.vary:
-                    self.CIAparam_list.loc[(self.CIAparam_list['CIA Pair'] == 'O2_O2'), parameter + '_err'] = par.stderr
-            elif (self.dataset.CIA_model['model']=='Karman') and ('O2_N2' in par.name):
-                indices = [m.start() for m in re.finditer('_', par.name)]
-                parameter = par.name[:indices[1]]
-                self.CIAparam_list.loc[(self.CIAparam_list['CIA Pair'] == 'O2_N2'), parameter] = par.value
-                if par.vary:
-                    self.CIAparam_list.loc[(self.CIAparam_list['CIA Pair'] == 'O2_N2'), parameter + '_err'] = par.stderr 
-            #Line shape Parameters
-            else:
-                parameter = par.name[:par.name.find('_line')]
-                line = int(par.name[par.name.find('_line')+6:])
-                self.lineparam_list.loc[line, parameter] = par.value
-                if par.vary:
-                    self.lineparam_list.loc[line, parameter + '_err'] = par.stderr
+        #Values and errors are gathered for each table column and assigned together
+        updates = {}
+        for name, (table, rows, parameter) in self._parameter_locations(result.params).items():
+            par = result.params[name]
+            entries = updates.setdefault((table, parameter), ([], []))
+            entries[0].extend(rows)
+            entries[1].extend(len(rows)*[par.value])
+            if par.vary:
+                entries = updates.setdefault((table, parameter + '_err'), ([], []))
+                entries[0].extend(rows)
+                entries[1].extend(len(rows)*[par.stderr])
+        for (table, parameter), (rows, values) in updates.items():
+            getattr(self, table).loc[rows, parameter] = np.asarray(values, dtype = float)
         self.baseline_list.to_csv(base_linelist_update_file + '.csv', index = False)
         self.lineparam_list.to_csv(param_linelist_update_file + '.csv')
         if self.dataset.CIA_model['model'] == "Karman":
@@ -1443,34 +2333,19 @@ class Fit_DataSet:
 
 
         #Calculate Baseline + Etalons and add to the Baseline term for each spectra
+        parameter_map = self._parameter_map(result.params)
+        values = result.params.valuesdict()
+        vector = np.fromiter(values.values(), dtype = float, count = len(values))
         for spectrum in self.dataset.spectra:
-            wavenumber_segments, alpha_segments, indices_segments = spectrum.segment_wave_alpha()
-            baseline = len(spectrum.wavenumber)*[0]
-            for segment in set(spectrum.segments):
-                waves = wavenumber_segments[segment]
-                bound_min = np.min(indices_segments[segment])
-                bound_max = np.max(indices_segments[segment])
-                wave_rel = waves - np.min(spectrum.wavenumber)
-                baseline_param_array = [0]*(self.dataset.baseline_order+1)
-                fit_etalon_parameters = {}
-                for i in range(1, len(spectrum.etalons)+1):
-                    fit_etalon_parameters[i] = {'amp': 0, 'period':0, 'phase':0}
-                for key, par in result.params.items():
-                    if ('baseline' in par.name) and ((str(spectrum.spectrum_number) + '_' + str(segment)) in par.name):
-                        baseline_param_array[ord(par.name[9:par.name.find('_',9)])-97] = float(par.value)
-                    elif ('etalon' in par.name) and ((str(spectrum.spectrum_number) + '_' + str(segment)) in par.name[par.name.find('_', 7):]):
-                        etalon_num = int(par.name[par.name.find('_')+1: par.name.find('_', par.name.find('_')+1)])
-                        if ('amp' in par.name) and (str(etalon_num) in par.name):
-                            fit_etalon_parameters[etalon_num]['amp'] = par.value
-                        if ('period' in par.name) and (str(etalon_num) in par.name):
-                            fit_etalon_parameters[etalon_num]['period'] = par.value
-                        if ('phase' in par.name) and (str(etalon_num) in par.name):
-                            fit_etalon_parameters[etalon_num]['phase'] = par.value
-                baseline_param_array = baseline_param_array[::-1] # reverses array to be used for polyval
-                baseline[bound_min: bound_max + 1] += np.polyval(baseline_param_array, wave_rel)
-                for i in range(1, len(spectrum.etalons)+1):
-                    baseline[bound_min: bound_max +1] += etalon(wave_rel, fit_etalon_parameters[i]['amp'], fit_etalon_parameters[i]['period'], fit_etalon_parameters[i]['phase'])
-            spectrum.set_background(baseline)
+            segment_slices = spectrum.segment_slices()
+            wavenumber_min = np.min(spectrum.wavenumber)
+            background = np.zeros(len(spectrum.wavenumber))
+            for segment in segment_slices:
+                wave_rel = spectrum.wavenumber[segment_slices[segment]] - wavenumber_min
+                baseline, etalons = self._baseline_model(vector, parameter_map['segments'][(spectrum.spectrum_number, segment)], wave_rel)
+                background[segment_slices[segment]] = baseline
+                background[segment_slices[segment]] += etalons
+            spectrum.set_background(background)
         #Calculate CIA
         if self.dataset.CIA_model['model']!= None:
             if self.dataset.CIA_model['model']=='Karman':
@@ -1536,16 +2411,16 @@ class Fit_DataSet:
 
             #Single or MS for nu and nuVC
             for spectrum in self.dataset.spectra:
-                wavenumber_segments, alpha_segments, indices_segments = spectrum.segment_wave_alpha()
+                segment_slices = spectrum.segment_slices()
                 mp = 0
                 for diluent in spectrum.Diluent:
                     mp += spectrum.Diluent[diluent]['composition']*spectrum.Diluent[diluent]['m']
 
-                for segment in list(set(spectrum.segments)):
+                for segment in segment_slices:
                     p = self.baseline_list[(self.baseline_list['Spectrum Number'] == spectrum.spectrum_number) & (self.baseline_list['Segment Number'] == segment)]['Pressure'].values[0]
                     T = self.baseline_list[(self.baseline_list['Spectrum Number'] == spectrum.spectrum_number) & (self.baseline_list['Segment Number'] == segment)]['Temperature'].values[0]
-                    wave_min = np.min(wavenumber_segments[segment])
-                    wave_max = np.max(wavenumber_segments[segment])
+                    wave_min = np.min(spectrum.wavenumber[segment_slices[segment]])
+                    wave_max = np.max(spectrum.wavenumber[segment_slices[segment]])
 
                     beta_summary_list['alpha'] = mp / beta_summary_list['m']
                     if nu_constrain:
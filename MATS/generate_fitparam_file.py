@@ -1,6 +1,8 @@
 #Import Packages
 # from .Utilities import *
 #import re
+import numpy as np
+import pandas as pd
 from .o2_cia_karman import (
     o2_cia_karman_model
 )
@@ -114,6 +116,33 @@ class Generate_FitParam_File:
         return self.base_linelist
     def get_CIA_linelist(self):
         return self.CIA_linelist
+    def _line_groups(self, param_linelist_df):
+        """Precomputes the (molec_id, local_iso_id) group of each line, the nu-sorted order of the lines, and the lines with an intensity above the fit intensity, which are used to set the vary flags (see _set_vary_flags).
+        """
+        group_keys, group_index = np.unique(np.column_stack([param_linelist_df['molec_id'].values, param_linelist_df['local_iso_id'].values]), axis = 0, return_inverse = True)
+        nu = param_linelist_df['nu'].values
+        order = np.argsort(nu, kind = 'stable')
+        return {'groups': [tuple(key) for key in group_keys.tolist()], 'group_index': np.ravel(group_index), 'order': order, 'sorted_nu': nu[order],
+                'fit': param_linelist_df['sw'].values > 1, 'windows': {}}
+
+    def _set_vary_flags(self, param_linelist_df, column, vary, lines, wavenumber_min, wavenumber_max):
+        """Sets the vary column for the lines with an intensity above the fit intensity and nu between wavenumber_min and wavenumber_max from a vary dictionary ({molec_id: {local_iso_id: flag}}), where the flag of each line is looked up from its molecule and isotope group and the column is assigned once.
+        """
+        if vary == {}:
+            return
+        window = (wavenumber_min, wavenumber_max)
+        if window not in lines['windows']:
+            #Lines in the window are a contiguous range of the nu-sorted lines
+            start = np.searchsorted(lines['sorted_nu'], wavenumber_min, side = 'left')
+            stop = np.searchsorted(lines['sorted_nu'], wavenumber_max, side = 'right')
+            in_window = np.zeros(len(lines['order']), dtype = bool)
+            in_window[lines['order'][start:stop]] = True
+            lines['windows'][window] = in_window & lines['fit']
+        group_flags = [vary.get(molecule, {}).get(isotope) for molecule, isotope in lines['groups']]
+        flagged = np.asarray([flag != None for flag in group_flags], dtype = bool)[lines['group_index']] & lines['windows'][window]
+        flags = np.asarray([flag if flag != None else False for flag in group_flags])[lines['group_index']]
+        param_linelist_df[column] = np.where(flagged, flags, param_linelist_df[column].values)
+
     def generate_fit_param_linelist_from_linelist(self, vary_nu = {}, vary_sw = {},
                                    vary_gamma0 = {}, vary_n_gamma0 = {},
                                    vary_delta0 = {}, vary_n_delta0 = {},
@@ -219,6 +248,8 @@ class Generate_FitParam_File:
         #Re-defines the Line intensity as sw*sw_scale_factor
         param_linelist_df['sw'] = param_linelist_df['sw'] / self.fit_intensity
         param_linelist_df['sw_scale_factor'] = [self.fit_intensity]*len(param_linelist_df)
+        #Molecule and isotope group, nu order, and fit intensity of each line used to set the vary flags
+        lines = self._line_groups(param_linelist_df)
 
         # Defines the Linecenter parameters in the event that the line center is held constant across all samples and is not
         ## Starting point is equal to the inital value
@@ -226,20 +257,14 @@ class Generate_FitParam_File:
         param_linelist_df['nu_vary'] = len(param_linelist_df)*[False]
         param_linelist_df['nu_err'] = len(param_linelist_df)*[0.0]
         if self.nu_constrain:
-            if vary_nu != {}:
-                for molecule in vary_nu:
-                    for isotope in vary_nu[molecule]:
-                        param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) & (param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'nu_vary'] = (vary_nu[molecule][isotope])
+            self._set_vary_flags(param_linelist_df, 'nu_vary', vary_nu, lines, dataset_min, dataset_max)
         else:
             for spec in self.dataset.get_list_spectrum_numbers():
                 param_linelist_df['nu_' + str(spec)] = param_linelist_df['nu'].values
                 order_nu.append('nu_' + str(spec))
                 param_linelist_df['nu_' + str(spec) + '_vary'] = len(param_linelist_df)*[False]
                 param_linelist_df['nu_' + str(spec) + '_err'] = len(param_linelist_df)*[0.0]
-                if vary_nu != {}:
-                    for molecule in vary_nu:
-                        for isotope in vary_nu[molecule]:
-                            param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) & (param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'nu_' + str(spec) + '_vary'] = (vary_nu[molecule][isotope])
+                self._set_vary_flags(param_linelist_df, 'nu_' + str(spec) + '_vary', vary_nu, lines, dataset_min, dataset_max)
 
         # Defines the linestrength in the event that the sw is held constant across all samples and not
         ## Starting point is equal to the initial value
@@ -247,20 +272,14 @@ class Generate_FitParam_File:
         param_linelist_df['sw_vary'] = len(param_linelist_df)*[False]
         param_linelist_df['sw_err'] = len(param_linelist_df)*[0.0]
         if self.sw_constrain:
-            if vary_sw != {}:
-                 for molecule in vary_sw:
-                    for isotope in vary_sw[molecule]:
-                        param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'sw_vary'] = (vary_sw[molecule][isotope])
+            self._set_vary_flags(param_linelist_df, 'sw_vary', vary_sw, lines, dataset_min, dataset_max)
         else:
             for spec in self.dataset.get_list_spectrum_numbers():
                 param_linelist_df['sw_' + str(spec)] = param_linelist_df['sw'].values
                 order_sw.append('sw_' + str(spec))
                 param_linelist_df['sw_' + str(spec) + '_vary'] = len(param_linelist_df)*[False]
                 param_linelist_df['sw_' + str(spec) + '_err'] = len(param_linelist_df)*[0.0]
-                if vary_sw != {}:
-                    for molecule in vary_sw:
-                        for isotope in vary_sw[molecule]:
-                            param_linelist_df.loc[(param_linelist_df['nu'] >= extreme_dictionary[spec][0])&(param_linelist_df['nu'] <= extreme_dictionary[spec][1])&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'sw_' + str(spec) + '_vary'] = (vary_sw[molecule][isotope])
+                self._set_vary_flags(param_linelist_df, 'sw_' + str(spec) + '_vary', vary_sw, lines, extreme_dictionary[spec][0], extreme_dictionary[spec][1])
 
         #Loop through other parameters and then set things to 0 based on lineshape
         order_gamma0 = []
@@ -276,20 +295,14 @@ class Generate_FitParam_File:
             param_linelist_df['gamma0_' + diluent + '_vary'] = len(param_linelist_df)*[False]
             param_linelist_df['gamma0_' + diluent + '_err'] = len(param_linelist_df)*[0.0]
             if self.gamma0_constrain:
-                if vary_gamma0 != {}:
-                    for molecule in vary_gamma0:
-                        for isotope in vary_gamma0[molecule]:
-                            param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'gamma0_' +diluent + '_vary'] = (vary_gamma0[molecule][isotope])
+                self._set_vary_flags(param_linelist_df, 'gamma0_' +diluent + '_vary', vary_gamma0, lines, dataset_min, dataset_max)
             else:
                 for spec in self.dataset.get_list_spectrum_numbers():
                     order_gamma0.append('gamma0_' +diluent + '_' +str(spec))
                     param_linelist_df['gamma0_' +diluent + '_' +str(spec)] = (param_linelist_df['gamma0_' + diluent].values)
                     param_linelist_df['gamma0_' + diluent + '_'+str(spec) + '_vary'] = len(param_linelist_df)*[False]
                     param_linelist_df['gamma0_'+ diluent + '_'+ str(spec) + '_err'] = len(param_linelist_df)*[0]
-                    if vary_gamma0 != {}:
-                        for molecule in vary_gamma0:
-                            for isotope in vary_gamma0[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= extreme_dictionary[spec][0])&(param_linelist_df['nu'] <= extreme_dictionary[spec][1])&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'gamma0_' +diluent +'_'+str(spec) + '_vary'] = (vary_gamma0[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'gamma0_' +diluent +'_'+str(spec) + '_vary', vary_gamma0, lines, extreme_dictionary[spec][0], extreme_dictionary[spec][1])
             order_gamma0.append('n_gamma0_' +diluent )
 
             #Delta0 option for constrain and not constrained
@@ -297,20 +310,14 @@ class Generate_FitParam_File:
             param_linelist_df['delta0_' + diluent + '_vary'] = len(param_linelist_df)*[False]
             param_linelist_df['delta0_' + diluent + '_err'] = len(param_linelist_df)*[0.0]
             if self.delta0_constrain:
-                if vary_delta0 != {}:
-                    for molecule in vary_delta0:
-                        for isotope in vary_delta0[molecule]:
-                            param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'delta0_' +diluent + '_vary'] = (vary_delta0[molecule][isotope])
+                self._set_vary_flags(param_linelist_df, 'delta0_' +diluent + '_vary', vary_delta0, lines, dataset_min, dataset_max)
             else:
                 for spec in self.dataset.get_list_spectrum_numbers():
                     order_delta0.append('delta0_' +diluent + '_' +str(spec))
                     param_linelist_df['delta0_' +diluent + '_' +str(spec)] = (param_linelist_df['delta0_' + diluent].values)
                     param_linelist_df['delta0_' +  diluent + '_'+str(spec) + '_vary'] = len(param_linelist_df)*[0]
                     param_linelist_df['delta0_' + diluent + '_'+ str(spec) + '_err'] = len(param_linelist_df)*[0.0]
-                    if vary_delta0 != {}:
-                        for molecule in vary_delta0:
-                            for isotope in vary_delta0[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= extreme_dictionary[spec][0])&(param_linelist_df['nu'] <= extreme_dictionary[spec][1])&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'delta0_' +diluent +'_'+str(spec) + '_vary'] = (vary_delta0[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'delta0_' +diluent +'_'+str(spec) + '_vary', vary_delta0, lines, extreme_dictionary[spec][0], extreme_dictionary[spec][1])
             order_delta0.append('n_delta0_' +diluent )
 
             #SD Gamma option for constrain and not constrained
@@ -321,10 +328,7 @@ class Generate_FitParam_File:
                 if (self.lineprofile == 'VP') or (self.lineprofile == 'NGP'):
                     param_linelist_df.loc[:, 'SD_gamma_' + diluent] = 0.0
                 else:
-                    if vary_aw != {}:
-                        for molecule in vary_aw:
-                            for isotope in vary_aw[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'SD_gamma_' +diluent + '_vary'] = (vary_aw[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'SD_gamma_' +diluent + '_vary', vary_aw, lines, dataset_min, dataset_max)
             else:
                 for spec in self.dataset.get_list_spectrum_numbers():
                     order_SD_gamma.append('SD_gamma_' +diluent + '_' +str(spec))
@@ -334,10 +338,7 @@ class Generate_FitParam_File:
                         param_linelist_df.loc[:, 'SD_gamma_' +diluent + '_' +str(spec)] = 0.0
                     else:
                         param_linelist_df['SD_gamma_' +diluent + '_' +str(spec)] = (param_linelist_df['SD_gamma_' + diluent].values)
-                        if vary_aw != {}:
-                            for molecule in vary_aw:
-                                for isotope in vary_aw[molecule]:
-                                    param_linelist_df.loc[(param_linelist_df['nu'] >= extreme_dictionary[spec][0])&(param_linelist_df['nu'] <= extreme_dictionary[spec][1])&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'SD_gamma_' +diluent +'_'+str(spec) + '_vary'] = (vary_aw[molecule][isotope])
+                        self._set_vary_flags(param_linelist_df, 'SD_gamma_' +diluent +'_'+str(spec) + '_vary', vary_aw, lines, extreme_dictionary[spec][0], extreme_dictionary[spec][1])
             order_SD_gamma.append('n_gamma2_' +diluent )
 
             #SD Delta option for constrain and not constrained
@@ -348,10 +349,7 @@ class Generate_FitParam_File:
                 if (self.lineprofile == 'VP') or (self.lineprofile == 'NGP'):
                     param_linelist_df.loc[:, 'SD_delta_' + diluent] = 0.0
                 else:
-                    if vary_as != {}:
-                        for molecule in vary_as:
-                            for isotope in vary_as[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'SD_delta_' +diluent + '_vary'] = (vary_as[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'SD_delta_' +diluent + '_vary', vary_as, lines, dataset_min, dataset_max)
             else:
                 for spec in self.dataset.get_list_spectrum_numbers():
                     order_SD_delta.append('SD_delta_' +diluent + '_' +str(spec))
@@ -362,10 +360,7 @@ class Generate_FitParam_File:
                     else:
                         param_linelist_df['SD_delta_' +diluent + '_' +str(spec)] = (param_linelist_df['SD_delta_' + diluent].values)
 
-                        if vary_as != {}:
-                            for molecule in vary_as:
-                                for isotope in vary_as[molecule]:
-                                    param_linelist_df.loc[(param_linelist_df['nu'] >= extreme_dictionary[spec][0])&(param_linelist_df['nu'] <= extreme_dictionary[spec][1])&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'SD_delta_' +diluent +'_'+str(spec) + '_vary'] = (vary_as[molecule][isotope])
+                        self._set_vary_flags(param_linelist_df, 'SD_delta_' +diluent +'_'+str(spec) + '_vary', vary_as, lines, extreme_dictionary[spec][0], extreme_dictionary[spec][1])
             order_SD_delta.append('n_delta2_' +diluent )
 
             #nuVC option for constrain and not constrained
@@ -376,10 +371,7 @@ class Generate_FitParam_File:
                 if (self.lineprofile == 'VP') or (self.lineprofile == 'SDVP'):
                     param_linelist_df.loc[:, 'nuVC_' + diluent ] = 0.0
                 else:
-                    if vary_nuVC != {}:
-                        for molecule in vary_nuVC:
-                            for isotope in vary_nuVC[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'nuVC_' +diluent + '_vary'] = (vary_nuVC[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'nuVC_' +diluent + '_vary', vary_nuVC, lines, dataset_min, dataset_max)
             else:
                 for spec in self.dataset.get_list_spectrum_numbers():
                     order_nuVC.append('nuVC_' + diluent + '_'+str(spec))
@@ -390,10 +382,7 @@ class Generate_FitParam_File:
                     else:
                         param_linelist_df['nuVC_' +diluent + '_' +str(spec)] = (param_linelist_df['nuVC_' + diluent].values)
 
-                        if vary_nuVC != {}:
-                            for molecule in vary_nuVC:
-                                for isotope in vary_nuVC[molecule]:
-                                    param_linelist_df.loc[(param_linelist_df['nu'] >= extreme_dictionary[spec][0])&(param_linelist_df['nu'] <= extreme_dictionary[spec][1])&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'nuVC_' +diluent +'_'+str(spec) + '_vary'] = (vary_nuVC[molecule][isotope])
+                        self._set_vary_flags(param_linelist_df, 'nuVC_' +diluent +'_'+str(spec) + '_vary', vary_nuVC, lines, extreme_dictionary[spec][0], extreme_dictionary[spec][1])
             order_nuVC.append('n_nuVC_' +diluent )
 
             #eta option for constrain and not constrained
@@ -404,23 +393,17 @@ class Generate_FitParam_File:
                 if (self.lineprofile == 'VP') or (self.lineprofile == 'SDVP') or (self.lineprofile == 'NGP') or (self.lineprofile == 'SDNGP'):
                     param_linelist_df.loc[:, 'eta_' + diluent] = 0.0
                 else:
-                    if vary_eta != {}:
-                        for molecule in vary_eta:
-                            for isotope in vary_eta[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'eta_' +diluent + '_vary'] = (vary_eta[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'eta_' +diluent + '_vary', vary_eta, lines, dataset_min, dataset_max)
             else:
                 for spec in self.dataset.get_list_spectrum_numbers():
                     order_eta.append('eta_' +diluent + '_' +str(spec))
-                    param_linelist_df['eta_' + str(spec) + '_vary'] = len(param_linelist_df)*[False]
-                    param_linelist_df['eta_' + str(spec) + '_err'] = len(param_linelist_df)*[0]
+                    param_linelist_df['eta_' + diluent + '_'+str(spec) + '_vary'] = len(param_linelist_df)*[False]
+                    param_linelist_df['eta_' + diluent + '_'+ str(spec) + '_err'] = len(param_linelist_df)*[0]
                     if (self.lineprofile == 'VP') or (self.lineprofile == 'SDVP') or (self.lineprofile == 'NGP') or (self.lineprofile == 'SDNGP'):
                         param_linelist_df.loc[:, 'eta_' +diluent + '_' +str(spec)] = 0.0
                     else:
                         param_linelist_df['eta_' +diluent + '_' +str(spec)] = (param_linelist_df['eta_' + diluent].values)
-                        if vary_eta != {}:
-                            for molecule in vary_eta:
-                                for isotope in vary_eta[molecule]:
-                                    param_linelist_df.loc[(param_linelist_df['nu'] >= extreme_dictionary[spec][0])&(param_linelist_df['nu'] <= extreme_dictionary[spec][1])&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'eta_' +diluent +'_'+str(spec) + '_vary'] = (vary_eta[molecule][isotope])
+                        self._set_vary_flags(param_linelist_df, 'eta_' +diluent +'_'+str(spec) + '_vary', vary_eta, lines, extreme_dictionary[spec][0], extreme_dictionary[spec][1])
 
             # Linemixing
             order_linemixing.append('y_' + diluent)
@@ -428,20 +411,14 @@ class Generate_FitParam_File:
             param_linelist_df['y_' + diluent + '_err'] = len(param_linelist_df)*[0.0]
             if self.linemixing:
                 if self.linemixing_constrain:
-                    if vary_linemixing != {}:
-                        for molecule in vary_linemixing:
-                            for isotope in vary_linemixing[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'y_' +diluent + '_vary'] = (vary_linemixing[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'y_' +diluent + '_vary', vary_linemixing, lines, dataset_min, dataset_max)
                 else:
                     for spec in self.dataset.get_list_spectrum_numbers():
                         order_linemixing.append('y_' +diluent + '_' +str(spec))
                         param_linelist_df['y_' +diluent + '_' +str(spec)] = (param_linelist_df['y_' + diluent].values)
                         param_linelist_df['y_' + diluent + '_'+str(spec) + '_vary'] = len(param_linelist_df)*[False]
                         param_linelist_df['y_'+ diluent + '_'+ str(spec) + '_err'] = len(param_linelist_df)*[0]
-                        if vary_linemixing != {}:
-                            for molecule in vary_linemixing:
-                                for isotope in vary_linemixing[molecule]:
-                                    param_linelist_df.loc[(param_linelist_df['nu'] >= extreme_dictionary[spec][0])&(param_linelist_df['nu'] <= extreme_dictionary[spec][1])&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'y_' +diluent +'_'+str(spec) + '_vary'] = (vary_linemixing[molecule][isotope])
+                        self._set_vary_flags(param_linelist_df, 'y_' +diluent +'_'+str(spec) + '_vary', vary_linemixing, lines, extreme_dictionary[spec][0], extreme_dictionary[spec][1])
             else:
                 param_linelist_df['y_' + diluent] = 0.0
             order_linemixing.append('n_y_' +diluent )
@@ -461,39 +438,21 @@ class Generate_FitParam_File:
                 param_linelist_df['n_y_'+diluent+'_vary'] = len(param_linelist_df)*[False]
                 param_linelist_df['n_y_'+diluent+'_err'] = len(param_linelist_df)*[0.0]
                 #n_Gamma0
-                if vary_n_gamma0 != {}:
-                    for molecule in vary_n_gamma0:
-                        for isotope in vary_n_gamma0[molecule]:
-                            param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'n_gamma0_' +diluent + '_vary'] = (vary_n_gamma0[molecule][isotope])
+                self._set_vary_flags(param_linelist_df, 'n_gamma0_' +diluent + '_vary', vary_n_gamma0, lines, dataset_min, dataset_max)
                 #n_Delta0
-                if vary_n_delta0 != {}:
-                    for molecule in vary_n_delta0:
-                        for isotope in vary_n_delta0[molecule]:
-                            param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'n_delta0_' +diluent + '_vary'] = (vary_n_delta0[molecule][isotope])
+                self._set_vary_flags(param_linelist_df, 'n_delta0_' +diluent + '_vary', vary_n_delta0, lines, dataset_min, dataset_max)
                 #n_Gamma2 发现逻辑错误
                 if not (self.lineprofile == 'VP') or  not (self.lineprofile == 'NGP') :
-                    if vary_n_gamma2 != {}:
-                        for molecule in vary_n_gamma2:
-                            for isotope in vary_n_gamma2[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'n_gamma2_' +diluent + '_vary'] = (vary_n_gamma2[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'n_gamma2_' +diluent + '_vary', vary_n_gamma2, lines, dataset_min, dataset_max)
                 #n_Delta2
                 if not (self.lineprofile == 'VP') or  not (self.lineprofile == 'NGP') :
-                    if vary_n_delta2 != {}:
-                        for molecule in vary_n_delta2:
-                            for isotope in vary_n_delta2[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'n_delta2_' +diluent + '_vary'] = (vary_n_delta2[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'n_delta2_' +diluent + '_vary', vary_n_delta2, lines, dataset_min, dataset_max)
                 #n_nuVC
                 if not (self.lineprofile == 'VP') or  not (self.lineprofile == 'SDVP') :
-                    if vary_n_nuVC != {}:
-                        for molecule in vary_n_nuVC:
-                            for isotope in vary_n_nuVC[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'n_nuVC_' +diluent + '_vary'] = (vary_n_nuVC[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'n_nuVC_' +diluent + '_vary', vary_n_nuVC, lines, dataset_min, dataset_max)
                 #n_y
                 if not (self.linemixing) :
-                    if vary_n_linemixing != {}:
-                        for molecule in vary_n_linemixing:
-                            for isotope in vary_n_linemixing[molecule]:
-                                param_linelist_df.loc[(param_linelist_df['nu'] >= dataset_min)&(param_linelist_df['nu'] <= dataset_max)&(param_linelist_df['sw'] > 1) &(param_linelist_df['molec_id'] == molecule) & (param_linelist_df['local_iso_id'] == isotope), 'n_y_' +diluent + '_vary'] = (vary_n_linemixing[molecule][isotope])
+                    self._set_vary_flags(param_linelist_df, 'n_y_' +diluent + '_vary', vary_n_linemixing, lines, dataset_min, dataset_max)
         
         ordered_list = self.additional_columns.copy()
         ordered_list += ['molec_id', 'local_iso_id','elower']
@@ -622,39 +581,42 @@ class Generate_FitParam_File:
         parameters =  (list(base_linelist_df))
         baseline_param_order = ['Segment Number']
 
-        #Generate Fit Baseline file
+        #Generate Fit Baseline file, where the err and vary columns of each parameter are computed as arrays and added to the dataframe together
+        fit_columns = {}
         for param in parameters:
-            if ('Baseline Order' != param) and ('Segment Number' != param):
-                base_linelist_df[param + '_err'] = 0.0
-                base_linelist_df[param + '_vary']= False
-                baseline_param_order += [param, param + '_err', param + '_vary']
-
+            if ('Baseline Order' == param) or ('Segment Number' == param):
+                continue
+            values = base_linelist_df[param].values
+            vary = np.zeros(len(base_linelist_df), dtype = bool)
             if 'Pressure' in param:
-                base_linelist_df[param + '_vary'] = len(base_linelist_df)*[(vary_pressure)]
+                vary = np.full(len(base_linelist_df), vary_pressure)
                 if (vary_pressure):
                     print ('USE CAUTION WHEN FLOATING PRESSURES')
             if 'Temperature' in param:
-                base_linelist_df[param + '_vary'] = len(base_linelist_df)*[(vary_temperature)]
+                vary = np.full(len(base_linelist_df), vary_temperature)
                 if (vary_temperature):
                     print ('USE CAUTION WHEN FLOATING TEMPERATURES')
             if 'x_shift' in param:
-                base_linelist_df[param + '_vary'] = len(base_linelist_df)*[(vary_xshift)]
+                vary = np.full(len(base_linelist_df), vary_xshift)
             if 'baseline' in param:
                 order = ord(param.replace('baseline_', '')) - 97
-                base_linelist_df.loc[base_linelist_df['Baseline Order']>= order, param + '_vary'] = vary_baseline
+                vary = np.where(base_linelist_df['Baseline Order'].values >= order, vary_baseline, vary)
             if 'molefraction' in param:
                 for molecule in vary_molefraction:
                     if (self.dataset.isotope_list[(molecule, 1)][4]) in param:
-                        base_linelist_df.loc[base_linelist_df[param]!=0, param + '_vary'] = (vary_molefraction[molecule])
+                        vary = np.where(values != 0, vary_molefraction[molecule], vary)
             if 'amp' in param:
-                base_linelist_df.loc[base_linelist_df[param]!=0, param + '_vary'] = (vary_etalon_amp)
+                vary = np.where(values != 0, vary_etalon_amp, vary)
             if 'period' in param:
-                base_linelist_df.loc[base_linelist_df[param]!=0, param + '_vary'] = (vary_etalon_period)
+                vary = np.where(values != 0, vary_etalon_period, vary)
             if 'phase' in param:
-                base_linelist_df.loc[base_linelist_df[param.replace("phase", "period")]!=0, param + '_vary'] = (vary_etalon_phase)
+                vary = np.where(base_linelist_df[param.replace("phase", "period")].values != 0, vary_etalon_phase, vary)
             if '_res_' in param:
-                base_linelist_df.loc[base_linelist_df[param]!=0, param + '_vary'] = (vary_ILS_res)
-
+                vary = np.where(values != 0, vary_ILS_res, vary)
+            fit_columns[param + '_err'] = np.zeros(len(base_linelist_df))
+            fit_columns[param + '_vary'] = vary
+            baseline_param_order += [param, param + '_err', param + '_vary']
+        base_linelist_df = pd.concat([base_linelist_df, pd.DataFrame(fit_columns, index = base_linelist_df.index)], axis = 1)
 
         #base_linelist_df.drop(['Baseline Order'], axis=1, inplace = True)
         base_linelist_df = base_linelist_df[baseline_param_order]
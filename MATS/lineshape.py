@@ -0,0 +1,617 @@
+#Import Packages
+from functools import lru_cache
+import warnings
+
+import numpy as np
+
+from .hapi import VARIABLES, cpf3, hum1_wei
+
+
+# Number of (line, wavenumber) points evaluated together in one block of the batch engine.
+BLOCK_SIZE = 2**12
+
+# Line shape backends accepted by cross_section_batch.
+LINESHAPE_BACKENDS = ('numpy', 'numba')
+
+
+def line_windows(wavenumbers, nu, line_cutoff):
+    """Calculates the simulation window on the wavenumber axis for every line at once.
+
+    Equivalent to calling bisect(wavenumbers, nu -/+ line_cutoff) for each line.
+
+    Parameters
+    ----------
+    wavenumbers : array
+        sorted 1-D array of wavenumbers (cm-1) used as the x-axis of the simulation.
+    nu : array
+        line centers (cm-1).
+    line_cutoff : array or float
+        half-width of the simulation window for each line (cm-1).
+
+    Returns
+    -------
+    lower : array
+        index of the first wavenumber in the window of each line.
+    upper : array
+        index one past the last wavenumber in the window of each line (equal to lower for an empty window).
+
+    """
+    lower = np.searchsorted(wavenumbers, nu - line_cutoff, side = 'right')
+    upper = np.searchsorted(wavenumbers, nu + line_cutoff, side = 'right')
+    #A negative cut-off (ie from a negative width during a fit) gives an empty window, as with bisect
+    upper = np.maximum(upper, lower)
+    return lower, upper
+
+def _any_per_line(mask, line_index):
+    """Broadcasts back to each point whether any point of the same line has mask set.
+    """
+    if line_index is None:
+        return np.full(len(mask), mask.any())
+    flagged = np.unique(line_index[mask])
+    return np.isin(line_index, flagged)
+
+@lru_cache(maxsize = None)
+def weideman_coefficients(N = 24):
+    """Calculates the coefficients of the Weideman rational series for w(z) with N terms, as in hapi.cef.
+
+    The coefficients only depend on N, so they are calculated once for each N and cached.
+
+    Parameters
+    ----------
+    N : int, optional
+        number of terms in the series. The default is 24.
+
+    Returns
+    -------
+    L : float
+        optimal scale parameter of the series.
+    a : array
+        read-only array of the N polynomial coefficients, highest order first.
+
+    """
+    M = 2 * N
+    M2 = 2 * M
+    k = np.arange(-M + 1, M)
+    L = np.sqrt(N / np.sqrt(2))
+    theta = k * np.pi / M
+    t = L * np.tan(theta / 2)
+    f = np.zeros(len(t) + 1)
+    f[1:] = np.exp(-(t**2)) * (L**2 + t**2)
+    a = np.real(np.fft.fft(np.fft.fftshift(f))) / M2
+    a = np.flipud(a[1 : N + 1]).copy()
+    a.flags.writeable = False
+    return L, a
+
+def cpf_weideman(x, y, N = 24):
+    """Complex probability function w(z), z = x + iy, as calculated by hapi.hum1_wei, returned as a complex array.
+
+    Points with |x| + y < 15 use the Weideman rational series with the cached coefficients from weideman_coefficients, and the rest keep the one-term asymptotic (Humlicek region 1) expansion.  The series is evaluated with a single Horner loop and without repeating the complex intermediates of hapi.cef, giving results identical to hapi.hum1_wei.
+
+    Parameters
+    ----------
+    x, y : array
+        real and imaginary parts of z, with y >= 0.
+    N : int, optional
+        number of terms in the Weideman series. The default is 24.
+
+    Returns
+    -------
+    w : array
+        complex probability function at each z.
+
+    """
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    t = y - 1.0j*x
+    w = 1 / np.sqrt(np.pi) * t / (0.5 + t**2)
+
+    index = np.flatnonzero(np.abs(x) + y < 15.0)
+    if len(index) > 0:
+        L, a = weideman_coefficients(N)
+        iz = 1.0j*(x[index] + 1.0j*y[index])
+        denominator = L - iz
+        Z = (L + iz) / denominator
+        p = np.zeros(len(Z), dtype = complex)
+        for coefficient in a:
+            p *= Z
+            p += coefficient
+        w[index] = 2 * p / denominator**2 + (1 / np.sqrt(np.pi)) / denominator
+    return w
+
+def _cpf(x, y):
+    """Complex probability function as selected in HAPI, returned as a complex array.
+
+    The default hapi.hum1_wei is evaluated with cpf_weideman.
+    """
+    if VARIABLES['CPF'] is hum1_wei:
+        return cpf_weideman(x, y)
+    WR, WI = VARIABLES['CPF'](x, y)
+    return WR + 1.0j*WI
+
+def _sd_terms(X, Y, csqrtY, c2t, cte, Z1_PART2, bterm = True):
+    """A and B terms of pcqsdhc for speed-dependent points (c2t != 0).
+
+    Z1_PART2 is a function returning the Voigt-like Z1 argument for the points selected by a mask, which is only needed in the PART2 region.  If bterm is False, then only the A term is calculated and B is returned as None.
+    """
+    rpi = np.sqrt(np.pi)
+    A_SD = np.zeros(len(X), dtype = complex)
+    B_SD = np.zeros(len(X), dtype = complex) if bterm else None
+
+    index_PART2 = np.abs(X) <= 3.0e-8*np.abs(Y)
+    index_PART3 = (np.abs(Y) <= 1.0e-15*np.abs(X)) & ~index_PART2
+    index_PART4 = ~(index_PART2 | index_PART3)
+
+    #PART4
+    if index_PART4.any():
+        X4 = X[index_PART4]
+        Y4 = Y[index_PART4]
+        csqrtY4 = csqrtY[index_PART4]
+        Z1 = np.sqrt(X4 + Y4) - csqrtY4
+        Z2 = Z1 + 2.0*csqrtY4
+        SZ1 = np.abs(Z1)
+        SZ2 = np.abs(Z2)
+        index_CPF3 = (np.abs(SZ1 - SZ2) <= 1.0) & (np.maximum(SZ1, SZ2) > 8.0) & (np.minimum(SZ1, SZ2) <= 8.0)
+        index_CPF = ~index_CPF3
+        W1 = np.zeros(len(X4), dtype = complex)
+        W2 = np.zeros(len(X4), dtype = complex)
+        if index_CPF3.any():
+            WR, WI = cpf3(-Z1.imag[index_CPF3], Z1.real[index_CPF3])
+            W1[index_CPF3] = WR + 1.0j*WI
+            WR, WI = cpf3(-Z2.imag[index_CPF3], Z2.real[index_CPF3])
+            W2[index_CPF3] = WR + 1.0j*WI
+        if index_CPF.any():
+            W1[index_CPF] = _cpf(-Z1.imag[index_CPF], Z1.real[index_CPF])
+            W2[index_CPF] = _cpf(-Z2.imag[index_CPF], Z2.real[index_CPF])
+        A_SD[index_PART4] = rpi*cte[index_PART4]*(W1 - W2)
+        if bterm:
+            B_SD[index_PART4] = (-1.0 + rpi/(2.0*csqrtY4)*(1.0 - Z1**2)*W1 - rpi/(2.0*csqrtY4)*(1.0 - Z2**2)*W2) / c2t[index_PART4]
+
+    #PART2
+    if index_PART2.any():
+        csqrtY2 = csqrtY[index_PART2]
+        Z1 = Z1_PART2(index_PART2)
+        Z2 = np.sqrt(X[index_PART2] + Y[index_PART2]) + csqrtY2
+        W1 = _cpf(-Z1.imag, Z1.real)
+        W2 = _cpf(-Z2.imag, Z2.real)
+        A_SD[index_PART2] = rpi*cte[index_PART2]*(W1 - W2)
+        if bterm:
+            B_SD[index_PART2] = (-1.0 + rpi/(2.0*csqrtY2)*(1.0 - Z1**2)*W1 - rpi/(2.0*csqrtY2)*(1.0 - Z2**2)*W2) / c2t[index_PART2]
+
+    #PART3
+    if index_PART3.any():
+        X3 = X[index_PART3]
+        Y3 = Y[index_PART3]
+        c2t3 = c2t[index_PART3]
+        index_ABS = np.abs(np.sqrt(X3)) <= 4.0e3
+        A3 = np.zeros(len(X3), dtype = complex)
+        B3 = np.zeros(len(X3), dtype = complex)
+        if bterm:
+            W1 = _cpf(-np.sqrt(X3 + Y3).imag, np.sqrt(X3 + Y3).real)
+        if index_ABS.any():
+            Xb = X3[index_ABS]
+            Wb = _cpf(-np.sqrt(Xb).imag, np.sqrt(Xb).real)
+            A3[index_ABS] = (2.0*rpi/c2t3[index_ABS])*(1.0/rpi - np.sqrt(Xb)*Wb)
+            if bterm:
+                B3[index_ABS] = (1.0/c2t3[index_ABS])*(-1.0 + 2.0*rpi*(1.0 - Xb - 2.0*Y3[index_ABS])*(1.0/rpi - np.sqrt(Xb)*Wb) + 2.0*rpi*np.sqrt(Xb + Y3[index_ABS])*W1[index_ABS])
+        if (~index_ABS).any():
+            Xb = X3[~index_ABS]
+            A3[~index_ABS] = (1.0/c2t3[~index_ABS])*(1.0/Xb - 1.5/(Xb**2))
+            if bterm:
+                B3[~index_ABS] = (1.0/c2t3[~index_ABS])*(-1.0 + (1.0 - Xb - 2.0*Y3[~index_ABS])*(1.0/Xb - 1.5/(Xb**2)) + 2.0*rpi*np.sqrt(Xb + Y3[~index_ABS])*W1[~index_ABS])
+        A_SD[index_PART3] = A3
+        if bterm:
+            B_SD[index_PART3] = B3
+
+    return A_SD, B_SD
+
+def htp_profile(sg0, GamD, Gam0, Gam2, Shift0, Shift2, anuVC, eta, sg, line_index = None):
+    """Point-by-point version of hapi.pcqsdhc, where every line parameter is given for every wavenumber.
+
+    This allows the partially-Correlated quadratic-Speed-Dependent Hard-Collision profile of many lines to be evaluated in a single call by concatenating the simulation windows of the lines.
+
+    Parameters
+    ----------
+    sg0, GamD, Gam0, Gam2, Shift0, Shift2, anuVC, eta : array
+        line center, Doppler HWHM, speed-averaged width, speed dependence of the width, speed-averaged shift, speed dependence of the shift, velocity-changing frequency, and correlation parameter for each point (see hapi.pcqsdhc).
+    sg : array
+        wavenumber (cm-1) of each point.
+    line_index : array, optional
+        line that each point belongs to.  pcqsdhc selects the far-wing expansion of the Voigt B-term for a whole line, so this is used to reproduce that choice.  The default is None, which treats all points as a single line.
+
+    Returns
+    -------
+    real : array
+        real part of the normalized spectral shape (cm).
+    imag : array
+        imaginary part of the normalized spectral shape (cm).
+
+    """
+    number_of_points = len(sg)
+    Aterm = np.zeros(number_of_points, dtype = complex)
+    Bterm = np.zeros(number_of_points, dtype = complex)
+
+    cte = np.sqrt(np.log(2.0)) / GamD
+    rpi = np.sqrt(np.pi)
+    c0 = Gam0 + 1.0j*Shift0
+    c2 = Gam2 + 1.0j*Shift2
+    c0t = (1.0 - eta)*(c0 - 1.5*c2) + anuVC
+    c2t = (1.0 - eta)*c2
+
+    #Voigt-like lines (c2t = 0)
+    index_VP = np.abs(c2t) == 0.0
+    if index_VP.any():
+        cte_VP = cte[index_VP]
+        Z1 = (1.0j*(sg0[index_VP] - sg[index_VP]) + c0t[index_VP])*cte_VP
+        W1 = _cpf(-Z1.imag, Z1.real)
+        Aterm[index_VP] = rpi*cte_VP*W1
+        line_index_VP = None if line_index is None else line_index[index_VP]
+        far_wing = _any_per_line(np.abs(Z1) > 4.0e3, line_index_VP)
+        Bterm[index_VP] = np.where(far_wing,
+                                   cte_VP*(rpi*W1 + 0.5/Z1 - 0.75/(Z1**3)),
+                                   rpi*cte_VP*((1.0 - Z1**2)*W1 + Z1/rpi))
+
+    #Speed-dependent lines
+    index_SD = ~index_VP
+    if index_SD.any():
+        c2t_SD = c2t[index_SD]
+        cte_SD = cte[index_SD]
+        X = (1.0j*(sg0[index_SD] - sg[index_SD]) + c0t[index_SD]) / c2t_SD
+        Y = 1.0 / ((2.0*cte_SD*c2t_SD))**2
+        csqrtY = (Gam2[index_SD] - 1.0j*Shift2[index_SD]) / (2.0*cte_SD*(1.0 - eta[index_SD])*(Gam2[index_SD]**2 + Shift2[index_SD]**2))
+        sub_SD = np.flatnonzero(index_SD)
+        Z1_PART2 = lambda index_PART2: (1.0j*(sg0[sub_SD[index_PART2]] - sg[sub_SD[index_PART2]]) + c0t[sub_SD[index_PART2]])*cte[sub_SD[index_PART2]]
+        Aterm[index_SD], Bterm[index_SD] = _sd_terms(X, Y, csqrtY, c2t_SD, cte_SD, Z1_PART2)
+
+    LS_pCqSDHC = (1.0 / np.pi)*(Aterm / (1.0 - (anuVC - eta*(c0 - 1.5*c2))*Aterm + eta*c2*Bterm))
+    return LS_pCqSDHC.real, LS_pCqSDHC.imag
+
+def _per_point(line_index):
+    """Returns a function that gathers line parameters to the points of the lines, or leaves them unchanged if line_index is None.
+    """
+    if line_index is None:
+        return lambda parameter: parameter
+    return lambda parameter: parameter[line_index]
+
+def voigt_profile(sg0, GamD, Gam0, Shift0, anuVC, eta, sg, line_index = None):
+    """pcqsdhc for lines without speed dependence (Gam2 = Shift2 = 0), which covers the Voigt (anuVC = 0) and the Nelkin-Ghatak (Rautian) profiles.
+
+    Without speed dependence the B-term of pcqsdhc is multiplied by zero, so only the A-term is calculated, with a single evaluation of the complex probability function.  The line dependent terms are calculated once for each line, and for Voigt lines the normalization denominator, which is exactly 1, is skipped.
+
+    Parameters
+    ----------
+    sg0, GamD, Gam0, Shift0, anuVC, eta : array
+        line center, Doppler HWHM, speed-averaged width, speed-averaged shift, velocity-changing frequency, and correlation parameter of each line (see hapi.pcqsdhc).
+    sg : array
+        wavenumber (cm-1) of each point.
+    line_index : array, optional
+        line that each point belongs to.  The default is None, where the line parameters are given for each point.
+
+    Returns
+    -------
+    real : array
+        real part of the normalized spectral shape (cm).
+    imag : array
+        imaginary part of the normalized spectral shape (cm).
+
+    """
+    per_point = _per_point(line_index)
+    cte = np.sqrt(np.log(2.0)) / GamD
+    c0 = Gam0 + 1.0j*Shift0
+    c0t = (1.0 - eta)*c0 + anuVC
+    #Z1 = (i(sg0 - sg) + c0t)*cte, evaluated as the arguments of the complex probability function
+    W = _cpf(-((per_point(sg0) - sg) + per_point(c0t.imag))*per_point(cte), per_point(c0t.real*cte))
+    Aterm = per_point(np.sqrt(np.pi)*cte)*W
+
+    correction = anuVC - eta*c0
+    narrowed = np.flatnonzero(per_point(correction != 0))
+    LS_pCqSDHC = (1.0 / np.pi)*Aterm
+    if len(narrowed) > 0:
+        LS_pCqSDHC[narrowed] = (1.0 / np.pi)*(Aterm[narrowed] / (1.0 - per_point(correction)[narrowed]*Aterm[narrowed]))
+    return LS_pCqSDHC.real, LS_pCqSDHC.imag
+
+def sdvp_profile(sg0, GamD, Gam0, Gam2, Shift0, Shift2, anuVC, sg, line_index = None):
+    """pcqsdhc for speed-dependent lines without correlation (eta = 0), which covers the speed-dependent Voigt and speed-dependent Nelkin-Ghatak profiles.
+
+    Without correlation the B-term of pcqsdhc is multiplied by zero, so only the A-term is calculated.  The line dependent terms are calculated once for each line.
+
+    Parameters
+    ----------
+    sg0, GamD, Gam0, Gam2, Shift0, Shift2, anuVC : array
+        line center, Doppler HWHM, speed-averaged width, speed dependence of the width, speed-averaged shift, speed dependence of the shift, and velocity-changing frequency of each line (see hapi.pcqsdhc).  Gam2 and Shift2 must not both be zero.
+    sg : array
+        wavenumber (cm-1) of each point.
+    line_index : array, optional
+        line that each point belongs to.  The default is None, where the line parameters are given for each point.
+
+    Returns
+    -------
+    real : array
+        real part of the normalized spectral shape (cm).
+    imag : array
+        imaginary part of the normalized spectral shape (cm).
+
+    """
+    per_point = _per_point(line_index)
+    cte = np.sqrt(np.log(2.0)) / GamD
+    c0 = Gam0 + 1.0j*Shift0
+    c2 = Gam2 + 1.0j*Shift2
+    c0t = (c0 - 1.5*c2) + anuVC
+    Y = 1.0 / ((2.0*cte*c2))**2
+    csqrtY = (Gam2 - 1.0j*Shift2) / (2.0*cte*(Gam2**2 + Shift2**2))
+
+    d = per_point(sg0) - sg
+    c0t = per_point(c0t)
+    c2 = per_point(c2)
+    cte = per_point(cte)
+    X = (1.0j*d + c0t) / c2
+    Z1_PART2 = lambda index_PART2: (1.0j*d[index_PART2] + c0t[index_PART2])*cte[index_PART2]
+    Aterm, Bterm = _sd_terms(X, per_point(Y), per_point(csqrtY), c2, cte, Z1_PART2, bterm = False)
+
+    correction = per_point(anuVC)
+    narrowed = np.flatnonzero(correction != 0)
+    LS_pCqSDHC = (1.0 / np.pi)*Aterm
+    if len(narrowed) > 0:
+        LS_pCqSDHC[narrowed] = (1.0 / np.pi)*(Aterm[narrowed] / (1.0 - correction[narrowed]*Aterm[narrowed]))
+    return LS_pCqSDHC.real, LS_pCqSDHC.imag
+
+def line_profile_types(Gamma2, Shift2, Eta):
+    """Classifies each line by the kernel needed for its effective line profile.
+
+    Parameters
+    ----------
+    Gamma2, Shift2, Eta : array
+        speed dependence of the width, speed dependence of the shift, and correlation parameter of each line at experimental conditions.
+
+    Returns
+    -------
+    voigt : array
+        True for lines without speed dependence (Voigt and Nelkin-Ghatak), calculated with voigt_profile.
+    sdvp : array
+        True for speed-dependent lines without correlation (speed-dependent Voigt and Nelkin-Ghatak), calculated with sdvp_profile.
+    htp : array
+        True for the remaining lines, calculated with the full htp_profile.
+
+    """
+    voigt = (Gamma2 == 0) & (Shift2 == 0)
+    sdvp = ~voigt & (Eta == 0)
+    htp = ~(voigt | sdvp)
+    return voigt, sdvp, htp
+
+@lru_cache(maxsize = None)
+def _numba_cross_section():
+    """Returns lineshape_numba.cross_section_numba, or None (with a warning the first time) if numba is not installed.
+    """
+    try:
+        from .lineshape_numba import cross_section_numba
+    except ImportError:
+        warnings.warn("numba is not installed, so the 'numpy' lineshape backend is used instead.")
+        return None
+    return cross_section_numba
+
+def cross_section_batch(wavenumbers, nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength, line_cutoff,
+                        block_size = BLOCK_SIZE, backend = 'numpy'):
+    """Simulates and sums the lines of a line list on a wavenumber axis using the batch line-by-line engine.
+
+    The simulation windows of all lines are found at once, the windows are concatenated into ragged blocks of at most block_size points, the profile of every point in a block is evaluated in one vectorized call for each profile type (see line_profile_types), and the result is scatter-added into the cross section.
+
+    Parameters
+    ----------
+    wavenumbers : array
+        sorted 1-D array of wavenumbers (cm-1) used as the x-axis for the simulation.
+    nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y : array
+        line parameters at the experimental conditions for each line (cm-1), with Y being the dimensionless line mixing term.
+    line_strength : array
+        multiplicative factor applied to each line profile (molecular density * mole fraction * abundance ratio * line intensity).
+    line_cutoff : array or float
+        half-width of the simulation window for each line (cm-1).
+    block_size : int, optional
+        maximum number of points evaluated in one block. The default is BLOCK_SIZE.
+    backend : str, optional
+        line shape backend, either 'numpy' or 'numba'.  The 'numba' backend evaluates the lines with the compiled loop in lineshape_numba.cross_section_numba, and falls back to 'numpy' with a warning if numba is not installed. The default is 'numpy'.
+
+    Returns
+    -------
+    xsect : array
+        summed cross section on the wavenumber axis.
+
+    """
+    if backend not in LINESHAPE_BACKENDS:
+        raise ValueError("lineshape backend must be one of %s, not '%s'" % (LINESHAPE_BACKENDS, backend))
+    if (backend == 'numba') and (_numba_cross_section() != None):
+        return _numba_cross_section()(wavenumbers, nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength, line_cutoff)
+    wavenumbers = np.asarray(wavenumbers, dtype = float)
+    xsect = np.zeros(len(wavenumbers))
+    if len(nu) == 0:
+        return xsect
+    lower, upper = line_windows(wavenumbers, nu, line_cutoff)
+    counts = upper - lower
+    line_end = np.cumsum(counts)
+    #Line parameters for each profile type and the position of each line within its profile type
+    voigt, sdvp, htp = line_profile_types(Gamma2, Shift2, Eta)
+    type_position = np.zeros(len(nu), dtype = int)
+    for profile in [voigt, sdvp]:
+        type_position[profile] = np.arange(np.count_nonzero(profile))
+    voigt_lines = (nu[voigt], GammaD[voigt], Gamma0[voigt], Shift0[voigt], NuVC[voigt], Eta[voigt])
+    sdvp_lines = (nu[sdvp], GammaD[sdvp], Gamma0[sdvp], Gamma2[sdvp], Shift0[sdvp], Shift2[sdvp], NuVC[sdvp])
+
+    line_start = 0
+    while line_start < len(nu):
+        #Largest group of lines whose windows fit in the block (always at least one line)
+        points_before = line_end[line_start] - counts[line_start]
+        line_stop = max(np.searchsorted(line_end, points_before + block_size, side = 'right'), line_start + 1)
+        block_counts = counts[line_start:line_stop]
+        n_points = block_counts.sum()
+        if n_points > 0:
+            line_index = np.repeat(np.arange(line_start, line_stop), block_counts)
+            point_index = np.arange(n_points) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts) + np.repeat(lower[line_start:line_stop], block_counts)
+            real = np.zeros(n_points)
+            imag = np.zeros(n_points)
+            #Dispatch the points to the kernel for the profile of their line
+            points = np.flatnonzero(voigt[line_index])
+            if len(points) > 0:
+                real[points], imag[points] = voigt_profile(*voigt_lines, wavenumbers[point_index[points]],
+                                                           line_index = type_position[line_index[points]])
+            points = np.flatnonzero(sdvp[line_index])
+            if len(points) > 0:
+                real[points], imag[points] = sdvp_profile(*sdvp_lines, wavenumbers[point_index[points]],
+                                                          line_index = type_position[line_index[points]])
+            points = np.flatnonzero(htp[line_index])
+            if len(points) > 0:
+                lines = line_index[points]
+                real[points], imag[points] = htp_profile(nu[lines], GammaD[lines], Gamma0[lines], Gamma2[lines],
+                                                         Shift0[lines], Shift2[lines], NuVC[lines], Eta[lines],
+                                                         wavenumbers[point_index[points]], line_index = lines)
+            xsect += np.bincount(point_index, weights = line_strength[line_index]*(real + Y[line_index]*imag), minlength = len(wavenumbers))
+        line_start = line_stop
+    return xsect
+
+# Diluent-dependent line parameters, stored in LineArrays as (number of diluents, number of lines) arrays.
+DILUENT_PARAMETERS = ('gamma0', 'n_gamma0', 'delta0', 'n_delta0', 'SD_gamma', 'n_gamma2', 'SD_delta', 'n_delta2',
+                      'nuVC', 'n_nuVC', 'eta', 'y', 'n_y')
+
+class LineArrays:
+    """Struct-of-arrays representation of a line list used in the simulation hot path.
+
+    Each line parameter is held in a contiguous NumPy array (int32 for the molecule and isotope ids, float64 otherwise) instead of a dataframe column.  The diluent-dependent parameters (see DILUENT_PARAMETERS) are 2-D arrays with one row per diluent, so that gamma0[row, i] corresponds to the gamma0_species column for line i.
+
+    Use LineArrays.from_dataframe to build the arrays from a line list dataframe.
+
+    Attributes
+    ----------
+    index : array
+        index labels of the lines in the source dataframe.
+    diluents : tuple
+        diluent species, in the order of the rows of the diluent-dependent arrays.
+    molec_id, local_iso_id : array
+        HITRAN molecule and isotopologue ids (int32).
+    isotopes : tuple
+        unique (molec_id, local_iso_id) pairs in the line list.
+    isotope_index : array
+        position of the (molec_id, local_iso_id) pair of each line in isotopes (int32), so that isotope properties can be gathered for all lines at once.
+    nu, sw, elower : array
+        line center (cm-1), line intensity at 296 K and lower-state energy (cm-1) (float64).
+    sw_scale_factor : array
+        multiplicative factor applied to sw to get the line intensity.
+    gamma0, n_gamma0, delta0, n_delta0, SD_gamma, n_gamma2, SD_delta, n_delta2, nuVC, n_nuVC, eta, y, n_y : array
+        diluent-dependent line parameters with shape (number of diluents, number of lines).
+    columns : dict
+        maps the dataframe column names the arrays were built from to (attribute, row), where row is None for diluent-independent parameters.
+    positions : dict
+        maps the index labels to the position of each line in the arrays.
+
+    """
+    __slots__ = ('index', 'diluents', 'molec_id', 'local_iso_id', 'isotopes', 'isotope_index', 'nu', 'sw', 'elower', 'sw_scale_factor') + DILUENT_PARAMETERS + ('columns', 'positions')
+
+    @classmethod
+    def from_dataframe(cls, linelist, diluents, spectrum_number = None, sw_scale_factor = False):
+        """Builds the line arrays from a line list dataframe (see HTP_from_DF_select for the expected columns).
+
+        Parameters
+        ----------
+        linelist : dataframe
+            line list with the nu, sw, elower, molec_id, local_iso_id columns and the diluent-dependent columns (ie gamma0_air) for each diluent.
+        diluents : dict or list
+            diluent species to read the diluent-dependent columns for.  The Diluent dictionary of a spectrum can be used directly.
+        spectrum_number : int, optional
+            If given, then spectrum specific columns (ie nu_1 for spectrum 1) are used in place of the generic column when they are in the line list. The default is None.
+        sw_scale_factor : bool, optional
+            If True, then the sw_scale_factor column is read, as in the parameter line list used for fitting.  Otherwise the scale factor is 1. The default is False.
+
+        Returns
+        -------
+        LineArrays
+
+        """
+        lines = cls()
+        lines.index = linelist.index.values
+        lines.diluents = tuple(diluents)
+        lines.columns = {}
+        lines.positions = {label: position for position, label in enumerate(lines.index)}
+
+        def source_column(column):
+            if (spectrum_number != None) and ((column + '_' + str(spectrum_number)) in linelist):
+                return column + '_' + str(spectrum_number)
+            return column
+
+        lines.molec_id = np.ascontiguousarray(linelist['molec_id'].values, dtype = np.int32)
+        lines.local_iso_id = np.ascontiguousarray(linelist['local_iso_id'].values, dtype = np.int32)
+        isotopes, isotope_index = np.unique(np.column_stack((lines.molec_id, lines.local_iso_id)), axis = 0, return_inverse = True)
+        lines.isotopes = tuple((int(molec), int(iso)) for molec, iso in isotopes)
+        lines.isotope_index = np.ascontiguousarray(isotope_index.ravel(), dtype = np.int32)
+        for parameter in ['nu', 'sw', 'elower']:
+            column = source_column(parameter)
+            setattr(lines, parameter, np.array(linelist[column].values, dtype = np.float64))
+            lines.columns[column] = (parameter, None)
+        if sw_scale_factor:
+            lines.sw_scale_factor = np.array(linelist['sw_scale_factor'].values, dtype = np.float64)
+        else:
+            lines.sw_scale_factor = np.ones(len(linelist))
+        for parameter in DILUENT_PARAMETERS:
+            values = np.empty((len(lines.diluents), len(linelist)))
+            for row, species in enumerate(lines.diluents):
+                column = source_column(parameter + '_' + species)
+                values[row] = linelist[column].values
+                lines.columns[column] = (parameter, row)
+            setattr(lines, parameter, values)
+        return lines
+
+    def __len__(self):
+        return len(self.nu)
+
+    def copy(self):
+        """Returns a copy of the line arrays, where the parameter arrays can be changed without changing the original.
+        """
+        lines = LineArrays()
+        for attribute in self.__slots__:
+            value = getattr(self, attribute)
+            setattr(lines, attribute, value.copy() if isinstance(value, np.ndarray) else value)
+        return lines
+
+    def take(self, lines):
+        """Returns the line arrays for a subset of the lines.
+
+        Parameters
+        ----------
+        lines : array
+            boolean mask or positions of the lines to keep.
+
+        Returns
+        -------
+        LineArrays
+            copy of the selected lines, with the same diluents, columns and isotopes.
+
+        """
+        subset = LineArrays()
+        for attribute in self.__slots__:
+            value = getattr(self, attribute)
+            if attribute in DILUENT_PARAMETERS:
+                value = value[:, lines]
+            elif isinstance(value, np.ndarray):
+                value = value[lines]
+            setattr(subset, attribute, value)
+        subset.positions = {label: position for position, label in enumerate(subset.index)}
+        return subset
+
+    def set_value(self, column, line, value):
+        """Sets the value of a parameter for one line.
+
+        Parameters
+        ----------
+        column : str
+            dataframe column name of the parameter (ie sw or gamma0_air_1).
+        line : int
+            index label of the line.
+        value : float
+            new value of the parameter.
+
+        """
+        attribute, row = self.columns[column]
+        if row == None:
+            getattr(self, attribute)[self.positions[line]] = value
+        else:
+            getattr(self, attribute)[row, self.positions[line]] = value
+
+    def diluent_row(self, species):
+        """Returns the row of the diluent-dependent arrays corresponding to the diluent species.
+        """
+        return self.diluents.index(species)
@@ -0,0 +1,152 @@
+#Import Packages
+import cmath
+import math
+
+import numpy as np
+from numba import njit
+
+from .hapi import tt
+from .lineshape import line_windows, weideman_coefficients
+
+
+@njit(cache = True)
+def _cpf(Z, L, a):
+    """Complex probability function at x = -Im(Z), y = Re(Z), as calculated by hapi.hum1_wei (Weideman series with coefficients a and scale L).
+    """
+    x = -Z.imag
+    y = Z.real
+    if abs(x) + y < 15.0:
+        iz = complex(-y, x)
+        denominator = L - iz
+        Z_series = (L + iz) / denominator
+        p = 0.0j
+        for k in range(len(a)):
+            p = p*Z_series + a[k]
+        return 2*p / denominator**2 + (1 / math.sqrt(math.pi)) / denominator
+    t = complex(y, -x)
+    return 1 / math.sqrt(math.pi) * t / (0.5 + t*t)
+
+@njit(cache = True)
+def _cpf3(Z):
+    """Complex probability function at x = -Im(Z), y = Re(Z), as calculated by hapi.cpf3.
+    """
+    zm1 = 1.0 / complex(-Z.imag, Z.real)
+    zm2 = zm1*zm1
+    zsum = 1.0 + 0.0j
+    zterm = 1.0 + 0.0j
+    for k in range(len(tt)):
+        zterm *= zm2*tt[k]
+        zsum += zterm
+    return zsum*(1.0j*zm1*0.564189583547756)
+
+@njit(cache = True)
+def _htp_point(sg0, cte, c0, c2, c0t, c2t, anuVC, eta, Gam2, Shift2, sg, bterm, far_wing, L, a):
+    """hapi.pcqsdhc for a single wavenumber, where bterm selects whether the B-term is needed (eta*c2 != 0) and far_wing selects the far-wing expansion of the Voigt B-term for the line.
+    """
+    rpi = math.sqrt(math.pi)
+    Bterm = 0.0j
+    if c2t == 0.0:
+        Z1 = (1.0j*(sg0 - sg) + c0t)*cte
+        W1 = _cpf(Z1, L, a)
+        Aterm = rpi*cte*W1
+        if bterm:
+            if far_wing:
+                Bterm = cte*(rpi*W1 + 0.5/Z1 - 0.75/(Z1**3))
+            else:
+                Bterm = rpi*cte*((1.0 - Z1**2)*W1 + Z1/rpi)
+    else:
+        X = (1.0j*(sg0 - sg) + c0t) / c2t
+        Y = 1.0 / ((2.0*cte*c2t))**2
+        csqrtY = complex(Gam2, -Shift2) / (2.0*cte*(1.0 - eta)*(Gam2**2 + Shift2**2))
+        if abs(X) <= 3.0e-8*abs(Y):
+            #PART2
+            Z1 = (1.0j*(sg0 - sg) + c0t)*cte
+            Z2 = cmath.sqrt(X + Y) + csqrtY
+            W1 = _cpf(Z1, L, a)
+            W2 = _cpf(Z2, L, a)
+            Aterm = rpi*cte*(W1 - W2)
+            if bterm:
+                Bterm = (-1.0 + rpi/(2.0*csqrtY)*(1.0 - Z1**2)*W1 - rpi/(2.0*csqrtY)*(1.0 - Z2**2)*W2) / c2t
+        elif abs(Y) <= 1.0e-15*abs(X):
+            #PART3
+            sqrtX = cmath.sqrt(X)
+            sqrtXY = cmath.sqrt(X + Y)
+            if abs(sqrtX) <= 4.0e3:
+                Wb = _cpf(sqrtX, L, a)
+                Aterm = (2.0*rpi/c2t)*(1.0/rpi - sqrtX*Wb)
+                if bterm:
+                    Bterm = (1.0/c2t)*(-1.0 + 2.0*rpi*(1.0 - X - 2.0*Y)*(1.0/rpi - sqrtX*Wb) + 2.0*rpi*sqrtXY*_cpf(sqrtXY, L, a))
+            else:
+                Aterm = (1.0/c2t)*(1.0/X - 1.5/(X**2))
+                if bterm:
+                    Bterm = (1.0/c2t)*(-1.0 + (1.0 - X - 2.0*Y)*(1.0/X - 1.5/(X**2)) + 2.0*rpi*sqrtXY*_cpf(sqrtXY, L, a))
+        else:
+            #PART4
+            Z1 = cmath.sqrt(X + Y) - csqrtY
+            Z2 = Z1 + 2.0*csqrtY
+            SZ1 = abs(Z1)
+            SZ2 = abs(Z2)
+            if (abs(SZ1 - SZ2) <= 1.0) and (max(SZ1, SZ2) > 8.0) and (min(SZ1, SZ2) <= 8.0):
+                W1 = _cpf3(Z1)
+                W2 = _cpf3(Z2)
+            else:
+                W1 = _cpf(Z1, L, a)
+                W2 = _cpf(Z2, L, a)
+            Aterm = rpi*cte*(W1 - W2)
+            if bterm:
+                Bterm = (-1.0 + rpi/(2.0*csqrtY)*(1.0 - Z1**2)*W1 - rpi/(2.0*csqrtY)*(1.0 - Z2**2)*W2) / c2t
+    return (1.0 / math.pi)*(Aterm / (1.0 - (anuVC - eta*(c0 - 1.5*c2))*Aterm + eta*c2*Bterm))
+
+@njit(cache = True)
+def _cross_section(wavenumbers, lower, upper, nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength, L, a, xsect):
+    """Fused loop over the lines and the points in their simulation windows, accumulating directly into xsect.
+    """
+    for i in range(len(nu)):
+        cte = math.sqrt(math.log(2.0)) / GammaD[i]
+        c0 = complex(Gamma0[i], Shift0[i])
+        c2 = complex(Gamma2[i], Shift2[i])
+        c0t = (1.0 - Eta[i])*(c0 - 1.5*c2) + NuVC[i]
+        c2t = (1.0 - Eta[i])*c2
+        bterm = Eta[i]*c2 != 0.0
+        #pcqsdhc uses the far-wing Voigt B-term for the whole line if any point is in the far-wing
+        far_wing = False
+        if bterm and c2t == 0.0:
+            for k in range(lower[i], upper[i]):
+                if abs((1.0j*(nu[i] - wavenumbers[k]) + c0t)*cte) > 4.0e3:
+                    far_wing = True
+                    break
+        for k in range(lower[i], upper[i]):
+            LS = _htp_point(nu[i], cte, c0, c2, c0t, c2t, NuVC[i], Eta[i], Gamma2[i], Shift2[i], wavenumbers[k], bterm, far_wing, L, a)
+            xsect[k] += line_strength[i]*(LS.real + Y[i]*LS.imag)
+    return xsect
+
+def cross_section_numba(wavenumbers, nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength, line_cutoff):
+    """Simulates and sums the lines of a line list on a wavenumber axis with the numba compiled line-by-line engine.
+
+    Each line profile is evaluated point by point in a compiled loop, without intermediate arrays, and accumulated directly into the cross section.  The complex probability function is always the hapi.hum1_wei Weideman series (with hapi.cpf3 where pcqsdhc uses it), independent of the HAPI CPF selection.  Takes the same arguments as lineshape.cross_section_batch.
+
+    Parameters
+    ----------
+    wavenumbers : array
+        sorted 1-D array of wavenumbers (cm-1) used as the x-axis for the simulation.
+    nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y : array
+        line parameters at the experimental conditions for each line (cm-1), with Y being the dimensionless line mixing term.
+    line_strength : array
+        multiplicative factor applied to each line profile (molecular density * mole fraction * abundance ratio * line intensity).
+    line_cutoff : array or float
+        half-width of the simulation window for each line (cm-1).
+
+    Returns
+    -------
+    xsect : array
+        summed cross section on the wavenumber axis.
+
+    """
+    wavenumbers = np.ascontiguousarray(wavenumbers, dtype = float)
+    xsect = np.zeros(len(wavenumbers))
+    if len(nu) == 0:
+        return xsect
+    lower, upper = line_windows(wavenumbers, nu, line_cutoff)
+    L, a = weideman_coefficients(24)
+    line_parameters = [np.ascontiguousarray(parameter, dtype = float) for parameter in [nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength]]
+    return _cross_section(wavenumbers, lower, upper, *line_parameters, L, a, xsect)
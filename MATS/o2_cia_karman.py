@@ -1,12 +1,117 @@
 #Import Packages
 import numpy as np
 import pandas as pd
-import scipy.interpolate as interpolate
+from collections import OrderedDict
 from pathlib import Path
 
+#Names of the Karman CIA tables in the CIA data directory for each band
+KARMAN_CIA_TABLES = {'singlet_delta': 'Karman_SingletDelta_Mech_Temp_Dep', 'a_band': 'Karman_ABand_Mech_Temp_Dep'}
+#Maximum number of interpolated temperature profiles kept by each KarmanCIA
+KARMAN_PROFILE_CACHE_SIZE = 64
+
+def _cia_data_directory():
+    """Returns the directory with the CIA tables, independent of the case of its name (CIA_DATA).
+    """
+    for path in Path(__file__).parent.iterdir():
+        if path.is_dir() and (path.name.lower() == 'cia_data'):
+            return path
+    return Path(__file__).parent / "CIA_Data"
+
+class KarmanCIA:
+    """O2 CIA model reported by Karman et al. for one band, where the band table is read once and the interpolated temperature profiles are cached (see o2_cia_karman_model).
+
+    The spin-orbit and exchange temperature polynomials of the table are evaluated at the temperature of a spectrum and linearly interpolated (with linear extrapolation) on the wavenumbers of the spectrum minus the shift.  These profiles are cached for the last KARMAN_PROFILE_CACHE_SIZE (wavenumbers, temperature, shift) conditions, so that an evaluation with a fixed temperature and shift only scales and sums the cached profiles.
+
+    Use KarmanCIA.for_band to get the shared instance for a band.
+
+    Parameters
+    ----------
+    band : str, optional
+        band of the CIA model, either 'a_band' or 'singlet_delta'. The default is 'singlet_delta'.
+
+    """
+    _instances = {}
+
+    def __init__(self, band = 'singlet_delta'):
+        if band not in KARMAN_CIA_TABLES:
+            raise ValueError("band must be one of %s, not '%s'" % (list(KARMAN_CIA_TABLES), band))
+        self.band = band
+        df_Karman = pd.read_csv(_cia_data_directory() / (KARMAN_CIA_TABLES[band] + '.csv'))
+        order = np.argsort(df_Karman['Wavenumber (cm-1)'].values, kind = 'stable')
+        self.model_wavenumber = df_Karman['Wavenumber (cm-1)'].values[order].astype(float)
+        #Temperature polynomial coefficients (a, b, c, d) multiplied by the normalized profile, with shape (4, number of table wavenumbers)
+        self.SO_coefficients = np.asarray([df_Karman['SO Temp Dep - ' + term].values[order] for term in 'abcd'], dtype = float)*df_Karman['Spin Orbit (cm-1 amagat-2) Normalized'].values[order]
+        self.EXCH_coefficients = np.asarray([df_Karman['EXCH Temp Dep - ' + term].values[order] for term in 'abcd'], dtype = float)*df_Karman['Exchange (cm-1 amagat-2) Normalized'].values[order]
+        self.grids = []
+        self.profiles = OrderedDict()
+
+    @classmethod
+    def for_band(cls, band = 'singlet_delta'):
+        """Returns the KarmanCIA for a band, which is only created (and the table read) once for each process.
+        """
+        if band not in cls._instances:
+            cls._instances[band] = cls(band)
+        return cls._instances[band]
+
+    def _grid(self, wavenumbers):
+        """Returns the position of the wavenumber grid in the stored grids, adding it if it is new.
+        """
+        for position, grid in enumerate(self.grids):
+            if (len(grid) == len(wavenumbers)) and ((len(grid) == 0) or (grid[0] == wavenumbers[0])) and np.array_equal(grid, wavenumbers):
+                return position
+        if len(self.grids) >= KARMAN_PROFILE_CACHE_SIZE:
+            self.grids = []
+            self.profiles.clear()
+        self.grids.append(wavenumbers.copy())
+        return len(self.grids) - 1
+
+    def profile(self, wavenumbers, T, shift = 0, mechanism = 'SO'):
+        """Spin-orbit ('SO') or exchange ('EXCH') temperature dependent profile at temperature T (K), interpolated at the wavenumbers - shift.
+        """
+        wavenumbers = np.asarray(wavenumbers, dtype = float)
+        key = (self._grid(wavenumbers), float(T), float(shift), mechanism)
+        if key in self.profiles:
+            self.profiles.move_to_end(key)
+            return self.profiles[key]
+        if mechanism == 'SO':
+            coefficients = self.SO_coefficients
+        else:
+            coefficients = self.EXCH_coefficients
+        table_profile = coefficients[3]*(T-296)**3 + coefficients[2]*(T-296)**2 + coefficients[1]*(T-296) + coefficients[0]
+        #Linear interpolation, which is extrapolated with the first and last table intervals
+        x = wavenumbers - shift
+        index = np.clip(np.searchsorted(self.model_wavenumber, x, side = 'right') - 1, 0, len(self.model_wavenumber) - 2)
+        weight = (x - self.model_wavenumber[index]) / (self.model_wavenumber[index + 1] - self.model_wavenumber[index])
+        profile = table_profile[index]*(1 - weight) + table_profile[index + 1]*weight
+        self.profiles[key] = profile
+        if len(self.profiles) > KARMAN_PROFILE_CACHE_SIZE:
+            self.profiles.popitem(last = False)
+        return profile
+
+    def __call__(self, wavenumbers, T, P, Diluent,
+                 SO_O2, SO_N2, EXCH_O2,
+                 EXCH_b, EXCH_c,
+                 SO_b_O2_O2, SO_c_O2_O2,
+                 SO_b_O2_N2, SO_c_O2_N2,
+                 SO_shift_O2_O2 = 0, SO_shift_O2_N2 = 0,
+                 EXCH_shift = 0):
+        """Calculates the CIA on the wavenumbers (see o2_cia_karman_model for the parameters).
+        """
+        SO_O2_O2 = self.profile(wavenumbers, T, SO_shift_O2_O2, 'SO')
+        SO_O2_N2 = self.profile(wavenumbers, T, SO_shift_O2_N2, 'SO')
+        EXCH_ = self.profile(wavenumbers, T, EXCH_shift, 'EXCH')
+
+        amagats_O2 = (P/1)*(273.15/(T))*Diluent['O2']['composition']
+        amagats_N2 = (P/1)*(273.15/(T))*Diluent['N2']['composition']
+
+        O2_O2_scale = amagats_O2*amagats_O2
+        O2_N2_scale = amagats_N2*amagats_O2
+        return ((EXCH_O2*(1 + EXCH_b*(T-296) + EXCH_c*(T-296)**2)*O2_O2_scale)*EXCH_ + (SO_O2*(1 + SO_b_O2_O2*(T-296) + SO_c_O2_O2*(T-296)**2)*O2_O2_scale)*SO_O2_O2
+                + (SO_N2*(1 + SO_b_O2_N2*(T-296) + SO_c_O2_N2*(T-296)**2)*O2_N2_scale)*SO_O2_N2)
+
 def o2_cia_karman_model(wavenumbers, T, P,Diluent,
-                        SO_O2, SO_N2, EXCH_O2, 
-                        EXCH_b, EXCH_c, 
+                        SO_O2, SO_N2, EXCH_O2,
+                        EXCH_b, EXCH_c,
                         SO_b_O2_O2, SO_c_O2_O2,
                         SO_b_O2_N2, SO_c_O2_N2,
                         SO_shift_O2_O2 = 0, SO_shift_O2_N2 = 0,
@@ -14,52 +119,23 @@ def o2_cia_karman_model(wavenumbers, T, P,Diluent,
                         band = 'singlet_delta'):
     '''
     #Default values based on Karman, T. et al., Icarus 2019, 328 , 160 175.
-    
+
     #Singlet Delta
     #EXCH_c, EXCH_b, EXCH_a = [3.6307626466573398e-06, 0.0028385240774561797, 1]
     #SO_c, SO_b, SO_a =[1.4670403122287775e-06, 0.00014594154382655564, 1]
     #SO_O2, SO_N2, EXCH_O2 = [39.13, 70.74 ,304.7448171031378] #Initial guess derived based HITRAN 2020 reported theoretical CIA
-    
+
     #ABand
     #EXCH_c, EXCH_b, EXCH_a =[6.559060698261758e-05, 0.011869752199984616, 1]
     #SO_c, SO_b, SO_a =[1.5906417750834962e-06, 0.00011263534228667677, 1]
     #SO_O2, SO_N2, EXCH_O2 = [6.20731994222978,7.961801018674746, 39.42079598436756]
-    '''
-    
-    
-    prefix_local = Path(__file__).parent / "CIA_Data"
-    paths_default = list(prefix_local.glob('*.csv'))
-    paths_dict = {p.with_suffix('').name : p for p in paths_default}
-    paths_dict['singlet_delta'] = paths_dict.pop('Karman_SingletDelta_Mech_Temp_Dep')
-    paths_dict['a_band'] = paths_dict.pop('Karman_ABand_Mech_Temp_Dep')
-    
-    
-    if band == 'singlet_delta':
-        df_Karman = pd.read_csv(paths_dict['singlet_delta'])
-    elif band == 'a_band':
-        df_Karman = pd.read_csv(paths_dict['a_band'])
-    #print (len(df_Karman['Wavenumber (cm-1)'].values), len(df_Karman['SO Temp Dep - d'].values))
-    
-    model_wavenumber = df_Karman['Wavenumber (cm-1)'].values
-    SO = (df_Karman['SO Temp Dep - d'].values*(T-296)**3 +df_Karman['SO Temp Dep - c'].values*(T-296)**2 + df_Karman['SO Temp Dep - b'].values*(T-296) + df_Karman['SO Temp Dep - a'].values)*df_Karman['Spin Orbit (cm-1 amagat-2) Normalized'].values    
-    EXCH = (df_Karman['EXCH Temp Dep - d'].values*(T-296)**3 +df_Karman['EXCH Temp Dep - c'].values*(T-296)**2 + df_Karman['EXCH Temp Dep - b'].values*(T-296) + df_Karman['EXCH Temp Dep - a'].values)*df_Karman['Exchange (cm-1 amagat-2) Normalized'].values
-
-    
-    f = interpolate.interp1d(model_wavenumber, SO, fill_value = 'extrapolate', bounds_error = False, kind = 'slinear')
-    SO_O2_O2 = f(wavenumbers- SO_shift_O2_O2)
-    g = interpolate.interp1d(model_wavenumber, SO, fill_value = 'extrapolate', bounds_error = False, kind = 'slinear')
-    SO_O2_N2 = g(wavenumbers- SO_shift_O2_N2)
-    h = interpolate.interp1d(model_wavenumber, EXCH, fill_value = 'extrapolate', bounds_error = False, kind = 'slinear')
-    EXCH_ = h(wavenumbers - EXCH_shift)
-    
-    model_O2_O2 = EXCH_O2*(1 + EXCH_b*(T-296) + EXCH_c*(T-296)**2)*EXCH_ + SO_O2*(1 + SO_b_O2_O2*(T-296) + SO_c_O2_O2*(T-296)**2)*SO_O2_O2
-    model_O2_N2 = SO_N2*(1 + SO_b_O2_N2*(T-296) + SO_c_O2_N2*(T-296)**2)*SO_O2_N2
-    
-    amagats_O2 = (P/1)*(273.15/(T))*Diluent['O2']['composition']
-    amagats_N2 = (P/1)*(273.15/(T))*Diluent['N2']['composition']
-    
-    CIA_model = (model_O2_O2*amagats_O2*amagats_O2) + (model_O2_N2*amagats_N2*amagats_O2) 
-    #CIA_model = (Diluent['O2']['composition']*model_O2_O2) + (Diluent['N2']['composition']*model_O2_N2) # in amagats
-    
-    return CIA_model
 
+    #The band table is read once and the interpolated profiles are cached by the shared KarmanCIA for the band (see KarmanCIA.for_band).
+    '''
+    return KarmanCIA.for_band(band)(wavenumbers, T, P, Diluent,
+                                    SO_O2, SO_N2, EXCH_O2,
+                                    EXCH_b, EXCH_c,
+                                    SO_b_O2_O2, SO_c_O2_O2,
+                                    SO_b_O2_N2, SO_c_O2_N2,
+                                    SO_shift_O2_O2 = SO_shift_O2_O2, SO_shift_O2_N2 = SO_shift_O2_N2,
+                                    EXCH_shift = EXCH_shift)
@@ -3,9 +3,8 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
-from scipy.interpolate import RegularGridInterpolator
 
-from .utilities import etalon, convolveSpectrumSame
+from .utilities import etalon, convolveSpectrumSame, load_compressability_table, read_spectrum_columns
 
 from .fit_dataset import HTP_from_DF_select, HTP_wBeta_from_DF_select
 from .hapi import ISO, PYTIPS2011, PYTIPS2017, PYTIPS2021
@@ -21,7 +20,7 @@ class Spectrum:
     ----------
     filename : str
     文件名（不加拓展名）
-        file containing spectrum with .csv extension. File extension is not included in the name
+        file containing spectrum with .csv extension. File extension is not included in the name.  The numeric columns of the file are cached in filename + '.columns.npz' on the first read, which is used instead of the csv file until the csv file changes (see utilities.read_spectrum_columns).
     molefraction : dict
     光谱中每个分子的摩尔分数
         mole fraction of each molecule in spectra in the format {molec_id: mole fraction (out of 1), molec_id: molefraction, . . . }
@@ -161,7 +160,13 @@ class Spectrum:
         #文件格式转换
         # file_contents = pd.read_excel(self.filename + '.xlsx')
         # file_contents.to_csv(self.filename + '.csv', index=False)
-        file_contents = pd.read_csv(self.filename + '.csv', float_precision='high')
+        #Only the used columns are read, from the binary column cache of the file after the first read (see read_spectrum_columns)
+        file_columns = [self.pressure_column, self.temperature_column, self.frequency_column, self.tau_column]
+        if self.tau_stats_column != None:
+            file_columns.append(self.tau_stats_column)
+        if self.segment_column != None:
+            file_columns.append(self.segment_column)
+        file_contents = read_spectrum_columns(self.filename, file_columns)
         self.pressure = file_contents[self.pressure_column].mean() / 760
         self.temperature = file_contents[self.temperature_column].mean() + 273.15
         if self.input_freq:
@@ -192,8 +197,11 @@ class Spectrum:
         self.model = len(self.alpha)*[0.0]
         self.residuals = self.alpha - self.model
         self.background = len(self.alpha)*[0.0]
-        self.cia = len(self.alpha)*[0.0]
+        self.cia = np.zeros(len(self.alpha))
         self.compressability_file = compressability_file
+        self.segment_cache = None
+        #Counts the changes made through the set_ methods, so that the Fit_DataSet caches only compare the arrays of the spectrum by identity (see Fit_DataSet._model_state)
+        self.version = 0
 
 
     def diluent_sum_check(self):
@@ -213,6 +221,33 @@ class Spectrum:
         if diluent_sum != 1:
             print ("YOUR DILUENTS DO NOT SUM TO ONE!  They sum to " + str(diluent_sum))
 
+    def segment_slices(self):
+        """Defines the slice of the spectrum arrays from the first to the last point of each spectrum segment.
+
+        The segment boundaries are found once from the runs of the segment column and stored in the segment_cache, which is updated when the segments are replaced.  Slicing the spectrum arrays (ie spectrum.wavenumber[segment_slice]) gives views of the segment, which should not be modified in place.
+
+        Returns
+        -------
+        segment_slices : dict
+            dictionary where the key corresponds to a segment number (in increasing order) and the value is the slice(start, stop) of that segment.
+
+        """
+        if (self.segment_cache == None) or (self.segment_cache['segments'] is not self.segments) or (self.segment_cache['length'] != len(self.segments)):
+            segments = np.asarray(self.segments)
+            #Runs of equal segment numbers
+            run_starts = np.concatenate(([0], np.flatnonzero(segments[1:] != segments[:-1]) + 1))
+            run_stops = np.append(run_starts[1:], len(segments))
+            segment_slices = {}
+            indices = {}
+            for segment, start, stop in sorted(zip(segments[run_starts].tolist(), run_starts.tolist(), run_stops.tolist())):
+                if segment in segment_slices:
+                    #Segments split into several runs keep the indices of their points
+                    indices[segment] = np.flatnonzero(segments == segment)
+                    start = segment_slices[segment].start
+                segment_slices[segment] = slice(start, stop)
+            self.segment_cache = {'segments': self.segments, 'length': len(self.segments), 'slices': segment_slices, 'indices': indices}
+        return self.segment_cache['slices']
+
     def segment_wave_alpha(self):
         """Defines the wavenumber, alpha, and indices of spectrum that correspond to a given spectrum segment.
 
@@ -231,8 +266,12 @@ class Spectrum:
         wavenumber_segments = {}
         alpha_segments = {}
         indices_segments = {}
-        for segment in list(set(self.segments)):
-            indices = [i for i, x in enumerate(self.segments) if x == segment]
+        segment_slices = self.segment_slices()
+        for segment in segment_slices:
+            if segment in self.segment_cache['indices']:
+                indices = self.segment_cache['indices'][segment]
+            else:
+                indices = np.arange(segment_slices[segment].start, segment_slices[segment].stop)
             indices_segments[segment] = indices
             wavenumber_segments[segment] = self.wavenumber[indices]
             alpha_segments[segment] = self.alpha[indices]
@@ -286,16 +325,21 @@ class Spectrum:
 
     ##SETTERS
     def set_weight(self, new_weight):
+        self.version += 1
         self.weight = new_weight
         if new_weight == 0:
             print ('Change the weight to a non-zero value or remove the spectrum from the dataset.  If the weight is 0, then the residuals returned for that spectrum will be 0. ')
     def set_molefraction(self, new_molefraction):
+        self.version += 1
         self.molefraction = new_molefraction
     def set_natural_abundance(self, new_natural_abundance):
+        self.version += 1
         self.natural_abundance = new_natural_abundance
     def set_abundance_ration_MI(self, new_abundance_ratio_MI):
+        self.version += 1
         self.abundance_ratio_MI = new_abundance_ratio_MI
     def set_diluent(self, new_diluent):
+        self.version += 1
         self.diluent = new_diluent
         if self.diluent == 'air':
             self.Diluent = {self.diluent: {'composition':1, 'm': 28.95734}}
@@ -306,30 +350,37 @@ class Spectrum:
             print ('If using the HTP_wBeta_from_DF_select then you need to go back and use the Diluent{diluent:{"composition": 1, "m": mass}} format')
             self.Diluent = {self.diluent: {'composition':1, 'm': 0.0}}
     def set_Diluent(self, new_Diluent):
+        self.version += 1
         self.Diluent = new_Diluent
     def set_spectrum_number(self, new_spectrum_number):
+        self.version += 1
         self.spectrum_number = new_spectrum_number
     def set_pressure_column(self, new_pressure_column):
+        self.version += 1
         self.pressure_column = new_pressure_column
-        file_contents = pd.read_csv(self.filename + '.csv')
+        file_contents = read_spectrum_columns(self.filename, [self.pressure_column])
         self.pressure = file_contents[self.pressure_column].mean() / 760
     def set_temperature_column(self, new_temperature_column):
-        self.temperature_colum = new_temperature_column
-        file_contents = pd.read_csv(self.filename + '.csv')
+        self.version += 1
+        self.temperature_column = new_temperature_column
+        file_contents = read_spectrum_columns(self.filename, [self.temperature_column])
         self.temperature = file_contents[self.temperature_column].mean() + 273.15
     def set_frequency_column(self, new_frequency_column):
+        self.version += 1
         self.frequency_column = new_frequency_column
-        file_contents = pd.read_csv(self.filename + '.csv')
+        file_contents = read_spectrum_columns(self.filename, [self.frequency_column])
         self.frequency = file_contents[self.frequency_column].values
         self.wavenumber = self.frequency*10**6 / CONSTANTS['c']
     def set_tau_column(self, new_tau_column):
+        self.version += 1
         self.tau_column = new_tau_column
-        file_contents = pd.read_csv(self.filename + '.csv')
+        file_contents = read_spectrum_columns(self.filename, [self.tau_column])
         self.tau = file_contents[self.tau_column].values
         self.alpha = (self.tau* CONSTANTS['c']*1e-12)**-1
     def set_tau_stats_column(self, new_tau_stats_column):
+        self.version += 1
         self.tau_stats_column = new_tau_stats_column
-        file_contents = pd.read_csv(self.filename + '.csv')
+        file_contents = read_spectrum_columns(self.filename, [self.tau_stats_column])
         stats = file_contents[self.tau_stats_column].values
         stats= np.nan_to_num(stats)
         median_tau_stats = np.median(stats [stats  > 0])
@@ -345,8 +396,10 @@ class Spectrum:
     def set_background(self, new_background):
         self.background = new_background
     def set_cia(self, new_cia):
+        #The cia array is compared by identity, and the Karman CIA model sets it at every evaluation, so the version is not changed
         self.cia = new_cia
     def set_nominal_temperature(self, new_nominal_temperature):
+        self.version += 1
         self.nominal_temperature = new_nominal_temperature
 
     ##Other Functions
@@ -417,7 +470,7 @@ class Spectrum:
 
         """
 
-        file_contents = pd.read_csv(self.filename + '.csv')
+        file_contents = read_spectrum_columns(self.filename, [self.pressure_column, self.temperature_column])
         new_file = pd.DataFrame()
         new_file['Spectrum Number'] = [self.spectrum_number]*len(self.alpha)
         new_file['Spectrum Name'] = [self.filename]*len(self.alpha)
@@ -636,16 +689,7 @@ def simulate_spectrum(parameter_linelist,
     temperature_array = len(wavenumbers)*[0.0]
     
     if compressability_file != None:
-        comp_factor = pd.read_csv(compressability_file + '.csv')
-        pressures = np.asarray(comp_factor['Pressure (MPa)'].values*1e6/101325)
-        pressures = pressures.astype(float)
-        temperatures = list(comp_factor)
-        temperatures.remove('Pressure (MPa)')
-        temperatures = np.asarray(temperatures)
-        temperatures = temperatures.astype(float)
-        comp_factor.drop('Pressure (MPa)', inplace=True, axis=1) 
-        comp_factor_array = comp_factor.to_numpy()
-        interp_comp_factor = RegularGridInterpolator(points = [pressures, temperatures], values = comp_factor_array)
+        interp_comp_factor = load_compressability_table(compressability_file)
     
     for seg in range(0, num_segments):
 
@@ -654,7 +698,7 @@ def simulate_spectrum(parameter_linelist,
         segment_pressure = np.mean(np.take(pressure_w_error, segment_array))
         segment_temperature = np.mean(np.take(temperature_w_error, segment_array))
         if compressability_file != None:
-            compressability_factor = interp_comp_factor([segment_pressure, segment_temperature])[0]
+            compressability_factor = float(interp_comp_factor(segment_pressure, segment_temperature))
         else:
             compressability_factor = 1   
 
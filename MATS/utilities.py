@@ -1,5 +1,14 @@
+import os
+import time
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
+
 import numpy as np
-from .hapi import ISO, ISO_INDEX, SLIT_RECTANGULAR
+import pandas as pd
+from scipy.interpolate import RegularGridInterpolator
+from scipy.signal import oaconvolve
+from .hapi import ISO, ISO_INDEX, SLIT_RECTANGULAR, PYTIPS2021, TIPS_2021_ISOT_HASH, TIPS_2021_ISOQ_HASH
 
 
 
@@ -67,6 +76,288 @@ def molecularMass(M,I, isotope_list = ISO):
     """
     return isotope_list[(M,I)][ISO_INDEX['mass']]
 
+# Maximum number of (TIPS, M, I, T) partition sums kept by partition_function.
+PARTITION_FUNCTION_CACHE_SIZE = 4096
+
+@lru_cache(maxsize = PARTITION_FUNCTION_CACHE_SIZE)
+def partition_function(TIPS, M, I, T):
+    """Memoized partition sum look-up, where the least recently used values are discarded once PARTITION_FUNCTION_CACHE_SIZE values are stored.
+
+    Parameters
+    ----------
+    TIPS : definition
+        HAPI provided TIPS version to use for the partition function (ie PYTIPS2021).
+    M : int
+        HITRAN molecule number.
+    I : int
+        HITRAN isotopologue number.
+    T : float
+        temperature (K).
+
+    Returns
+    -------
+    float
+        partition sum at temperature T.  Returns 1 if the TIPS version does not include the isotopologue (ie isotopes added to the isotope list).  PYTIPS2021 is evaluated with tips2021.
+
+    """
+    if TIPS is PYTIPS2021:
+        TIPS = tips2021
+    try:
+        return TIPS(M,I,T)
+    except:
+        return 1
+
+class CompressabilityTable:
+    """Compressability factor as a function of pressure and temperature, linearly interpolated from a table generated by the NIST Refprop program (see the compressability_file of Spectrum).
+
+    Use load_compressability_table to read a table, which is only read once for each file (until the file is modified).
+
+    Parameters
+    ----------
+    pressures : array
+        pressures of the rows of the table (atm).
+    temperatures : array
+        temperatures of the columns of the table (K).
+    values : array
+        compressability factor with shape (number of pressures, number of temperatures).
+
+    """
+    def __init__(self, pressures, temperatures, values):
+        self.pressures = np.asarray(pressures, dtype = float)
+        self.temperatures = np.asarray(temperatures, dtype = float)
+        self.values = np.asarray(values)
+        self.interpolator = RegularGridInterpolator(points = [self.pressures, self.temperatures], values = self.values)
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Reads a compressability table from a csv file with the pressure (MPa) in the 'Pressure (MPa)' column and the temperatures (K) as the remaining column headers.
+        """
+        comp_factor = pd.read_csv(filename)
+        pressures = np.asarray(comp_factor['Pressure (MPa)'].values*1e6/101325)
+        temperatures = list(comp_factor)
+        temperatures.remove('Pressure (MPa)')
+        comp_factor.drop('Pressure (MPa)', inplace=True, axis=1)
+        return cls(pressures, np.asarray(temperatures).astype(float), comp_factor.to_numpy())
+
+    def __call__(self, p, T):
+        """Interpolates the compressability factor at each pressure (atm) and temperature (K), where p and T are floats or arrays of conditions.
+
+        Returns
+        -------
+        array
+            compressability factor with the broadcast shape of p and T.
+
+        """
+        p, T = np.broadcast_arrays(np.asarray(p, dtype = float), np.asarray(T, dtype = float))
+        return self.interpolator(np.stack([p.ravel(), T.ravel()], axis = -1)).reshape(p.shape)
+
+#Compressability tables read by load_compressability_table, with the absolute path of the csv file as the key and the (modification time, size, CompressabilityTable) as the value
+_compressability_tables = {}
+
+def load_compressability_table(compressability_file):
+    """Returns the CompressabilityTable for a compressability file, which is read once for each process and cached until the modification time of the file changes.
+
+    Parameters
+    ----------
+    compressability_file : str
+        name of the compressability file without the .csv extension (see Spectrum).
+
+    Returns
+    -------
+    CompressabilityTable
+
+    """
+    filename = os.path.abspath(compressability_file + '.csv')
+    status = os.stat(filename)
+    cached = _compressability_tables.get(filename)
+    if (cached == None) or (cached[0] != (status.st_mtime_ns, status.st_size)):
+        cached = ((status.st_mtime_ns, status.st_size), CompressabilityTable.from_csv(filename))
+        _compressability_tables[filename] = cached
+    return cached[1]
+
+#Extension of the binary column cache that read_spectrum_columns writes next to each spectrum csv file
+SPECTRUM_CACHE_EXTENSION = '.columns.npz'
+#Age (s) of a csv file before it is cached, as a file rewritten within the timestamp resolution of its file system (up to 2 s) can keep its (modification time, size)
+SPECTRUM_CACHE_MIN_AGE = 2.0
+
+def _write_spectrum_cache(cache_file, file_contents, source):
+    """Writes the numeric columns of a spectrum file to an uncompressed npz column cache, with the names of all of the columns and the (modification time, size) of the csv file.  The cache is written to a temporary file and moved into place, so that a partially written cache is never read.
+    """
+    columns = list(file_contents.columns)
+    numeric = [column for column in columns if file_contents[column].dtype.kind in 'biuf']
+    arrays = {'column_%d' % position: file_contents[column].values for position, column in enumerate(columns) if column in numeric}
+    temporary_file = cache_file + '.%d.tmp' % os.getpid()
+    try:
+        with open(temporary_file, 'wb') as cache:
+            np.savez(cache, __source__ = source, __columns__ = np.asarray(columns, dtype = str), __numeric__ = np.asarray([column in numeric for column in columns], dtype = bool), **arrays)
+        os.replace(temporary_file, cache_file)
+    except OSError:
+        #The cache is optional (ie the directory of the spectrum is read-only)
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+def read_spectrum_columns(filename, columns):
+    """Reads columns of a spectrum csv file, using a binary column cache next to the file that is validated by the modification time and size of the csv file.
+
+    On the first read (or if the csv file has changed), the csv file is parsed with pd.read_csv(float_precision = 'high') and its numeric columns are written to filename + SPECTRUM_CACHE_EXTENSION, unless the csv file was modified less than SPECTRUM_CACHE_MIN_AGE seconds ago.  Later reads only load the requested columns from the cache, which have the same values and dtypes as the parsed csv file.  Non-numeric columns are not cached and are read from the csv file.
+
+    Parameters
+    ----------
+    filename : str
+        name of the spectrum file without the .csv extension (see Spectrum).
+    columns : list
+        names of the columns to read.
+
+    Returns
+    -------
+    file_contents : dataframe
+        dataframe with the requested columns.
+
+    """
+    csv_file = filename + '.csv'
+    cache_file = filename + SPECTRUM_CACHE_EXTENSION
+    status = os.stat(csv_file)
+    source = np.asarray([status.st_mtime_ns, status.st_size], dtype = np.int64)
+    cached_columns = None
+    try:
+        with np.load(cache_file, allow_pickle = False) as cache:
+            if np.array_equal(cache['__source__'], source):
+                positions = {column: position for position, column in enumerate(cache['__columns__'].tolist())}
+                numeric = cache['__numeric__']
+                cached_columns = {column: cache['column_%d' % positions[column]] for column in columns if (column in positions) and numeric[positions[column]]}
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        cached_columns = None
+    if cached_columns == None:
+        file_contents = pd.read_csv(csv_file, float_precision = 'high')
+        if time.time() - status.st_mtime >= SPECTRUM_CACHE_MIN_AGE:
+            _write_spectrum_cache(cache_file, file_contents, source)
+        return file_contents[list(dict.fromkeys(columns))]
+    for column in columns:
+        if column not in positions:
+            raise KeyError(column)
+    text_columns = [column for column in dict.fromkeys(columns) if column not in cached_columns]
+    if len(text_columns) != 0:
+        text_contents = pd.read_csv(csv_file, usecols = text_columns, float_precision = 'high')
+        for column in text_columns:
+            cached_columns[column] = text_contents[column].values
+    return pd.DataFrame({column: cached_columns[column] for column in dict.fromkeys(columns)})
+
+def _lagrange_denominator(difference):
+    """Replaces zero differences between grid points, as in hapi.AtoB.
+    """
+    return np.where(difference == 0.0, 0.0001, difference)
+
+def lagrange_interpolation(aa, A, B):
+    """Vectorized version of the hapi.AtoB LaGrange 3- and 4-point interpolation, which gives identical results.
+
+    The interpolation bracket for each value of aa is found with a binary search instead of a linear scan over the grid.
+
+    Parameters
+    ----------
+    aa : float or array
+        values of the A variable to interpolate at.  These must be within the range of A.
+    A : array
+        sorted grid of the A variable.
+    B : array
+        values of the B variable on the A grid.
+
+    Returns
+    -------
+    bb : array
+        interpolated B values corresponding to aa.
+
+    """
+    aa = np.asarray(aa, dtype = float)
+    A = np.asarray(A, dtype = float)
+    B = np.asarray(B, dtype = float)
+    npt = len(A)
+    #index of the first grid point after the first one that is >= aa
+    K = np.maximum(np.searchsorted(A, aa, side = 'left'), 1)
+    #last point of the bracket, where the first and last intervals use 3 points and the rest 4
+    J = np.maximum(K, 2)
+    three_point = (K < 2) | (K == npt - 1)
+    bb = np.zeros(aa.shape)
+
+    if three_point.any():
+        a = aa[three_point]
+        j = J[three_point]
+        A0D1 = _lagrange_denominator(A[j - 2] - A[j - 1])
+        A0D2 = A[j - 2] - A[j]
+        A1D1 = _lagrange_denominator(A[j - 1] - A[j - 2])
+        A1D2 = _lagrange_denominator(A[j - 1] - A[j])
+        A2D1 = _lagrange_denominator(A[j] - A[j - 2])
+        A2D2 = _lagrange_denominator(A[j] - A[j - 1])
+
+        A0 = (a - A[j - 1]) * (a - A[j]) / (A0D1 * A0D2)
+        A1 = (a - A[j - 2]) * (a - A[j]) / (A1D1 * A1D2)
+        A2 = (a - A[j - 2]) * (a - A[j - 1]) / (A2D1 * A2D2)
+
+        bb[three_point] = A0 * B[j - 2] + A1 * B[j - 1] + A2 * B[j]
+
+    four_point = ~three_point
+    if four_point.any():
+        a = aa[four_point]
+        j = J[four_point]
+        A0D1 = _lagrange_denominator(A[j - 2] - A[j - 1])
+        A0D2 = _lagrange_denominator(A[j - 2] - A[j])
+        A0D3 = _lagrange_denominator(A[j - 2] - A[j + 1])
+        A1D1 = _lagrange_denominator(A[j - 1] - A[j - 2])
+        A1D2 = _lagrange_denominator(A[j - 1] - A[j])
+        A1D3 = _lagrange_denominator(A[j - 1] - A[j + 1])
+        A2D1 = _lagrange_denominator(A[j] - A[j - 2])
+        A2D2 = _lagrange_denominator(A[j] - A[j - 1])
+        A2D3 = _lagrange_denominator(A[j] - A[j + 1])
+        A3D1 = _lagrange_denominator(A[j + 1] - A[j - 2])
+        A3D2 = _lagrange_denominator(A[j + 1] - A[j - 1])
+        A3D3 = _lagrange_denominator(A[j + 1] - A[j])
+
+        A0 = (a - A[j - 1]) * (a - A[j]) * (a - A[j + 1])
+        A0 = A0 / (A0D1 * A0D2 * A0D3)
+        A1 = (a - A[j - 2]) * (a - A[j]) * (a - A[j + 1])
+        A1 = A1 / (A1D1 * A1D2 * A1D3)
+        A2 = (a - A[j - 2]) * (a - A[j - 1]) * (a - A[j + 1])
+        A2 = A2 / (A2D1 * A2D2 * A2D3)
+        A3 = (a - A[j - 2]) * (a - A[j - 1]) * (a - A[j])
+        A3 = A3 / (A3D1 * A3D2 * A3D3)
+
+        bb[four_point] = A0 * B[j - 2] + A1 * B[j - 1] + A2 * B[j] + A3 * B[j + 1]
+
+    return bb
+
+def tips2021(M, I, T):
+    """Array-aware version of hapi.PYTIPS2021 that gives identical results.
+
+    Parameters
+    ----------
+    M : int or array
+        HITRAN molecule number(s).
+    I : int or array
+        HITRAN isotopologue number(s).
+    T : float or array
+        temperature(s) (K).  M, I, and T are broadcast against each other, so a temperature grid can be evaluated for one isotopologue or one temperature for many isotopologues.
+
+    Returns
+    -------
+    Q : float or array
+        TIPS2021 partition sum for each (M, I, T).
+
+    """
+    M, I, T = np.broadcast_arrays(np.asarray(M), np.asarray(I), np.asarray(T, dtype = float))
+    Q = np.zeros(T.shape)
+    isotopes = set(zip(M.ravel().tolist(), I.ravel().tolist()))
+    for molec, iso in isotopes:
+        if (molec, iso) not in TIPS_2021_ISOT_HASH:
+            raise Exception("TIPS2021: no data for M,I = %d,%d." % (molec, iso))
+        TT = TIPS_2021_ISOT_HASH[(molec, iso)]
+        select = (M == molec) & (I == iso)
+        temperatures = T[select]
+        # out of temperature range
+        if (temperatures < TT[0]).any() or (temperatures > TT[-1]).any():
+            out_of_range = temperatures[(temperatures < TT[0]) | (temperatures > TT[-1])][0]
+            raise Exception("TIPS2021: T(%.1fK) must be between %.1fK and %.1fK." % (out_of_range, TT[0], TT[-1]))
+        Q[select] = lagrange_interpolation(temperatures, TT, TIPS_2021_ISOQ_HASH[(molec, iso)])
+    return Q[()]
+
 def isotope_list_molecules_isotopes(isotope_list = ISO):
     ''' The HITRAN style isotope list in the format (M,I), this function creates a dictionary from this with M as the keys and lists of I as values.
 
@@ -153,21 +444,81 @@ def arange_(lower,upper,step):
         npnt += 1
     return np.linspace(lower,upper_new,int(npnt))
 
+#Maximum number of slit kernels (and slit grids) kept by slit_kernel
+SLIT_KERNEL_CACHE_SIZE = 64
+#Slit kernels longer than this are convolved with the overlap-add FFT method instead of np.convolve
+DIRECT_CONVOLUTION_SIZE = 64
+#Slit grids with (step, AF_wing) as the key and normalized slit kernels with (SlitFunction, Resolution, step, AF_wing) as the key
+_slit_grids = OrderedDict()
+_slit_kernels = OrderedDict()
+
+def _cache_lookup(cache, key, build):
+    """Returns the cached value for the key, building and adding it (and dropping the least recently used value beyond SLIT_KERNEL_CACHE_SIZE) if it is missing.
+    """
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = build()
+    cache[key] = value
+    if len(cache) > SLIT_KERNEL_CACHE_SIZE:
+        cache.popitem(last = False)
+    return value
+
+def slit_kernel(SlitFunction, Resolution, step, AF_wing):
+    """Returns the normalized slit kernel used by convolveSpectrumSame, which is cached for the last SLIT_KERNEL_CACHE_SIZE (SlitFunction, Resolution, step, AF_wing) combinations.
+
+    The slit grid only depends on the step and AF_wing, so if the resolution is floated only the slit function is re-evaluated.
+
+    Parameters
+    ----------
+    SlitFunction : function
+        slit function, which takes the slit grid and the resolution.
+    Resolution : float or list
+        resolution parameter(s) of the slit function.
+    step : float
+        wavenumber step of the spectrum (cm-1).
+    AF_wing : float
+        half-width of the slit grid (cm-1).
+
+    Returns
+    -------
+    slit : array
+        read-only slit kernel normalized to an area of 1.
+
+    """
+    if isinstance(Resolution, (list, tuple, np.ndarray)):
+        resolution_key = tuple(float(resolution) for resolution in Resolution)
+    else:
+        resolution_key = float(Resolution)
+    def build_kernel():
+        x = _cache_lookup(_slit_grids, (step, AF_wing), lambda: arange_(-AF_wing,AF_wing+step,step)) # fix
+        slit = SlitFunction(x,Resolution)
+        slit /= sum(slit)*step # simple normalization
+        slit.flags.writeable = False
+        return slit
+    return _cache_lookup(_slit_kernels, (SlitFunction, resolution_key, step, AF_wing), build_kernel)
+
 def convolveSpectrumSame(Omega,CrossSection,Resolution=0.1,AF_wing=10.,
                          SlitFunction=SLIT_RECTANGULAR,Wavenumber=None):
     """
     Convolves cross section with a slit function with given parameters.
     Originally from HAPI 1.1.0.9.6 with correction to arange_ to prevent float/int error
+
+    The slit kernel is cached (see slit_kernel), and kernels longer than DIRECT_CONVOLUTION_SIZE points are convolved with the overlap-add FFT method, which gives the same result as np.convolve within rounding error.
     """
     # compatibility with older versions
     if Wavenumber: Omega=Wavenumber
     step = Omega[1]-Omega[0]
     if step>=Resolution: raise Exception('step must be less than resolution')
-    #x = arange(-AF_wing,AF_wing+step,step)
-    x = arange_(-AF_wing,AF_wing+step,step) # fix
-    slit = SlitFunction(x,Resolution)
-    slit /= sum(slit)*step # simple normalization
+    slit = slit_kernel(SlitFunction, Resolution, step, AF_wing)
     left_bnd = 0
     right_bnd = len(Omega)
-    CrossSectionLowRes = np.convolve(CrossSection,slit,mode='same')*step
+    if len(slit) <= DIRECT_CONVOLUTION_SIZE:
+        CrossSectionLowRes = np.convolve(CrossSection,slit,mode='same')*step
+    else:
+        #Central max(N, K) points of the full convolution, as in np.convolve mode='same'
+        full = oaconvolve(np.asarray(CrossSection, dtype = float), slit, mode = 'full')
+        n_same = max(len(CrossSection), len(slit))
+        start = (len(full) - n_same) // 2
+        CrossSectionLowRes = full[start: start + n_same]*step
     return Omega[left_bnd:right_bnd],CrossSectionLowRes[left_bnd:right_bnd],left_bnd,right_bnd,slit
@@ -0,0 +1,51 @@
+"""Micro-benchmark of the complex probability function w(z) used by the line shape engine.
+
+Compares hapi.hum1_wei (which rebuilds the Weideman coefficients on every call) with lineshape.cpf_weideman (cached coefficients and fused kernel) on argument distributions typical of the Voigt and HTP line shapes, and checks that both give the same values.
+
+Usage: python benchmarks/cpf_benchmark.py [number of points]
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from MATS.hapi import hum1_wei
+from MATS.lineshape import cpf_weideman
+
+
+def voigt_arguments(number_of_points, rng):
+    """x = sqrt(ln2)*(nu - nu0)/GammaD over a 25 half-width window and y = sqrt(ln2)*Gamma0/GammaD from Doppler to pressure broadened lines.
+    """
+    y = 10**rng.uniform(-3, 2, number_of_points)
+    x = rng.uniform(-25, 25, number_of_points)*(1 + y)
+    return x, y
+
+def htp_arguments(number_of_points, rng):
+    """Arguments of the two w(z) calls of the HTP, where speed dependence moves z away from the real axis and into the asymptotic region.
+    """
+    x, y = voigt_arguments(number_of_points, rng)
+    return x*rng.uniform(0.5, 2, number_of_points), y + 10**rng.uniform(-1, 1.5, number_of_points)
+
+def run(number_of_points = 100000, repeat = 5):
+    rng = np.random.default_rng(0)
+    print('points: %d' % number_of_points)
+    for name, arguments in [('Voigt', voigt_arguments), ('HTP', htp_arguments)]:
+        x, y = arguments(number_of_points, rng)
+        WR, WI = hum1_wei(x, y)
+        w = cpf_weideman(x, y)
+        max_difference = np.max(np.abs((WR + 1.0j*WI) - w))
+        t_hapi = min(timeit.repeat(lambda: hum1_wei(x, y), number = 1, repeat = repeat))
+        t_cached = min(timeit.repeat(lambda: cpf_weideman(x, y), number = 1, repeat = repeat))
+        print('%-6s hum1_wei %8.2f ms   cpf_weideman %8.2f ms   speed-up %5.2fx   max |difference| %.1e'
+              % (name, 1e3*t_hapi, 1e3*t_cached, t_hapi / t_cached, max_difference))
+    #Many small calls, as for the masked blocks in pcqsdhc
+    x, y = voigt_arguments(200, rng)
+    t_hapi = min(timeit.repeat(lambda: hum1_wei(x, y), number = 200, repeat = repeat)) / 200
+    t_cached = min(timeit.repeat(lambda: cpf_weideman(x, y), number = 200, repeat = repeat)) / 200
+    print('200 points per call: hum1_wei %6.1f us   cpf_weideman %6.1f us   speed-up %5.2fx' % (1e6*t_hapi, 1e6*t_cached, t_hapi / t_cached))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
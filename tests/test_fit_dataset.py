@@ -0,0 +1,163 @@
+import copy
+
+import numpy as np
+import pytest
+
+import MATS
+from MATS.linelistdata import linelistdata
+
+PARAM_LINELIST = linelistdata['O2_ABand_Drouin_2017_linelist']
+
+
+def _fit_dataset(dataset):
+    return MATS.Fit_DataSet(dataset, 'Baseline_LineList', 'Parameter_LineList',
+                            minimum_parameter_fit_intensity = 1e-24, baseline_limit = True)
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    #Generate_FitParam_File writes its tables to the working directory
+    monkeypatch.chdir(tmp_path)
+    np.random.seed(0)
+    spectra = [MATS.simulate_spectrum(PARAM_LINELIST, wave_min = 13155, wave_max = 13158, wave_space = 0.01,
+                                      temperature = 25, pressure = pressure, SNR = 10000, molefraction = {7: 0.002},
+                                      filename = 'spectrum_%d' % number, baseline_terms = [0, 1e-3])
+               for number, pressure in enumerate([500, 975])]
+    dataset = MATS.Dataset(spectra, 'Cache', PARAM_LINELIST)
+    base_linelist = dataset.generate_baseline_paramlist()
+    fitparams = MATS.Generate_FitParam_File(dataset, PARAM_LINELIST, base_linelist, lineprofile = 'SDVP',
+                                            linemixing = False, fit_intensity = 1e-24, threshold_intensity = 1e-30,
+                                            sim_window = 1.5)
+    fitparams.generate_fit_param_linelist_from_linelist(vary_nu = {7: {1: True}}, vary_sw = {7: {1: True}})
+    fitparams.generate_fit_baseline_linelist(vary_baseline = True)
+    return dataset
+
+
+def _set_composition(spectrum):
+    spectrum.set_Diluent({'air': {'composition': 0.3, 'm': 28.95734}})
+
+
+def _edit_composition(spectrum):
+    spectrum.Diluent['air']['composition'] = 0.3
+
+
+def _shift_wavenumber(spectrum):
+    spectrum.wavenumber = spectrum.wavenumber + 0.004
+
+
+@pytest.mark.parametrize('change_spectrum', [_set_composition, _edit_composition, _shift_wavenumber])
+def test_background_follows_spectrum_change(dataset, change_spectrum):
+    fit = _fit_dataset(dataset)
+    params = fit.generate_params()
+    fit.simulation_model(params)
+
+    change_spectrum(dataset.spectra[1])
+    fit.model_cache = None
+    reused = fit.simulation_model(params)
+
+    fresh = _fit_dataset(dataset)
+    expected = fresh.simulation_model(fresh.generate_params())
+    np.testing.assert_allclose(reused, expected, rtol = 0, atol = 1e-12)
+
+
+def test_background_is_kept_for_unchanged_spectra(dataset):
+    fit = _fit_dataset(dataset)
+    params = fit.generate_params()
+    fit.simulation_model(params)
+    backgrounds = {key: entry[-1] for key, entry in fit.background_cache.items()}
+
+    fit.model_cache = None
+    fit.simulation_model(params)
+    assert all(fit.background_cache[key][-1] is background for key, background in backgrounds.items())
+
+
+def _set_weight(spectrum):
+    spectrum.set_weight(0.5)
+
+
+def _shift_alpha(spectrum):
+    spectrum.alpha = spectrum.alpha + 1e-3
+
+
+@pytest.mark.parametrize('change_spectrum', [_set_weight, _shift_alpha, _edit_composition])
+def test_cached_residuals_follow_spectrum_change(dataset, change_spectrum):
+    fit = MATS.Fit_DataSet(dataset, 'Baseline_LineList', 'Parameter_LineList',
+                           minimum_parameter_fit_intensity = 1e-24, baseline_limit = True, weight_spectra = True)
+    params = fit.generate_params()
+    fit.simulation_model(params)
+
+    change_spectrum(dataset.spectra[1])
+    reused = fit.simulation_model(params)
+
+    fresh = MATS.Fit_DataSet(dataset, 'Baseline_LineList', 'Parameter_LineList',
+                             minimum_parameter_fit_intensity = 1e-24, baseline_limit = True, weight_spectra = True)
+    expected = fresh.simulation_model(fresh.generate_params())
+    np.testing.assert_allclose(reused, expected, rtol = 0, atol = 1e-12)
+
+
+def test_simulation_pool_follows_diluent_edit(dataset):
+    fit = MATS.Fit_DataSet(dataset, 'Baseline_LineList', 'Parameter_LineList',
+                           minimum_parameter_fit_intensity = 1e-24, baseline_limit = True, n_workers = 2)
+    try:
+        params = fit.generate_params()
+        fit.simulation_model(params)
+
+        _edit_composition(dataset.spectra[1])
+        fit.background_cache = {}
+        fit.model_cache = None
+        reused = fit.simulation_model(params)
+    finally:
+        fit.close_pool()
+
+    fresh = _fit_dataset(dataset)
+    expected = fresh.simulation_model(fresh.generate_params())
+    np.testing.assert_allclose(reused, expected, rtol = 0, atol = 1e-12)
+
+
+def test_varpro_counts_projection_evaluations(dataset):
+    fit = _fit_dataset(dataset)
+    result = fit.fit_data(fit.generate_params(), method = 'varpro')
+    assert result.varpro_nfev >= 1
+    assert result.nfev > result.varpro_nfev
+
+
+def test_simulation_pool_spawns_workers_without_fork(dataset, monkeypatch):
+    #As on Windows, where the workers are spawned and their arguments are pickled
+    monkeypatch.setattr(MATS.fit_dataset.multiprocessing, 'get_all_start_methods', lambda: ['spawn'])
+    fit = MATS.Fit_DataSet(dataset, 'Baseline_LineList', 'Parameter_LineList',
+                           minimum_parameter_fit_intensity = 1e-24, baseline_limit = True, n_workers = 2)
+    try:
+        residuals = fit.simulation_model(fit.generate_params())
+        assert fit.simulation_pool['executor']._mp_context.get_start_method() == 'spawn'
+    finally:
+        fit.close_pool()
+
+    serial = _fit_dataset(dataset)
+    expected = serial.simulation_model(serial.generate_params())
+    np.testing.assert_allclose(residuals, expected, rtol = 0, atol = 1e-12)
+
+
+def test_line_derivative_stays_within_bounds(dataset, monkeypatch):
+    fit = _fit_dataset(dataset)
+    params = fit.generate_params()
+    name = [param for param in params if param.startswith('nu_line_') and params[param].vary][0]
+    line = int(name[len('nu_line_'):])
+    value = params[name].value
+    params[name].set(min = value)
+
+    stepped = []
+    set_value = MATS.lineshape.LineArrays.set_value
+    def record_value(line_arrays, column, line_label, new_value):
+        if (column == 'nu') and (line_label == line):
+            stepped.append(new_value)
+        set_value(line_arrays, column, line_label, new_value)
+    monkeypatch.setattr(MATS.lineshape.LineArrays, 'set_value', record_value)
+    derivative = fit._jacobian_columns(params, [name], 25, 25, 'wing_cutoff')[:, 0]
+    monkeypatch.undo()
+    assert min(stepped) >= value
+
+    #One-sided (forward) difference at the lower bound
+    reference = fit.simulation_model(params)
+    params[name].set(min = -np.inf, value = value + 1e-6)
+    expected = (fit.simulation_model(params) - reference) / 1e-6
+    np.testing.assert_allclose(derivative, expected, rtol = 0, atol = 1e-6*np.max(np.abs(expected)))
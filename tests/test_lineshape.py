@@ -0,0 +1,60 @@
+from bisect import bisect
+
+import numpy as np
+import pytest
+
+from MATS.hapi import pcqsdhc
+from MATS.lineshape import cross_section_batch
+
+
+def _per_line_cross_section(wavenumbers, nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength, line_cutoff):
+    #The per-line loop that HTP_from_DF_select used before the batch engine
+    xsect = np.zeros(len(wavenumbers))
+    for line in range(len(nu)):
+        lower = bisect(wavenumbers, nu[line] - line_cutoff[line])
+        upper = bisect(wavenumbers, nu[line] + line_cutoff[line])
+        if upper <= lower:
+            continue
+        real, imag = pcqsdhc(nu[line], GammaD[line], Gamma0[line], Gamma2[line], Shift0[line], Shift2[line],
+                             NuVC[line], Eta[line], wavenumbers[lower:upper])
+        xsect[lower:upper] += line_strength[line]*(real + Y[line]*imag)
+    return xsect
+
+
+@pytest.fixture
+def lines():
+    rng = np.random.default_rng(1)
+    n_lines = 12
+    wavenumbers = np.arange(6300.0, 6310.0, 0.002)
+    nu = np.linspace(6300.5, 6309.5, 8*n_lines)
+    GammaD = np.full(len(nu), 0.0065)
+    Gamma0 = rng.uniform(0.005, 0.05, len(nu))
+    zeros = np.zeros(len(nu))
+    #Blocks of lines with the Voigt, Nelkin-Ghatak, speed-dependent Voigt and Nelkin-Ghatak, and correlated (HTP) profiles
+    profiles = np.repeat(np.arange(8), n_lines)
+    Gamma2 = np.where(profiles >= 2, 0.1*Gamma0, zeros)
+    Shift2 = np.where(profiles >= 3, rng.uniform(-2e-4, 2e-4, len(nu)), zeros)
+    NuVC = np.where(profiles % 2 == 1, rng.uniform(0.001, 0.02, len(nu)), zeros)
+    Eta = np.where(profiles >= 6, rng.uniform(0.05, 0.5, len(nu)), zeros)
+    Shift0 = rng.uniform(-0.01, 0.01, len(nu))
+    #Line mixing on every other line
+    Y = np.where(np.arange(len(nu)) % 2 == 0, rng.uniform(-0.01, 0.01, len(nu)), zeros)
+    line_strength = rng.uniform(0.5, 2.0, len(nu))
+    line_cutoff = 25*(0.5346*Gamma0 + (0.2166*Gamma0**2 + GammaD**2)**0.5)
+    #Negative cut-offs, as from a negative width during a fit
+    line_cutoff[::11] *= -1
+    return wavenumbers, nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength, line_cutoff
+
+
+@pytest.mark.parametrize('block_size', [2**12, 257])
+def test_cross_section_batch_matches_per_line_pcqsdhc(lines, block_size):
+    expected = _per_line_cross_section(*lines)
+    xsect = cross_section_batch(*lines, block_size = block_size)
+    np.testing.assert_allclose(xsect, expected, rtol = 1e-12, atol = 1e-12*np.max(np.abs(expected)))
+
+
+def test_cross_section_batch_skips_negative_cutoff_lines(lines):
+    wavenumbers, nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength, line_cutoff = lines
+    line_cutoff = -np.abs(line_cutoff)
+    xsect = cross_section_batch(wavenumbers, nu, GammaD, Gamma0, Gamma2, Shift0, Shift2, NuVC, Eta, Y, line_strength, line_cutoff)
+    assert not xsect.any()
@@ -0,0 +1,85 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from MATS import utilities
+from MATS.utilities import SPECTRUM_CACHE_EXTENSION, read_spectrum_columns
+
+
+def _write_spectrum(filename, alpha, age = 60):
+    #Spectrum csv file that was last modified age seconds ago
+    pd.DataFrame({'Spectrum Name': ['test']*len(alpha), 'Wavenumber (cm-1)': np.linspace(13100, 13101, len(alpha)),
+                  'Alpha': alpha, 'Segment Number': np.arange(len(alpha)) // 2}).to_csv(filename + '.csv', index = False)
+    modified = time.time() - age
+    os.utime(filename + '.csv', (modified, modified))
+
+
+@pytest.fixture
+def spectrum_file(tmp_path):
+    filename = str(tmp_path / 'spectrum')
+    _write_spectrum(filename, [1.25, 2.5, 3.75, 5.0])
+    return filename
+
+
+def test_cache_is_written_and_read(spectrum_file):
+    first = read_spectrum_columns(spectrum_file, ['Alpha'])
+    assert os.path.exists(spectrum_file + SPECTRUM_CACHE_EXTENSION)
+    second = read_spectrum_columns(spectrum_file, ['Alpha'])
+    pd.testing.assert_frame_equal(first, second)
+
+
+@pytest.mark.parametrize('alpha', [[1.25, 2.5, 3.75, 6.0], [1.25, 2.5, 3.75, 6.125]])
+def test_cache_is_rebuilt_after_csv_change(spectrum_file, alpha):
+    read_spectrum_columns(spectrum_file, ['Alpha'])
+    #Same size and a different size of the csv file
+    _write_spectrum(spectrum_file, alpha, age = 30)
+    np.testing.assert_array_equal(read_spectrum_columns(spectrum_file, ['Alpha'])['Alpha'].values, alpha)
+    np.testing.assert_array_equal(read_spectrum_columns(spectrum_file, ['Alpha'])['Alpha'].values, alpha)
+
+
+def test_recent_csv_is_not_cached(spectrum_file):
+    #A csv file could be rewritten within the timestamp resolution of its file system without changing its modification time
+    _write_spectrum(spectrum_file, [1.25, 2.5, 3.75, 6.0], age = 0)
+    read_spectrum_columns(spectrum_file, ['Alpha'])
+    assert not os.path.exists(spectrum_file + SPECTRUM_CACHE_EXTENSION)
+
+
+def test_corrupt_cache_is_rebuilt(spectrum_file):
+    with open(spectrum_file + SPECTRUM_CACHE_EXTENSION, 'wb') as cache:
+        cache.write(b'not an npz file')
+    np.testing.assert_array_equal(read_spectrum_columns(spectrum_file, ['Alpha'])['Alpha'].values, [1.25, 2.5, 3.75, 5.0])
+    with np.load(spectrum_file + SPECTRUM_CACHE_EXTENSION) as cache:
+        assert 'Alpha' in cache['__columns__'].tolist()
+
+
+def test_cache_of_another_csv_is_not_used(spectrum_file, tmp_path):
+    other_file = str(tmp_path / 'other')
+    _write_spectrum(other_file, [9.0, 9.0, 9.0, 9.0])
+    read_spectrum_columns(other_file, ['Alpha'])
+    os.replace(other_file + SPECTRUM_CACHE_EXTENSION, spectrum_file + SPECTRUM_CACHE_EXTENSION)
+    np.testing.assert_array_equal(read_spectrum_columns(spectrum_file, ['Alpha'])['Alpha'].values, [1.25, 2.5, 3.75, 5.0])
+
+
+def test_unwritable_cache_is_skipped(spectrum_file, monkeypatch):
+    def read_only(source, destination):
+        raise PermissionError(destination)
+    monkeypatch.setattr(utilities.os, 'replace', read_only)
+    np.testing.assert_array_equal(read_spectrum_columns(spectrum_file, ['Alpha'])['Alpha'].values, [1.25, 2.5, 3.75, 5.0])
+    assert os.listdir(os.path.dirname(spectrum_file)) == ['spectrum.csv']
+
+
+def test_columns_match_csv(spectrum_file):
+    columns = ['Segment Number', 'Spectrum Name', 'Alpha', 'Wavenumber (cm-1)']
+    expected = pd.read_csv(spectrum_file + '.csv', float_precision = 'high')[columns]
+    #From the csv file and from the cache, with the text column read from the csv file
+    for attempt in range(2):
+        pd.testing.assert_frame_equal(read_spectrum_columns(spectrum_file, columns), expected)
+
+
+def test_missing_column_raises_key_error(spectrum_file):
+    for attempt in range(2):
+        with pytest.raises(KeyError):
+            read_spectrum_columns(spectrum_file, ['Alpha', 'Tau'])